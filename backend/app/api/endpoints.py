@@ -1,17 +1,27 @@
 
 
-import pandas as pd
-import io
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form
+import asyncio
+import time
+from fastapi import UploadFile, File, Depends, HTTPException, Form, Header, Query
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from app.data.database import get_db
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from app.data.database import SessionLocal, get_db
 from app.data.repositories import EnergyRepository
-from app.services.energy_service import EnergyService
-from app.services.chat_service import ChatService
+from app.services.csv_stream import iter_csv_batches
+from app.services.analysis_cache import analysis_cache
+from app.services.job_manager import JOB_ACTIVE_STATES
+from app.services.curve_encoding import (
+    CURVE_MODES, MSGPACK_MEDIA_TYPE, columnar_curve, dumps_json, dumps_msgpack, shape_outliers, wants_msgpack
+)
+from app.core.config import settings
+from app.core.container import ServiceContainer, get_container
+from app.core.metrics import TimedAPIRouter, metrics, stage
 
 # Definimos el Router explícitamente
-router = APIRouter()
+router = TimedAPIRouter()
 
 
 class OutlierRequest(BaseModel):
@@ -30,6 +40,15 @@ class TotalEnergyRequest(BaseModel):
     start_date: str  # formato YYYY-MM-DD
     end_date: str    # formato YYYY-MM-DD
 
+class BatchPeriodRequest(BaseModel):
+    start_date: str  # formato YYYY-MM-DD
+    end_date: str    # formato YYYY-MM-DD
+    device_ids: Optional[List[str]] = None
+    # Filtro geográfico (nombre parcial), alternativo o complementario a device_ids
+    departamento: Optional[str] = None
+    municipio: Optional[str] = None
+    localidad: Optional[str] = None
+
 class DemandGrowthRequest(BaseModel):
     current_period_start: str  # formato YYYY-MM-DD
     current_period_end: str    # formato YYYY-MM-DD
@@ -37,29 +56,217 @@ class DemandGrowthRequest(BaseModel):
     previous_period_end: str   # formato YYYY-MM-DD
     min_growth_percentage: float = 0.0  # porcentaje mínimo de crecimiento
 
+def _encoded_response(payload, accept: Optional[str]) -> Response:
+    """
+    Serializa la respuesta sin jsonable_encoder: JSON (desviaciones infinitas como null) o
+    MessagePack si el cliente envía Accept: application/x-msgpack.
+    """
+    with stage('serialize'):
+        if wants_msgpack(accept):
+            try:
+                return Response(dumps_msgpack(payload), media_type=MSGPACK_MEDIA_TYPE)
+            except RuntimeError as e:
+                raise HTTPException(status_code=406, detail=str(e))
+        return Response(dumps_json(payload), media_type="application/json")
+
+def _check_curves_mode(curves: str, modes=CURVE_MODES):
+    if curves not in modes:
+        raise HTTPException(status_code=400, detail=f"curves debe ser uno de: {', '.join(modes)}")
+
+async def _wait_for_job(container: ServiceContainer, job_id: str, timeout: float):
+    """
+    Espera sin ocupar un hilo a que termine un trabajo y retorna (estado, resultado). Si el trabajo
+    corre en este proceso se espera su future; si no (otro proceso, o reutilizado de la tabla) se
+    consulta su estado con espera creciente. Al vencer `timeout` retorna el estado aún activo.
+    """
+    deadline = time.monotonic() + timeout
+    future = container.jobs.future(job_id)
+    if future is not None:
+        try:
+            # shield: si el cliente se desconecta o vence el plazo, el trabajo sigue (un reintento lo reutiliza)
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+
+    espera = 0.1
+    while True:
+        found = await run_in_threadpool(container.jobs.get_result, job_id)
+        if found is None:
+            raise ValueError(f"Trabajo {job_id} no encontrado")
+        restante = deadline - time.monotonic()
+        if found[0]['status'] not in JOB_ACTIVE_STATES or restante <= 0:
+            return found
+        await asyncio.sleep(min(espera, restante))
+        espera = min(espera * 2, 2.0)
+
 @router.post("/analyze-outliers")
-def analyze_outliers(req: OutlierRequest, db: Session = Depends(get_db)):
-    """Busca medidores con desviaciones mayores al umbral en el rango de fechas dado."""
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+async def analyze_outliers(req: OutlierRequest, curves: str = "records", accept: Optional[str] = Header(None),
+                           container: ServiceContainer = Depends(get_container)):
+    """
+    Busca medidores con desviaciones mayores al umbral en el rango de fechas dado.
+    La búsqueda corre como trabajo en segundo plano; una solicitud repetida con los mismos
+    parámetros espera al mismo trabajo (o reutiliza su resultado reciente) en lugar de recalcular.
+    Si no termina en JOB_WAIT_TIMEOUT_SECONDS responde 202 con el estado del trabajo (job_id).
+
+    curves=records (curvas como lista de puntos), columnar (arreglos de 96 intervalos) o none
+    (solo resúmenes, con curve_url para /curves). Accept: application/x-msgpack para MessagePack.
+    """
+    _check_curves_mode(curves)
     try:
-        resultados = service.find_outlier_devices(
+        job = await run_in_threadpool(
+            container.jobs.submit_outlier_scan,
             base_year=req.base_year,
             start_date=req.start_date,
             end_date=req.end_date,
             threshold=req.threshold
         )
-        return {"outliers": resultados}
+        job, resultados = await _wait_for_job(container, job['job_id'], settings.JOB_WAIT_TIMEOUT_SECONDS)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if job['status'] in JOB_ACTIVE_STATES:
+        # Sigue en curso: el cliente consulta /jobs/{job_id} y después /jobs/{job_id}/result
+        return Response(dumps_json(job), status_code=202, media_type="application/json")
+    if job['status'] != 'completado':
+        raise HTTPException(status_code=400, detail=job['error'] or f"La búsqueda de anomalías terminó con estado {job['status']}")
+    return _encoded_response({"outliers": shape_outliers(resultados, curves, req.base_year)}, accept)
+
+@router.post("/analyze-outliers/stream")
+def analyze_outliers_stream(req: OutlierRequest, format: str = "ndjson", curves: str = "records",
+                            container: ServiceContainer = Depends(get_container)):
+    """
+    Variante en streaming de /analyze-outliers: envía cada día-medidor anómalo en cuanto se detecta
+    (sin acumular la respuesta completa) como JSON por línea (format=ndjson) o eventos SSE (format=sse).
+
+    Frames: start (total de medidores), outlier (un resultado), progress (tras cada bloque de medidores),
+    done o error. `curves` como en /analyze-outliers.
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format debe ser 'ndjson' o 'sse'")
+    _check_curves_mode(curves)
+
+    def frame(tipo: str, payload: dict) -> str:
+        if format == "sse":
+            return f"event: {tipo}\ndata: {dumps_json(payload)}\n\n"
+        return dumps_json({"type": tipo, **payload}) + "\n"
+
+    def generate():
+        # Sesión propia: el streaming continúa después de que el endpoint retorna
+        db = SessionLocal()
+        inicio = time.perf_counter()
+        anomalias = procesados = 0
+        try:
+            service = container.energy_service(db)
+            for procesados, total, resultados in service.iter_outlier_devices(
+                    base_year=req.base_year,
+                    start_date=req.start_date,
+                    end_date=req.end_date,
+                    threshold=req.threshold):
+                if procesados == 0:
+                    yield frame("start", {"total": total, "params": req.model_dump()})
+                    continue
+                for resultado in shape_outliers(resultados, curves, req.base_year):
+                    anomalias += 1
+                    yield frame("outlier", {"data": resultado})
+                yield frame("progress", {
+                    "processed": procesados,
+                    "total": total,
+                    "anomalies": anomalias,
+                    "elapsed_seconds": round(time.perf_counter() - inicio, 3)
+                })
+            yield frame("done", {
+                "processed": procesados,
+                "anomalies": anomalias,
+                "elapsed_seconds": round(time.perf_counter() - inicio, 3)
+            })
+        except Exception as e:
+            yield frame("error", {"detail": str(e)})
+        finally:
+            db.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/jobs/outliers", status_code=202)
+def submit_outliers_job(req: OutlierRequest, container: ServiceContainer = Depends(get_container)):
+    """Encola una búsqueda de anomalías en segundo plano y retorna el trabajo para consultar su progreso."""
+    try:
+        return container.jobs.submit_outlier_scan(
+            base_year=req.base_year,
+            start_date=req.start_date,
+            end_date=req.end_date,
+            threshold=req.threshold
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error encolando el trabajo: {str(e)}")
+
+@router.get("/jobs")
+def list_jobs(limit: int = 50, container: ServiceContainer = Depends(get_container)):
+    """Trabajos en segundo plano más recientes."""
+    return {"jobs": container.jobs.list_recent(limit)}
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, container: ServiceContainer = Depends(get_container)):
+    """Estado y progreso de un trabajo (medidores procesados / total y anomalías encontradas)."""
+    job = container.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, curves: str = "records", accept: Optional[str] = Header(None),
+                   container: ServiceContainer = Depends(get_container)):
+    """Resultado persistido de un trabajo terminado (`curves` y Accept como en /analyze-outliers)."""
+    _check_curves_mode(curves)
+    found = container.jobs.get_result(job_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    job, resultados = found
+    if job['status'] != 'completado':
+        raise HTTPException(status_code=409, detail=f"El trabajo {job_id} no tiene resultado (estado: {job['status']})")
+    return _encoded_response({"job": job, "outliers": shape_outliers(resultados, curves, job['params']['base_year'])}, accept)
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, container: ServiceContainer = Depends(get_container)):
+    """Cancela un trabajo pendiente o en curso (se detiene al terminar el bloque de medidores actual)."""
+    job = container.jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo {job_id} no encontrado")
+    return job
+
+@router.get("/curves/{device_id}/{fecha}")
+def get_outlier_curve(device_id: str, fecha: str, base_year: int, curves: str = "columnar",
+                      accept: Optional[str] = Header(None), db: Session = Depends(get_db),
+                      container: ServiceContainer = Depends(get_container)):
+    """
+    Curva real vs esperada de un día-medidor (fecha YYYY-MM-DD), con su desviación y estado,
+    para cargar bajo demanda las curvas de los resultados pedidos con curves=none.
+    curves=columnar (por defecto) o records; Accept: application/x-msgpack para MessagePack.
+    """
+    _check_curves_mode(curves, ('records', 'columnar'))
+    service = container.energy_service(db)
+    try:
+        curva = service.get_outlier_curve(device_id, fecha, base_year)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if curves == 'columnar':
+        curva['chart_data'] = columnar_curve(curva['chart_data'])
+    return _encoded_response(curva, accept)
 
 @router.post("/max-power")
-def get_max_power(req: MaxPowerRequest, db: Session = Depends(get_db)):
+def get_max_power(req: MaxPowerRequest, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
     """Obtiene la máxima potencia (kW) de un medidor en un periodo específico."""
     repo = EnergyRepository(db)
     try:
         # Validar que el medidor existe
-        if not repo.validate_device_id(req.device_id):
+        if not container.registry.exists(req.device_id):
             raise HTTPException(status_code=404, detail=f"Medidor {req.device_id} no encontrado")
         
         result = repo.get_max_power_in_period(
@@ -78,12 +285,12 @@ def get_max_power(req: MaxPowerRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/total-energy")
-def get_total_energy(req: TotalEnergyRequest, db: Session = Depends(get_db)):
+def get_total_energy(req: TotalEnergyRequest, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
     """Obtiene la energía total consumida (kWh) de un medidor en un periodo específico."""
     repo = EnergyRepository(db)
     try:
         # Validar que el medidor existe
-        if not repo.validate_device_id(req.device_id):
+        if not container.registry.exists(req.device_id):
             raise HTTPException(status_code=404, detail=f"Medidor {req.device_id} no encontrado")
         
         result = repo.get_total_energy_in_period(
@@ -101,19 +308,55 @@ def get_total_energy(req: TotalEnergyRequest, db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def _period_summary_batch(req: BatchPeriodRequest, db: Session):
+    """Resumen por medidor (energía, lecturas, potencia promedio y máxima) para los endpoints batch."""
+    if not (req.device_ids or req.departamento or req.municipio or req.localidad):
+        raise HTTPException(status_code=400, detail="Debe indicar device_ids o un filtro geográfico (departamento, municipio o localidad)")
+
+    repo = EnergyRepository(db)
+    results = repo.get_period_summary_batch(
+        start_date=req.start_date,
+        end_date=req.end_date,
+        device_ids=req.device_ids,
+        departamento=req.departamento,
+        municipio=req.municipio,
+        localidad=req.localidad
+    )
+    found = {r['device_id'] for r in results}
+    missing = [d for d in (req.device_ids or []) if d not in found]
+    return results, missing
+
+@router.post("/max-power/batch")
+def get_max_power_batch(req: BatchPeriodRequest, db: Session = Depends(get_db)):
+    """Obtiene la máxima potencia (kW) de varios medidores en un periodo, en una sola consulta."""
+    try:
+        results, missing = _period_summary_batch(req, db)
+        return {"max_power_data": results, "count": len(results), "devices_without_data": missing}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/total-energy/batch")
+def get_total_energy_batch(req: BatchPeriodRequest, db: Session = Depends(get_db)):
+    """Obtiene la energía total (kWh) de varios medidores en un periodo, en una sola consulta."""
+    try:
+        results, missing = _period_summary_batch(req, db)
+        return {"total_energy_data": results, "count": len(results), "devices_without_data": missing}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # --- Esquema para el chatbot ---
 class ChatRequest(BaseModel):
     message: str
     context: dict = None
+    session_id: Optional[str] = None  # Id de la conversación (lo asigna el servidor en la primera respuesta)
 # --- Endpoint de Chatbot ---
 @router.post("/chat")
-def chat_with_bot(req: ChatRequest, db: Session = Depends(get_db)):
+async def chat_with_bot(req: ChatRequest, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
     try:
-        # Crear instancias con dependencia de base de datos
-        repo = EnergyRepository(db)
-        energy_service = EnergyService(repo)
-        chat_service = ChatService(energy_service)
-        
         # Limitar longitud del mensaje para evitar bloqueos
         if len(req.message) > 1000:
             return {
@@ -121,8 +364,18 @@ def chat_with_bot(req: ChatRequest, db: Session = Depends(get_db)):
                 "parameters": None,
                 "type": "error"
             }
-        
-        result = chat_service.ask_gemini(req.message, req.context)
+
+        # Estado de la conversación: confirmación pendiente, última consulta y última lista mostrada
+        repo = EnergyRepository(db)
+        session_id = (req.session_id or "")[:64] or container.chat_sessions.new_id()
+        session = await run_in_threadpool(container.chat_sessions.get, session_id, repo)
+
+        # Crear instancias con dependencia de base de datos
+        chat_service = container.chat_service(db, session=session)
+        result = await chat_service.ask_gemini_async(req.message, req.context)
+
+        await run_in_threadpool(container.chat_sessions.put, session_id, session, repo)
+        result["session_id"] = session_id
         return result
     except Exception as e:
         error_msg = str(e)
@@ -154,77 +407,57 @@ class AnalysisReq(BaseModel):
 # --- Rutas (Usando @router) ---
 
 @router.post("/upload/{device_id}")
-async def upload_readings(
+def upload_readings(
     device_id: str, 
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    container: ServiceContainer = Depends(get_container)
 ):
     try:
-        content = await file.read()
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-        
-        repo = EnergyRepository(db)
-        service = EnergyService(repo)
-        
-        return service.process_csv_upload(df, device_id)
+        service = container.energy_service(db)
+
+        batches = iter_csv_batches(file.file, required=('timestamp', 'value'))
+        return service.process_csv_batches(batches, device_id)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/years-from-csv")
-async def get_years_from_csv(file: UploadFile = File(...)):
+def get_years_from_csv(file: UploadFile = File(...), container: ServiceContainer = Depends(get_container)):
     """Extrae los años únicos de un archivo CSV de lecturas."""
     try:
-        service = EnergyService(None) # No se necesita repo para esta operación
-        content = await file.read()
-        df = pd.read_csv(io.StringIO(content.decode('utf-8')))
-        return service.get_years_from_dataframe(df)
+        service = container.energy_service(None) # No se necesita repo para esta operación
+        return service.get_years_from_batches(iter_csv_batches(file.file, columns=('timestamp',)))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error al procesar el archivo: {e}")
 
 @router.get("/years/{device_id}")
-def get_available_years(device_id: str, db: Session = Depends(get_db)):
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+def get_available_years(device_id: str, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
+    service = container.energy_service(db)
     service.validate_device(device_id)
-    return {"years": repo.get_available_years(device_id)}
+    return {"years": service.repo.get_available_years(device_id)}
 
 @router.get("/devices")
-def get_available_devices(db: Session = Depends(get_db)):
+def get_available_devices(db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
     """Obtiene lista de medidores disponibles."""
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+    service = container.energy_service(db)
     return {"devices": service.get_available_devices()}
 
 @router.get("/available-data")
 def get_available_data_summary(db: Session = Depends(get_db)):
     """Obtiene un resumen de medidores y periodos con datos disponibles."""
-    from sqlalchemy import text
     try:
-        # Obtener medidores con datos usando SQL nativo
-        query = text("""
-        SELECT DISTINCT m.deviceid, m.description, 
-               MIN(DATE(ml.fecha)) as fecha_min, 
-               MAX(DATE(ml.fecha)) as fecha_max,
-               COUNT(ml.fecha) as total_lecturas
-        FROM public.medidor m 
-        JOIN public.m_lecturas ml ON m.deviceid = ml.deviceid 
-        GROUP BY m.deviceid, m.description 
-        ORDER BY total_lecturas DESC 
-        LIMIT 10
-        """)
-        
-        result = db.execute(query)
+        repo = EnergyRepository(db)
         devices_data = []
-        
-        for row in result:
+
+        for row in repo.get_available_data_summary(limit=10):
             devices_data.append({
-                'deviceid': row[0],
-                'description': row[1] if row[1] else 'Sin descripción', 
-                'fecha_min': str(row[2]) if row[2] else 'N/A',
-                'fecha_max': str(row[3]) if row[3] else 'N/A',
-                'total_lecturas': row[4] if row[4] else 0
+                'deviceid': row['deviceid'],
+                'description': row['description'] if row['description'] else 'Sin descripción',
+                'fecha_min': str(row['fecha_min']) if row['fecha_min'] else 'N/A',
+                'fecha_max': str(row['fecha_max']) if row['fecha_max'] else 'N/A',
+                'total_lecturas': row['total_lecturas'] if row['total_lecturas'] else 0
             })
-        
+
         return {
             "available_devices": devices_data,
             "total_devices": len(devices_data),
@@ -234,35 +467,74 @@ def get_available_data_summary(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error obteniendo datos: {str(e)}")
 
+@router.get("/analysis-cache/stats")
+def get_analysis_cache_stats(db: Session = Depends(get_db)):
+    """Contadores de la caché de análisis de Gemini (memoria) y análisis vigentes en la tabla."""
+    repo = EnergyRepository(db)
+    try:
+        return {
+            **analysis_cache.stats(),
+            "persisted_entries": repo.count_cached_analyses()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error obteniendo estadísticas de caché: {str(e)}")
+
+@router.get("/intent-cache/stats")
+def get_intent_cache_stats(container: ServiceContainer = Depends(get_container)):
+    """Contadores de la caché del análisis de consultas del chat (aciertos, vencimientos, invalidaciones)."""
+    return container.intent_cache.stats()
+
+@router.get("/metrics")
+def get_metrics():
+    """Métricas en formato de texto de Prometheus: solicitudes y duración de cada etapa por endpoint."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/events/stats")
+def get_event_bus_stats(container: ServiceContainer = Depends(get_container)):
+    """Entrega de eventos a los observadores: cola, descartes, lotes y latencia por sink."""
+    return container.event_bus.stats()
+
+@router.get("/chat/sessions/stats")
+def get_chat_session_stats(container: ServiceContainer = Depends(get_container)):
+    """Contadores de las sesiones del chat en memoria (aciertos, vencimientos, desalojos)."""
+    return container.chat_sessions.stats()
+
+@router.delete("/chat/sessions/{session_id}")
+def delete_chat_session(session_id: str, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
+    """Olvida el estado de una conversación (p. ej. al iniciar un chat nuevo en el cliente)."""
+    existia = container.chat_sessions.delete(session_id, EnergyRepository(db))
+    return {"session_id": session_id, "deleted": existia}
+
 @router.get("/devices/{device_id}")
-def get_device_info(device_id: str, db: Session = Depends(get_db)):
+def get_device_info(device_id: str, container: ServiceContainer = Depends(get_container)):
     """Obtiene información de un medidor específico."""
-    repo = EnergyRepository(db)
-    medidor = repo.get_medidor(device_id)
+    registry = container.registry
+    medidor = registry.get(device_id)
     if not medidor:
         raise HTTPException(status_code=404, detail=f"Medidor {device_id} no encontrado")
     
     # Incluir información de localidad si existe
+    localidad, municipio, departamento = registry.location(medidor)
     localidad_info = None
-    if medidor.localidad:
+    if localidad:
         municipio_info = None
-        if medidor.localidad.municipio:
+        if municipio:
             departamento_info = None
-            if medidor.localidad.municipio.departamento:
+            if departamento:
                 departamento_info = {
-                    "id_dep": medidor.localidad.municipio.departamento.id_dep,
-                    "departamento": medidor.localidad.municipio.departamento.departamento
+                    "id_dep": departamento.id_dep,
+                    "departamento": departamento.departamento
                 }
             municipio_info = {
-                "id_mun": medidor.localidad.municipio.id_mun,
-                "municipio": medidor.localidad.municipio.municipio,
+                "id_mun": municipio.id_mun,
+                "municipio": municipio.municipio,
                 "departamento": departamento_info
             }
         localidad_info = {
-            "id_loc": medidor.localidad.id_loc,
-            "localidad": medidor.localidad.localidad,
-            "latitud": medidor.localidad.latitud,
-            "longitud": medidor.localidad.longitud,
+            "id_loc": localidad.id_loc,
+            "localidad": localidad.localidad,
+            "latitud": localidad.latitud,
+            "longitud": localidad.longitud,
             "municipio": municipio_info
         }
     
@@ -278,118 +550,116 @@ def get_device_info(device_id: str, db: Session = Depends(get_db)):
         "localidad": localidad_info
     }
 
+@router.get("/registry/stats")
+def get_registry_stats(container: ServiceContainer = Depends(get_container)):
+    """Estado del registro en memoria de medidores y geografía."""
+    return container.registry.stats()
+
+@router.post("/registry/refresh")
+def refresh_registry(container: ServiceContainer = Depends(get_container)):
+    """Recarga de inmediato el registro de medidores y geografía (tras cambios en la base de datos)."""
+    try:
+        container.registry.refresh()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error recargando el registro de medidores: {str(e)}")
+    return container.registry.stats()
+
 # --- Endpoints para Localidades ---
 
+def _localidad_item(registry, l) -> dict:
+    municipio = registry.municipio(l.id_mun)
+    return {
+        "id_loc": l.id_loc,
+        "localidad": l.localidad,
+        "id_mun": l.id_mun,
+        "municipio": municipio.municipio if municipio else None,
+        "latitud": l.latitud,
+        "longitud": l.longitud
+    }
+
 @router.get("/localidades")
-def get_localidades(db: Session = Depends(get_db)):
+def get_localidades(container: ServiceContainer = Depends(get_container)):
     """Obtiene todas las localidades."""
-    repo = EnergyRepository(db)
-    localidades = repo.get_all_localidades()
+    registry = container.registry
     return {
-        "localidades": [
-            {
-                "id_loc": l.id_loc,
-                "localidad": l.localidad,
-                "id_mun": l.id_mun,
-                "municipio": l.municipio.municipio if l.municipio else None,
-                "latitud": l.latitud,
-                "longitud": l.longitud
-            }
-            for l in localidades
-        ]
+        "localidades": [_localidad_item(registry, l) for l in registry.localidades()]
     }
 
 @router.get("/localidades/search/{localidad_name}")
-def search_localidades(localidad_name: str, db: Session = Depends(get_db)):
-    """Busca localidades por nombre."""
-    repo = EnergyRepository(db)
-    localidades = repo.search_localidades_by_name(localidad_name)
+def search_localidades(localidad_name: str, container: ServiceContainer = Depends(get_container)):
+    """Busca localidades por nombre (sin distinguir tildes ni mayúsculas, las más relevantes primero)."""
+    registry = container.registry
+    localidades = [hit.record for hit in registry.search_index().search_places(localidad_name, 'localidad')]
     return {
-        "localidades": [
-            {
-                "id_loc": l.id_loc,
-                "localidad": l.localidad,
-                "id_mun": l.id_mun,
-                "municipio": l.municipio.municipio if l.municipio else None,
-                "latitud": l.latitud,
-                "longitud": l.longitud
-            }
-            for l in localidades
-        ],
+        "localidades": [_localidad_item(registry, l) for l in localidades],
         "count": len(localidades)
     }
 
 @router.get("/localidades/{localidad_name}/medidores")
-def get_medidores_by_localidad(localidad_name: str, db: Session = Depends(get_db)):
+def get_medidores_by_localidad(localidad_name: str, container: ServiceContainer = Depends(get_container)):
     """Obtiene todos los medidores de una localidad."""
-    repo = EnergyRepository(db)
-    medidores = repo.get_medidores_by_localidad(localidad_name)
+    registry = container.registry
+    medidores = registry.medidores_by_localidad(localidad_name)
     return {
         "medidores": [
             {
                 "deviceid": m.deviceid,
                 "description": m.description,
                 "devicetype": m.devicetype,
-                "localidad": m.localidad.localidad if m.localidad else None,
+                "localidad": localidad.localidad if localidad else None,
                 "id_loc": m.id_loc
             }
             for m in medidores
+            for localidad in [registry.localidad(m.id_loc)]
         ],
         "count": len(medidores)
     }
 
 # --- Endpoints para Municipios ---
 
+def _municipio_item(registry, m) -> dict:
+    departamento = registry.departamento(m.id_dep)
+    return {
+        "id_mun": m.id_mun,
+        "municipio": m.municipio,
+        "id_dep": m.id_dep,
+        "departamento": departamento.departamento if departamento else None
+    }
+
 @router.get("/municipios")
-def get_municipios(db: Session = Depends(get_db)):
+def get_municipios(container: ServiceContainer = Depends(get_container)):
     """Obtiene todos los municipios."""
-    repo = EnergyRepository(db)
-    municipios = repo.get_all_municipios()
+    registry = container.registry
     return {
-        "municipios": [
-            {
-                "id_mun": m.id_mun,
-                "municipio": m.municipio,
-                "id_dep": m.id_dep,
-                "departamento": m.departamento.departamento if m.departamento else None
-            }
-            for m in municipios
-        ]
+        "municipios": [_municipio_item(registry, m) for m in registry.municipios()]
     }
 
 @router.get("/municipios/search/{municipio_name}")
-def search_municipios(municipio_name: str, db: Session = Depends(get_db)):
-    """Busca municipios por nombre."""
-    repo = EnergyRepository(db)
-    municipios = repo.search_municipios_by_name(municipio_name)
+def search_municipios(municipio_name: str, container: ServiceContainer = Depends(get_container)):
+    """Busca municipios por nombre (sin distinguir tildes ni mayúsculas, los más relevantes primero)."""
+    registry = container.registry
+    municipios = [hit.record for hit in registry.search_index().search_places(municipio_name, 'municipio')]
     return {
-        "municipios": [
-            {
-                "id_mun": m.id_mun,
-                "municipio": m.municipio,
-                "id_dep": m.id_dep,
-                "departamento": m.departamento.departamento if m.departamento else None
-            }
-            for m in municipios
-        ],
+        "municipios": [_municipio_item(registry, m) for m in municipios],
         "count": len(municipios)
     }
 
 @router.get("/municipios/{municipio_name}/medidores")
-def get_medidores_by_municipio(municipio_name: str, db: Session = Depends(get_db)):
+def get_medidores_by_municipio(municipio_name: str, container: ServiceContainer = Depends(get_container)):
     """Obtiene todos los medidores de un municipio."""
-    repo = EnergyRepository(db)
-    medidores = repo.get_medidores_by_municipio(municipio_name)
+    registry = container.registry
+    medidores = registry.medidores_by_municipio(municipio_name)
     return {
         "medidores": [
             {
                 "deviceid": m.deviceid,
                 "description": m.description,
                 "devicetype": m.devicetype,
-                "localidad": m.localidad.localidad if m.localidad else None,
-                "municipio": m.localidad.municipio.municipio if m.localidad and m.localidad.municipio else None
+                "localidad": localidad.localidad if localidad else None,
+                "municipio": municipio.municipio if municipio else None
             }
             for m in medidores
+            for localidad, municipio, _ in [registry.location(m)]
         ],
         "count": len(medidores)
     }
@@ -397,36 +667,35 @@ def get_medidores_by_municipio(municipio_name: str, db: Session = Depends(get_db
 # --- Endpoints para Departamentos ---
 
 @router.get("/departamentos")
-def get_departamentos(db: Session = Depends(get_db)):
+def get_departamentos(container: ServiceContainer = Depends(get_container)):
     """Obtiene todos los departamentos."""
-    repo = EnergyRepository(db)
-    departamentos = repo.get_all_departamentos()
     return {
         "departamentos": [
             {
                 "id_dep": d.id_dep,
                 "departamento": d.departamento
             }
-            for d in departamentos
+            for d in container.registry.departamentos()
         ]
     }
 
 @router.get("/departamentos/{departamento_name}/medidores")
-def get_medidores_by_departamento(departamento_name: str, db: Session = Depends(get_db)):
+def get_medidores_by_departamento(departamento_name: str, container: ServiceContainer = Depends(get_container)):
     """Obtiene todos los medidores de un departamento."""
-    repo = EnergyRepository(db)
-    medidores = repo.get_medidores_by_departamento(departamento_name)
+    registry = container.registry
+    medidores = registry.medidores_by_departamento(departamento_name)
     return {
         "medidores": [
             {
                 "deviceid": m.deviceid,
                 "description": m.description,
                 "devicetype": m.devicetype,
-                "localidad": m.localidad.localidad if m.localidad else None,
-                "municipio": m.localidad.municipio.municipio if m.localidad and m.localidad.municipio else None,
-                "departamento": m.localidad.municipio.departamento.departamento if m.localidad and m.localidad.municipio and m.localidad.municipio.departamento else None
+                "localidad": localidad.localidad if localidad else None,
+                "municipio": municipio.municipio if municipio else None,
+                "departamento": departamento.departamento if departamento else None
             }
             for m in medidores
+            for localidad, municipio, departamento in [registry.location(m)]
         ],
         "count": len(medidores)
     }
@@ -434,7 +703,8 @@ def get_medidores_by_departamento(departamento_name: str, db: Session = Depends(
 # --- Endpoint de búsqueda general ---
 
 @router.get("/search/medidores/{search_term}")
-def search_medidores(search_term: str, db: Session = Depends(get_db)):
+def search_medidores(search_term: str, limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0),
+                     container: ServiceContainer = Depends(get_container)):
     """
     Búsqueda flexible de medidores por:
     - Device ID
@@ -442,9 +712,13 @@ def search_medidores(search_term: str, db: Session = Depends(get_db)):
     - Nombre de localidad
     - Nombre de municipio
     - Nombre de departamento
+
+    Sin distinguir tildes ni mayúsculas, con coincidencias aproximadas si no hay exactas. Los
+    resultados vienen ordenados por relevancia (score de 0 a 1, campo que coincidió en match) y
+    paginados con limit/offset; total es el número de medidores que coinciden.
     """
-    repo = EnergyRepository(db)
-    medidores = repo.search_medidores(search_term)
+    registry = container.registry
+    encontrados = registry.search(search_term, limit=limit, offset=offset)
     return {
         "medidores": [
             {
@@ -452,35 +726,46 @@ def search_medidores(search_term: str, db: Session = Depends(get_db)):
                 "description": m.description,
                 "devicetype": m.devicetype,
                 "customerid": m.customerid,
-                "localidad": m.localidad.localidad if m.localidad else None,
-                "municipio": m.localidad.municipio.municipio if m.localidad and m.localidad.municipio else None,
-                "departamento": m.localidad.municipio.departamento.departamento if m.localidad and m.localidad.municipio and m.localidad.municipio.departamento else None,
-                "id_loc": m.id_loc
+                "localidad": localidad.localidad if localidad else None,
+                "municipio": municipio.municipio if municipio else None,
+                "departamento": departamento.departamento if departamento else None,
+                "id_loc": m.id_loc,
+                "score": hit.score,
+                "match": hit.match
             }
-            for m in medidores
+            for hit in encontrados.hits
+            for m in [hit.medidor]
+            for localidad, municipio, departamento in [registry.location(m)]
         ],
-        "count": len(medidores),
+        "count": len(encontrados.hits),
+        "total": encontrados.total,
+        "limit": limit,
+        "offset": offset,
         "search_term": search_term
     }
 
 @router.post("/analyze")
-def analyze_energy(req: AnalysisReq, db: Session = Depends(get_db)):
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+async def analyze_energy(req: AnalysisReq, curves: str = "records", accept: Optional[str] = Header(None),
+                         db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
+    """Analiza un día de un medidor contra su curva base (curves=records o columnar para chart_data)."""
+    _check_curves_mode(curves, ('records', 'columnar'))
+    service = container.energy_service(db)
     try:
-        return service.analyze_day(
+        result = await service.analyze_day_async(
             req.device_id,
             req.target_date,
             req.base_year
         )
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if curves == 'columnar':
+        result['chart_data'] = columnar_curve(result['chart_data'])
+    return _encoded_response(result, accept)
 
 @router.post("/demand-growth")
-def analyze_demand_growth(req: DemandGrowthRequest, db: Session = Depends(get_db)):
+def analyze_demand_growth(req: DemandGrowthRequest, db: Session = Depends(get_db), container: ServiceContainer = Depends(get_container)):
     """Analiza el crecimiento de demanda entre dos periodos comparables."""
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+    service = container.energy_service(db)
     try:
         resultados = service.analyze_demand_growth(
             current_period_start=req.current_period_start,
@@ -499,20 +784,19 @@ async def analyze_energy_with_file(
     device_id: str = Form(...),
     base_year: int = Form(...),
     target_date: str = Form(...),
-    base_file: UploadFile = File(...)
+    base_file: UploadFile = File(...),
+    container: ServiceContainer = Depends(get_container)
 ):
     """Ejecuta el análisis usando un archivo CSV como base histórica."""
-    repo = EnergyRepository(db)
-    service = EnergyService(repo)
+    service = container.energy_service(db)
     try:
-        content = await base_file.read()
-        base_df = pd.read_csv(io.StringIO(content.decode('utf-8')))
+        batches = iter_csv_batches(base_file.file, columns=('timestamp', 'value'), required=('timestamp', 'value'))
 
-        return service.analyze_day_with_df(
+        return await service.analyze_day_with_batches_async(
             device_id=device_id,
             target_date_str=target_date,
             base_year=base_year,
-            base_df=base_df
+            batches=batches
         )
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -23,4 +23,62 @@ class Settings:
     # Environment
     ENVIRONMENT: str = os.getenv("ENVIRONMENT", "development")
 
+    # Carga masiva de lecturas (filas por lote de COPY / INSERT ... ON CONFLICT)
+    INGEST_BATCH_SIZE: int = int(os.getenv("INGEST_BATCH_SIZE", "50000"))
+
+    # Lectura de CSV por bloques (filas por bloque)
+    CSV_CHUNK_ROWS: int = int(os.getenv("CSV_CHUNK_ROWS", "100000"))
+
+    # Particionamiento de m_lecturas por rango de fecha ("month" o "year")
+    LECTURAS_PARTITION_INTERVAL: str = os.getenv("LECTURAS_PARTITION_INTERVAL", "month")
+    LECTURAS_PARTITION_MONTHS_AHEAD: int = int(os.getenv("LECTURAS_PARTITION_MONTHS_AHEAD", "3"))
+    # Convertir al iniciar una tabla m_lecturas existente sin particionar
+    LECTURAS_PARTITION_MIGRATE: bool = os.getenv("LECTURAS_PARTITION_MIGRATE", "false").lower() == "true"
+
+    # Caché de análisis de Gemini (entradas en memoria y vigencia en segundos, también en m_analisis_cache)
+    ANALYSIS_CACHE_SIZE: int = int(os.getenv("ANALYSIS_CACHE_SIZE", "512"))
+    ANALYSIS_CACHE_TTL_SECONDS: int = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+    # Llamadas async a Gemini: máximo simultáneas y plazo por llamada (segundos)
+    GEMINI_MAX_CONCURRENCY: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+    GEMINI_TIMEOUT_SECONDS: float = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+
+    # Trabajos en segundo plano: hilos de trabajo, medidores por bloque de la búsqueda de anomalías
+    # y segundos durante los que un resultado terminado se reutiliza para los mismos parámetros
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_SCAN_CHUNK_DEVICES: int = int(os.getenv("JOB_SCAN_CHUNK_DEVICES", "200"))
+    JOB_RESULT_REUSE_SECONDS: int = int(os.getenv("JOB_RESULT_REUSE_SECONDS", "600"))
+    # Segundos que /analyze-outliers espera el trabajo antes de responder 202 con su job_id: pocos,
+    # para que la solicitud no quede abierta hasta el timeout del proxy en búsquedas largas
+    JOB_WAIT_TIMEOUT_SECONDS: float = float(os.getenv("JOB_WAIT_TIMEOUT_SECONDS", "5"))
+    # Latido de los trabajos activos de cada proceso y segundos sin latido tras los que un trabajo
+    # se considera huérfano (su proceso terminó) y se marca como interrumpido
+    JOB_HEARTBEAT_SECONDS: float = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+    JOB_STALE_SECONDS: float = float(os.getenv("JOB_STALE_SECONDS", "120"))
+
+    # Procesos para la búsqueda de anomalías en paralelo (1 = en el proceso actual, 0 = un proceso por núcleo)
+    OUTLIER_SCAN_WORKERS: int = int(os.getenv("OUTLIER_SCAN_WORKERS", "1"))
+
+    # Registro en memoria de medidores y geografía: segundos entre recargas desde la base de datos
+    METER_REGISTRY_REFRESH_SECONDS: int = int(os.getenv("METER_REGISTRY_REFRESH_SECONDS", "300"))
+
+    # Chat: confianza mínima del parser local para responder sin pedir a Gemini el análisis de la consulta
+    CHAT_INTENT_MIN_CONFIDENCE: float = float(os.getenv("CHAT_INTENT_MIN_CONFIDENCE", "0.8"))
+    # Caché en memoria del análisis de consultas del chat hecho por Gemini (por consulta normalizada)
+    INTENT_CACHE_SIZE: int = int(os.getenv("INTENT_CACHE_SIZE", "1024"))
+    INTENT_CACHE_TTL_SECONDS: int = int(os.getenv("INTENT_CACHE_TTL_SECONDS", str(24 * 3600)))
+    # Sesiones del chat: conversaciones en memoria, inactividad (segundos) antes de descartarlas
+    # y copia en m_chat_sesiones (compartida entre procesos y reinicios)
+    CHAT_SESSION_SIZE: int = int(os.getenv("CHAT_SESSION_SIZE", "2048"))
+    CHAT_SESSION_TTL_SECONDS: int = int(os.getenv("CHAT_SESSION_TTL_SECONDS", str(2 * 3600)))
+    CHAT_SESSION_PERSIST: bool = os.getenv("CHAT_SESSION_PERSIST", "true").lower() == "true"
+
+    # Bus de eventos de los observadores: cola (eventos), hilos de despacho, eventos por lote y política
+    # con la cola llena (drop_new, drop_oldest o block, que espera EVENT_BUS_BLOCK_SECONDS)
+    EVENT_BUS_QUEUE_SIZE: int = int(os.getenv("EVENT_BUS_QUEUE_SIZE", "10000"))
+    EVENT_BUS_WORKERS: int = int(os.getenv("EVENT_BUS_WORKERS", "1"))
+    EVENT_BUS_BATCH_SIZE: int = int(os.getenv("EVENT_BUS_BATCH_SIZE", "100"))
+    EVENT_BUS_OVERFLOW: str = os.getenv("EVENT_BUS_OVERFLOW", "drop_oldest")
+    EVENT_BUS_BLOCK_SECONDS: float = float(os.getenv("EVENT_BUS_BLOCK_SECONDS", "0.05"))
+
 settings = Settings()
\ No newline at end of file
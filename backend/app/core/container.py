@@ -0,0 +1,148 @@
+import threading
+from datetime import date
+from typing import Optional
+
+from google import genai
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.data.repositories import EnergyRepository
+from app.services.analysis_cache import AnalysisCache, analysis_cache
+from app.services.chat_service import ChatService, build_system_prompt
+from app.services.chat_sessions import chat_sessions
+from app.services.energy_service import EnergyService
+from app.services.event_bus import EventBus
+from app.services.intent_cache import intent_cache
+from app.services.job_manager import JobManager
+from app.services.llm_gateway import GeminiGateway
+from app.services.meter_registry import MeterRegistry, meter_registry
+from app.services.observers import AuditLoggerObserver, CriticalAlertObserver
+
+
+class ServiceContainer:
+    """
+    Objetos de larga vida compartidos por todas las solicitudes (creados al iniciar la aplicación):
+
+    - Cliente de Gemini (un solo cliente HTTP con conexiones reutilizadas; seguro entre hilos).
+    - Prompt de sistema del chat, reconstruido solo cuando cambia la fecha.
+    - Observadores del análisis (auditoría y alertas críticas) y el bus que se los entrega en segundo plano.
+    - Caché de análisis y caché del análisis de consultas del chat.
+    - Gateway async de Gemini (límite de llamadas simultáneas y plazo por llamada).
+    - Gestor de trabajos en segundo plano (pool acotado de hilos para las búsquedas de anomalías).
+    - Registro en memoria de medidores y geografía.
+    - Sesiones del chat (estado de cada conversación).
+
+    Los servicios por solicitud solo enlazan la sesión de base de datos.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, cache: Optional[AnalysisCache] = None,
+                 registry: Optional[MeterRegistry] = None):
+        self.api_key = api_key if api_key is not None else settings.GEMINI_API_KEY
+        self.analysis_cache = cache or analysis_cache
+        self.intent_cache = intent_cache
+        self.chat_sessions = chat_sessions
+        self.registry = registry or meter_registry
+        self.observers = [AuditLoggerObserver(), CriticalAlertObserver()]
+        self.event_bus = EventBus(
+            capacity=settings.EVENT_BUS_QUEUE_SIZE,
+            workers=settings.EVENT_BUS_WORKERS,
+            batch_size=settings.EVENT_BUS_BATCH_SIZE,
+            overflow=settings.EVENT_BUS_OVERFLOW,
+            block_seconds=settings.EVENT_BUS_BLOCK_SECONDS
+        )
+        self._client = None
+        self._system_prompt = None  # (fecha, prompt)
+        self._lock = threading.Lock()
+        self.llm = GeminiGateway(lambda: self.genai_client, settings.GEMINI_MAX_CONCURRENCY, settings.GEMINI_TIMEOUT_SECONDS)
+        self.jobs = JobManager(self.energy_service, max_workers=settings.JOB_WORKERS,
+                               reuse_seconds=settings.JOB_RESULT_REUSE_SECONDS,
+                               heartbeat_seconds=settings.JOB_HEARTBEAT_SECONDS,
+                               stale_seconds=settings.JOB_STALE_SECONDS)
+
+    @property
+    def genai_client(self) -> genai.Client:
+        """Cliente de Gemini compartido; se crea en el primer uso."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if not self.api_key:
+                        raise ValueError("GEMINI_API_KEY no está configurada en variables de entorno.")
+                    self._client = genai.Client(api_key=self.api_key)
+                    print("[INFO] Cliente Gemini compartido inicializado")
+        return self._client
+
+    def system_prompt(self) -> str:
+        """Prompt de sistema del chat (incluye la fecha actual, se reconstruye una vez al día)."""
+        today = date.today()
+        cached = self._system_prompt
+        if cached is None or cached[0] != today:
+            cached = (today, build_system_prompt(today))
+            self._system_prompt = cached
+        return cached[1]
+
+    def energy_service(self, db: Session):
+        """EnergyService de una solicitud: enlaza la sesión y reutiliza los objetos compartidos."""
+        return EnergyService(
+            EnergyRepository(db) if db is not None else None,
+            genai_client=self.genai_client if self.api_key else None,
+            observers=self.observers,
+            analysis_cache=self.analysis_cache,
+            llm=self.llm,
+            registry=self.registry,
+            event_bus=self.event_bus
+        )
+
+    def chat_service(self, db: Session, session: Optional[dict] = None):
+        """ChatService de una solicitud con el cliente y el prompt de sistema compartidos y el estado de la conversación."""
+        return ChatService(self.energy_service(db), client=self.genai_client, system_prompt=self.system_prompt(),
+                           llm=self.llm, jobs=self.jobs, intent_cache=self.intent_cache, session=session)
+
+    def close(self):
+        """
+        Detiene los trabajos en segundo plano, entrega los eventos pendientes a los observadores y
+        libera el cliente HTTP de Gemini al apagar la aplicación.
+        """
+        self.jobs.shutdown()
+        self.event_bus.shutdown()
+        with self._lock:
+            if self._client is not None:
+                try:
+                    self._client.close()
+                except Exception as e:
+                    print(f"[INFO] Error cerrando el cliente Gemini: {e}")
+                self._client = None
+
+    async def aclose(self):
+        """Cierra también el cliente HTTP async de Gemini (desde el lifespan)."""
+        if self._client is not None:
+            try:
+                await self._client.aio.aclose()
+            except Exception as e:
+                print(f"[INFO] Error cerrando el cliente async de Gemini: {e}")
+        self.close()
+
+
+_container: Optional[ServiceContainer] = None
+_container_lock = threading.Lock()
+
+
+def init_container() -> ServiceContainer:
+    """Crea el contenedor de la aplicación (lifespan de FastAPI)."""
+    global _container
+    with _container_lock:
+        if _container is None:
+            _container = ServiceContainer()
+    return _container
+
+
+async def shutdown_container():
+    global _container
+    with _container_lock:
+        container, _container = _container, None
+    if container is not None:
+        await container.aclose()
+
+
+def get_container() -> ServiceContainer:
+    """Dependencia de FastAPI: contenedor de la aplicación (se crea si no pasó por el lifespan)."""
+    return _container or init_container()
@@ -0,0 +1,247 @@
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence
+
+from fastapi import APIRouter
+from starlette.datastructures import MutableHeaders
+
+# Límites de los histogramas (segundos): de consultas de milisegundos a llamadas largas a Gemini
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Endpoint de las etapas que corren fuera de una solicitud (trabajos en segundo plano, bus de eventos)
+BACKGROUND = 'background'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = '') -> str:
+    pares = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels → [conteos por límite, suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            serie = self._series.get(labels)
+            if serie is None:
+                serie = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += value
+            serie[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (conteos, suma, total) in sorted(self._series.items()):
+                acumulado = 0
+                for limite, conteo in zip(self.buckets, conteos):
+                    acumulado += conteo
+                    le = 'le="%g"' % limite
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {acumulado}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {total}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {suma:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class MetricsRegistry:
+    """Métricas del proceso en formato de texto de Prometheus (sin dependencias externas)."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+metrics = MetricsRegistry()
+
+REQUESTS = metrics.counter(
+    'energyapp_requests_total', 'Solicitudes HTTP por endpoint, método y código de estado',
+    ('endpoint', 'method', 'status'))
+REQUEST_DURATION = metrics.histogram(
+    'energyapp_request_duration_seconds', 'Duración de las solicitudes HTTP por endpoint',
+    ('endpoint', 'method'))
+STAGE_DURATION = metrics.histogram(
+    'energyapp_stage_duration_seconds',
+    'Duración de cada etapa (db_fetch, to_dataframe, baseline, merge, classify, llm, serialize, observers...) por endpoint',
+    ('endpoint', 'stage'))
+
+
+class RequestTimings:
+    """Tiempo acumulado por etapa durante una solicitud (para el histograma y el encabezado Server-Timing)."""
+
+    __slots__ = ('stages', 'endpoint_end', '_lock')
+
+    def __init__(self):
+        self.stages: Dict[str, list] = {}  # etapa → [segundos, veces]
+        self.endpoint_end: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            acumulado = self.stages.setdefault(name, [0.0, 0])
+            acumulado[0] += seconds
+            acumulado[1] += 1
+
+    def server_timing(self, total: float) -> str:
+        with self._lock:
+            partes = [f"{name};dur={seconds * 1000:.1f}" for name, (seconds, _) in self.stages.items()]
+        partes.append(f"total;dur={total * 1000:.1f}")
+        return ', '.join(partes)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def record_stage(name: str, seconds: float):
+    """Registra la duración de una etapa en la solicitud en curso (o como etapa en segundo plano)."""
+    timings = _current.get()
+    if timings is None:
+        STAGE_DURATION.observe(seconds, BACKGROUND, name)
+    else:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Mide el bloque como etapa `name`: with stage('db_fetch'): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def _route_path(scope) -> Optional[str]:
+    route = scope.get('route')
+    return getattr(route, 'path', None)
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: mide cada solicitud HTTP, agrega el encabezado Server-Timing con el tiempo de
+    cada etapa y, al terminar, registra la solicitud y sus etapas con la ruta como etiqueta
+    (la plantilla, p. ej. /devices/{device_id}, para no crear una serie por valor).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if timings.endpoint_end is not None:
+                    timings.add('serialize', time.perf_counter() - timings.endpoint_end)
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', timings.server_timing(time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - start
+            endpoint = _route_path(scope) or 'unmatched'
+            REQUESTS.inc(endpoint, scope['method'], str(status))
+            REQUEST_DURATION.observe(elapsed, endpoint, scope['method'])
+            for name, (seconds, _) in timings.stages.items():
+                STAGE_DURATION.observe(seconds, endpoint, name)
+
+
+class TimedAPIRouter(APIRouter):
+    """
+    Router que mide la etapa `serialize` de sus endpoints: desde que el endpoint retorna hasta que la
+    respuesta está lista (validación del response_model, jsonable_encoder y JSON).
+    """
+
+    def add_api_route(self, path: str, endpoint, **kwargs):
+        super().add_api_route(path, _marking_end(endpoint), **kwargs)
+
+
+def _marking_end(endpoint):
+    """Envuelve el endpoint (conservando su firma) para anotar cuándo retorna."""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def marked(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_end()
+    else:
+        @functools.wraps(endpoint)
+        def marked(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                _mark_endpoint_end()
+    return marked
+
+
+def _mark_endpoint_end():
+    timings = _current.get()
+    if timings is not None:
+        timings.endpoint_end = time.perf_counter()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, Integer, ForeignKey
+from sqlalchemy import Column, String, Float, Boolean, Date, DateTime, Integer, SmallInteger, ForeignKey, Index, Text, text
 from sqlalchemy.orm import relationship
 from app.data.database import Base
 
@@ -67,7 +67,12 @@ class Medidor(Base):
 
 class MLectura(Base):
     __tablename__ = "m_lecturas"
-    __table_args__ = {'schema': 'public'}  # Esquema público explícito
+    __table_args__ = (
+        # Consultas por medidor y rango de fechas
+        Index('ix_m_lecturas_deviceid_fecha', 'deviceid', 'fecha'),
+        # Esquema público explícito; particionada por rango de fecha (ver app/data/partitions.py)
+        {'schema': 'public', 'postgresql_partition_by': 'RANGE (fecha)'}
+    )
 
     # Definición de columnas según tu tabla PostgreSQL
     fecha = Column(DateTime, primary_key=True, nullable=False)
@@ -76,4 +81,116 @@ class MLectura(Base):
     kvarhd = Column(Float, nullable=False)
 
     # Relación con medidor
-    medidor = relationship("Medidor", back_populates="lecturas")
\ No newline at end of file
+    medidor = relationship("Medidor", back_populates="lecturas")
+
+class MBaseline(Base):
+    __tablename__ = "m_baseline"
+    __table_args__ = {'schema': 'public'}
+
+    # Curva base por medidor, año base, día de la semana (ISODOW: 1=lunes ... 7=domingo)
+    # e intervalo de 15 minutos del día (slot 0 = 00:00, slot 95 = 23:45)
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), primary_key=True, nullable=False)
+    base_year = Column(Integer, primary_key=True, nullable=False)
+    weekday = Column(SmallInteger, primary_key=True, nullable=False)
+    slot = Column(SmallInteger, primary_key=True, nullable=False)
+    mean = Column(Float, nullable=False)
+    std = Column(Float, nullable=True)
+    count = Column(Integer, nullable=False)
+
+class MBaselineEstado(Base):
+    __tablename__ = "m_baseline_estado"
+    __table_args__ = {'schema': 'public'}
+
+    # Marca de agua de las lecturas incluidas en la curva base de cada medidor/año
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), primary_key=True, nullable=False)
+    base_year = Column(Integer, primary_key=True, nullable=False)
+    lecturas = Column(Integer, nullable=False)
+    fecha_max = Column(DateTime, nullable=False)
+    actualizado = Column(DateTime, nullable=False)
+    # Lecturas del año cargadas por fuera del repositorio (seeder, COPY): se reconstruye al consultarla
+    sucio = Column(Boolean, nullable=False, default=False, server_default=text('false'))
+
+class MLecturaHora(Base):
+    __tablename__ = "m_lecturas_hora"
+    __table_args__ = {'schema': 'public'}
+
+    # Agregado horario de m_lecturas (hora = inicio de la hora)
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), primary_key=True, nullable=False)
+    hora = Column(DateTime, primary_key=True, nullable=False)
+    kwh_sum = Column(Float, nullable=False)
+    kvarh_sum = Column(Float, nullable=False)
+    kwhd_max = Column(Float, nullable=False)
+    kwhd_max_fecha = Column(DateTime, nullable=False)  # primera lectura con el kwhd máximo
+    ultima_lectura = Column(DateTime, nullable=False)
+    lecturas = Column(Integer, nullable=False)
+
+class MLecturaDia(Base):
+    __tablename__ = "m_lecturas_dia"
+    __table_args__ = {'schema': 'public'}
+
+    # Agregado diario de m_lecturas (calculado desde el agregado horario)
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), primary_key=True, nullable=False)
+    dia = Column(Date, primary_key=True, nullable=False)
+    kwh_sum = Column(Float, nullable=False)
+    kvarh_sum = Column(Float, nullable=False)
+    kwhd_max = Column(Float, nullable=False)
+    kwhd_max_fecha = Column(DateTime, nullable=False)
+    lecturas = Column(Integer, nullable=False)
+
+class MRollupEstado(Base):
+    __tablename__ = "m_rollup_estado"
+    __table_args__ = {'schema': 'public'}
+
+    # Marca de agua de los agregados de cada medidor: incluyen todas las lecturas hasta fecha_max
+    # (NULL si el medidor no tenía lecturas; en ese caso la marca es la fecha de actualización)
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), primary_key=True, nullable=False)
+    fecha_max = Column(DateTime, nullable=True)
+    actualizado = Column(DateTime, nullable=False)
+
+class MAnalisisCache(Base):
+    __tablename__ = "m_analisis_cache"
+    __table_args__ = {'schema': 'public'}
+
+    # Análisis de Gemini por clave de contenido (sha256 de medidor, fecha, año base, modelo y curva)
+    clave = Column(String(64), primary_key=True, nullable=False)
+    deviceid = Column(String(10), ForeignKey('public.medidor.deviceid'), nullable=False)
+    fecha = Column(Date, nullable=False)
+    base_year = Column(Integer, nullable=True)
+    model_id = Column(String(50), nullable=False)
+    resultado = Column(Text, nullable=False)  # JSON del análisis
+    creado = Column(DateTime, nullable=False)
+    expira = Column(DateTime, nullable=False, index=True)
+
+class MChatSesion(Base):
+    __tablename__ = "m_chat_sesiones"
+    __table_args__ = {'schema': 'public'}
+
+    # Estado de una conversación del chat (confirmación pendiente, última consulta, última lista mostrada)
+    id = Column(String(64), primary_key=True, nullable=False)
+    estado = Column(Text, nullable=False)  # JSON del estado
+    actualizado = Column(DateTime, nullable=False)
+    expira = Column(DateTime, nullable=False, index=True)
+
+class MTrabajo(Base):
+    __tablename__ = "m_trabajos"
+    __table_args__ = (
+        Index('ix_m_trabajos_tipo_clave', 'tipo', 'clave'),
+        {'schema': 'public'}
+    )
+
+    # Trabajos en segundo plano (búsquedas de anomalías): estado, progreso y resultado persistido
+    id = Column(String(32), primary_key=True, nullable=False)
+    tipo = Column(String(30), nullable=False)
+    clave = Column(String(64), nullable=False)  # sha256 del tipo y los parámetros (deduplicación)
+    parametros = Column(Text, nullable=False)  # JSON
+    estado = Column(String(20), nullable=False, index=True)  # pendiente, en_curso, completado, cancelado, error, interrumpido
+    procesados = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    anomalias = Column(Integer, nullable=False, default=0)
+    resultado = Column(Text, nullable=True)  # JSON del resultado
+    error = Column(Text, nullable=True)
+    creado = Column(DateTime, nullable=False)
+    iniciado = Column(DateTime, nullable=True)
+    actualizado = Column(DateTime, nullable=False)  # también es el latido del proceso propietario
+    terminado = Column(DateTime, nullable=True)
+    propietario = Column(String(80), nullable=True)  # equipo:pid del proceso que lo ejecuta
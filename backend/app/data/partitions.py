@@ -0,0 +1,210 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.core.config import settings
+from app.data.database import Base
+
+# Tabla de lecturas particionada por rango de fecha (mensual o anual)
+LECTURAS_TABLE = "m_lecturas"
+LECTURAS_INDEX = "ix_m_lecturas_deviceid_fecha"
+# Partición DEFAULT: recibe las lecturas de fechas sin partición propia (cargas externas, SQL manual)
+LECTURAS_DEFAULT_PARTITION = f"{LECTURAS_TABLE}_default"
+
+
+def _period_start(fecha: datetime, interval: str) -> datetime:
+    """Inicio de la partición (mes o año) que contiene la fecha."""
+    if interval == "year":
+        return datetime(fecha.year, 1, 1)
+    return datetime(fecha.year, fecha.month, 1)
+
+
+def _next_period(inicio: datetime, interval: str) -> datetime:
+    if interval == "year":
+        return datetime(inicio.year + 1, 1, 1)
+    if inicio.month == 12:
+        return datetime(inicio.year + 1, 1, 1)
+    return datetime(inicio.year, inicio.month + 1, 1)
+
+
+def _add_months(fecha: datetime, months: int) -> datetime:
+    month = fecha.month - 1 + months
+    return datetime(fecha.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_bounds(start: datetime, end: datetime, interval: Optional[str] = None) -> List[Tuple[str, datetime, datetime]]:
+    """
+    Particiones [desde, hasta) necesarias para cubrir las fechas entre start y end (inclusive).
+    Retorna tuplas (nombre, desde, hasta); los nombres son m_lecturas_pAAAA_MM o m_lecturas_pAAAA.
+    """
+    interval = interval or settings.LECTURAS_PARTITION_INTERVAL
+    bounds = []
+    inicio = _period_start(start, interval)
+    while inicio <= end:
+        hasta = _next_period(inicio, interval)
+        sufijo = f"{inicio.year}" if interval == "year" else f"{inicio.year}_{inicio.month:02d}"
+        bounds.append((f"{LECTURAS_TABLE}_p{sufijo}", inicio, hasta))
+        inicio = hasta
+    return bounds
+
+
+def is_partitioned(conn) -> bool:
+    """Indica si public.m_lecturas existe como tabla particionada."""
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relname = :tabla
+        )
+    """), {'tabla': LECTURAS_TABLE}).scalar())
+
+
+def ensure_partitions(conn, start: datetime, end: datetime) -> int:
+    """
+    Crea las particiones de m_lecturas que falten para cubrir [start, end].
+    No hace nada si la tabla no está particionada. Retorna el número de particiones creadas.
+
+    Si la partición DEFAULT ya tiene lecturas del rango de una partición nueva, se mueven a
+    ella en la misma transacción (PostgreSQL no permite crearla mientras la DEFAULT las contenga).
+
+    Crear una partición bloquea la tabla padre, por lo que conviene llamarla en una
+    transacción corta propia y antes de insertar (no dentro de una carga larga).
+    """
+    if not is_partitioned(conn):
+        return 0
+
+    existentes = {name for (name,) in conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = 'public' AND p.relname = :tabla
+    """), {'tabla': LECTURAS_TABLE}).all()}
+
+    created = 0
+    for name, desde, hasta in partition_bounds(start, end):
+        if name in existentes:
+            continue
+        movidas = 0
+        if LECTURAS_DEFAULT_PARTITION in existentes:
+            movidas = conn.execute(text(f"""
+                CREATE TEMP TABLE tmp_particion_default ON COMMIT DROP AS
+                SELECT * FROM public.{LECTURAS_DEFAULT_PARTITION} WHERE fecha >= :desde AND fecha < :hasta
+            """), {'desde': desde, 'hasta': hasta}).rowcount
+            if movidas:
+                conn.execute(text(f"DELETE FROM public.{LECTURAS_DEFAULT_PARTITION} WHERE fecha >= :desde AND fecha < :hasta"),
+                             {'desde': desde, 'hasta': hasta})
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS public.{name} PARTITION OF public.{LECTURAS_TABLE} "
+            f"FOR VALUES FROM ('{desde:%Y-%m-%d}') TO ('{hasta:%Y-%m-%d}')"
+        ))
+        if LECTURAS_DEFAULT_PARTITION in existentes:
+            if movidas:
+                conn.execute(text(f"INSERT INTO public.{name} SELECT * FROM tmp_particion_default"))
+                print(f"[INFO] {movidas} lecturas movidas de {LECTURAS_DEFAULT_PARTITION} a {name}")
+            conn.execute(text("DROP TABLE tmp_particion_default"))
+        created += 1
+
+    if created:
+        print(f"[INFO] Creadas {created} particiones de {LECTURAS_TABLE} ({start:%Y-%m-%d} a {end:%Y-%m-%d})")
+    return created
+
+
+def ensure_default_partition(conn) -> bool:
+    """
+    Crea la partición DEFAULT de m_lecturas si falta, para que una inserción con fecha fuera de
+    las particiones creadas (SQL manual, cargadores externos, un proceso que sigue corriendo
+    después del horizonte de LECTURAS_PARTITION_MONTHS_AHEAD) no falle. Las lecturas que caen
+    ahí se mueven a su partición cuando esta se crea (ensure_partitions: en la siguiente carga
+    masiva que la cubra o al iniciar la aplicación). Retorna True si la creó.
+    """
+    if not is_partitioned(conn):
+        return False
+    existe = conn.execute(text("SELECT to_regclass(:nombre) IS NOT NULL"),
+                          {'nombre': f"public.{LECTURAS_DEFAULT_PARTITION}"}).scalar()
+    if existe:
+        return False
+    conn.execute(text(f"CREATE TABLE public.{LECTURAS_DEFAULT_PARTITION} PARTITION OF public.{LECTURAS_TABLE} DEFAULT"))
+    print(f"[INFO] Creada la partición {LECTURAS_DEFAULT_PARTITION}")
+    return True
+
+
+def ensure_upcoming_partitions(engine) -> int:
+    """
+    Crea la partición DEFAULT y, por adelantado, las particiones desde el mes actual hasta
+    LECTURAS_PARTITION_MONTHS_AHEAD meses. Si la DEFAULT recibió lecturas (fechas sin partición
+    propia), crea también sus particiones y las mueve a ellas.
+    """
+    hoy = datetime.now()
+    with engine.begin() as conn:
+        ensure_default_partition(conn)
+        created = ensure_partitions(conn, hoy, _add_months(hoy, settings.LECTURAS_PARTITION_MONTHS_AHEAD))
+        fecha_min, fecha_max = conn.execute(text(f"SELECT MIN(fecha), MAX(fecha) FROM public.{LECTURAS_DEFAULT_PARTITION}")).one()
+        if fecha_min is not None:
+            created += ensure_partitions(conn, fecha_min, fecha_max)
+    return created
+
+
+def migrate_to_partitioned(engine) -> bool:
+    """
+    Convierte una tabla m_lecturas existente (no particionada) en particionada.
+
+    En una sola transacción: renombra la tabla actual, crea la tabla particionada
+    desde el modelo, crea las particiones que cubren los datos, copia las lecturas
+    y elimina la tabla anterior. Bloquea m_lecturas durante la copia: ejecutar en
+    una ventana de mantenimiento. Retorna True si se realizó la conversión.
+    """
+    from app.data.models import MLectura
+
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return False
+
+        anterior = f"{LECTURAS_TABLE}_sin_particion"
+        conn.execute(text(f"ALTER TABLE public.{LECTURAS_TABLE} RENAME TO {anterior}"))
+        conn.execute(text(f"ALTER TABLE public.{anterior} RENAME CONSTRAINT {LECTURAS_TABLE}_pkey TO {anterior}_pkey"))
+        conn.execute(text(f"DROP INDEX IF EXISTS public.{LECTURAS_INDEX}"))
+
+        MLectura.__table__.create(conn)
+
+        fecha_min, fecha_max = conn.execute(text(f"SELECT MIN(fecha), MAX(fecha) FROM public.{anterior}")).one()
+        if fecha_min is not None:
+            ensure_partitions(conn, fecha_min, fecha_max)
+        ensure_default_partition(conn)
+
+        copied = conn.execute(text(f"""
+            INSERT INTO public.{LECTURAS_TABLE} (fecha, deviceid, kwhd, kvarhd)
+            SELECT fecha, deviceid, kwhd, kvarhd FROM public.{anterior}
+        """)).rowcount
+        conn.execute(text(f"DROP TABLE public.{anterior}"))
+
+    print(f"[INFO] {LECTURAS_TABLE} convertida a tabla particionada ({copied} lecturas copiadas)")
+    return True
+
+
+def setup_schema(engine):
+    """
+    Prepara el esquema al iniciar la aplicación: crea las tablas que falten (m_lecturas nace
+    particionada), asegura el índice compuesto (deviceid, fecha) en instalaciones anteriores,
+    convierte m_lecturas a particionada si LECTURAS_PARTITION_MIGRATE está activo y crea
+    por adelantado las particiones de los próximos meses.
+    """
+    from app.data import models  # noqa: F401  (registra los modelos en Base.metadata)
+
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {LECTURAS_INDEX} ON public.{LECTURAS_TABLE} (deviceid, fecha)"))
+        partitioned = is_partitioned(conn)
+
+    if not partitioned:
+        if settings.LECTURAS_PARTITION_MIGRATE:
+            migrate_to_partitioned(engine)
+        else:
+            print(f"[INFO] {LECTURAS_TABLE} no está particionada (LECTURAS_PARTITION_MIGRATE=true para convertirla)")
+            return
+
+    ensure_upcoming_partitions(engine)
@@ -1,34 +1,361 @@
+import io
+import json
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import pandas as pd
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import extract, func
-from app.data.models import MLectura, Medidor, Localidad, Municipio, Departamento
+from sqlalchemy import func, text
+from app.core.config import settings
+from app.data.partitions import ensure_partitions
+from app.data.models import MLectura, Medidor, Localidad, Municipio, Departamento, MBaseline, MBaselineEstado, MRollupEstado, MAnalisisCache, MChatSesion, MTrabajo
 
 class EnergyRepository:
     def __init__(self, db: Session):
         self.db = db
 
-    def bulk_insert_readings(self, readings: List[MLectura]):
+    MAX_REJECTED_ROWS_REPORTED = 100  # filas rechazadas detalladas en el reporte de carga
+
+    def bulk_insert_readings(self, readings: List[MLectura], batch_size: Optional[int] = None) -> dict:
         """Inserta o actualiza lecturas masivamente."""
+        frame = pd.DataFrame({
+            'fecha': [r.fecha for r in readings],
+            'deviceid': [r.deviceid for r in readings],
+            'kwhd': [r.kwhd for r in readings],
+            'kvarhd': [r.kvarhd for r in readings]
+        })
+        return self.bulk_upsert_readings(frame, batch_size=batch_size)
+
+    def bulk_upsert_readings(self, frame: pd.DataFrame, batch_size: Optional[int] = None) -> dict:
+        """
+        Carga masiva de lecturas (columnas fecha, deviceid, kwhd, kvarhd).
+
+        Cada lote se copia con COPY a una tabla temporal y se aplica con un único
+        INSERT ... ON CONFLICT (fecha, deviceid) DO UPDATE. Toda la carga se confirma
+        en una sola transacción. Se rechazan (y se reportan) las filas de medidores
+        inexistentes y las repetidas dentro de la misma carga (se conserva la última).
+        """
+        batch_size = batch_size or settings.INGEST_BATCH_SIZE
+        rejected_rows = []
+        received = len(frame)
+
+        frame = frame[['fecha', 'deviceid', 'kwhd', 'kvarhd']]
+
+        # Medidores inexistentes (violarían la llave foránea y abortarían el lote completo)
+        device_ids = frame['deviceid'].unique().tolist()
+        known = {d for (d,) in self.db.query(Medidor.deviceid).filter(Medidor.deviceid.in_(device_ids)).all()}
+        unknown_mask = ~frame['deviceid'].isin(known)
+        rejected_rows += [{'row': int(i), 'reason': f"Medidor {d} no existe"}
+                          for i, d in frame.loc[unknown_mask, 'deviceid'].items()]
+
+        # Duplicados dentro de la carga: ON CONFLICT no puede actualizar la misma fila dos veces
+        duplicated_mask = frame.duplicated(['fecha', 'deviceid'], keep='last') & ~unknown_mask
+        rejected_rows += [{'row': int(i), 'reason': "Lectura duplicada en la carga (se conserva la última)"}
+                          for i in frame.index[duplicated_mask]]
+
+        frame = frame[~(unknown_mask | duplicated_mask)]
+
+        # Particiones que cubren la carga, en una transacción corta previa (bloquean la tabla padre)
+        if len(frame):
+            with self.db.get_bind().begin() as conn:
+                ensure_partitions(conn, frame['fecha'].min(), frame['fecha'].max())
+
+        inserted = 0
+        updated = 0
+        batches = 0
         try:
-            # Usamos merge para manejar duplicados (upsert simple)
-            for r in readings:
-                self.db.merge(r)
+            cursor = self.db.connection().connection.cursor()
+            cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS tmp_m_lecturas (
+                fecha timestamp NOT NULL,
+                deviceid varchar(10) NOT NULL,
+                kwhd double precision NOT NULL,
+                kvarhd double precision NOT NULL
+            ) ON COMMIT DELETE ROWS
+            """)
+
+            for start in range(0, len(frame), batch_size):
+                batch = frame.iloc[start:start + batch_size]
+                buffer = io.StringIO()
+                batch.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+                buffer.seek(0)
+
+                cursor.execute("TRUNCATE tmp_m_lecturas")
+                cursor.copy_expert("COPY tmp_m_lecturas (fecha, deviceid, kwhd, kvarhd) FROM STDIN WITH (FORMAT csv)", buffer)
+                # Lecturas ya existentes (se actualizan); en tablas particionadas RETURNING no expone xmax
+                cursor.execute("""
+                SELECT COUNT(*) FROM tmp_m_lecturas t
+                JOIN public.m_lecturas l ON l.fecha = t.fecha AND l.deviceid = t.deviceid
+                """)
+                batch_updated = cursor.fetchone()[0]
+                cursor.execute("""
+                INSERT INTO public.m_lecturas (fecha, deviceid, kwhd, kvarhd)
+                SELECT fecha, deviceid, kwhd, kvarhd FROM tmp_m_lecturas
+                ON CONFLICT (fecha, deviceid) DO UPDATE
+                SET kwhd = EXCLUDED.kwhd, kvarhd = EXCLUDED.kvarhd
+                """)
+                batch_inserted = cursor.rowcount - batch_updated
+                inserted += batch_inserted
+                updated += batch_updated
+                batches += 1
+
+            if len(frame):
+                self._refresh_rollups_after_ingest(frame)
+
             self.db.commit()
         except Exception as e:
             self.db.rollback()
             raise e
 
+        if len(frame):
+            self._refresh_baselines_after_ingest(frame)
+
+        return {
+            'status': 'success',
+            'records': inserted + updated,
+            'received': received,
+            'inserted': inserted,
+            'updated': updated,
+            'batches': batches,
+            'rejected': len(rejected_rows),
+            'rejected_rows': rejected_rows[:self.MAX_REJECTED_ROWS_REPORTED]
+        }
+
+    def _refresh_baselines_after_ingest(self, frame: pd.DataFrame):
+        """
+        Mantiene al día las curvas base ya materializadas de los medidores/años cargados.
+        Si la carga toca lecturas anteriores a la marca de agua, la curva se reconstruye;
+        si solo agrega lecturas posteriores, se actualiza de forma incremental.
+        Las curvas que aún no existen se construyen bajo demanda al consultarlas.
+        """
+        touched = frame.assign(year=frame['fecha'].dt.year).groupby(['deviceid', 'year'])['fecha'].min()
+        estados = self.db.query(MBaselineEstado).filter(
+            MBaselineEstado.deviceid.in_(touched.index.get_level_values('deviceid').unique().tolist()),
+            MBaselineEstado.base_year.in_([int(y) for y in touched.index.get_level_values('year').unique()])
+        ).all()
+
+        por_anio = {}
+        for estado in estados:
+            min_fecha = touched.get((estado.deviceid, estado.base_year))
+            if min_fecha is None:
+                continue
+            devices, rebuild = por_anio.setdefault(estado.base_year, ([], []))
+            devices.append(estado.deviceid)
+            if min_fecha <= estado.fecha_max:
+                rebuild.append(estado.deviceid)
+
+        for base_year, (devices, rebuild) in por_anio.items():
+            self.refresh_baselines(base_year, devices, rebuild=rebuild)
+
+    # Métodos para los agregados horario y diario (m_lecturas_hora, m_lecturas_dia)
+
+    ROLLUP_REFRESH_BATCH = 200  # medidores por sentencia al reconstruir agregados
+    ROLLUP_FECHA_MIN = datetime(1900, 1, 1)
+    ROLLUP_FECHA_MAX = datetime(2200, 1, 1)
+
+    def refresh_rollups(self, device_ids: Optional[List[str]] = None) -> dict:
+        """
+        Reconstruye desde m_lecturas los agregados horario y diario de los medidores indicados
+        (o de todos) y su marca de agua. Se usa para el llenado inicial y después de cargas
+        hechas fuera de la aplicación que modifiquen lecturas anteriores a la marca de agua.
+        """
+        if device_ids is None:
+            device_ids = [d for (d,) in self.db.query(Medidor.deviceid).all()]
+
+        for i in range(0, len(device_ids), self.ROLLUP_REFRESH_BATCH):
+            batch = device_ids[i:i + self.ROLLUP_REFRESH_BATCH]
+            self._rebuild_rollups(batch, [None] * len(batch), [None] * len(batch))
+            self.db.commit()
+
+        return {'devices': len(device_ids)}
+
+    def _refresh_rollups_after_ingest(self, frame: pd.DataFrame):
+        """
+        Recalcula los agregados de los días tocados por una carga (dentro de su transacción).
+        Si la carga llega hasta la marca de agua o la supera, se recalcula desde el día de la marca
+        para incluir lecturas agregadas por fuera de la aplicación. Los medidores sin agregados
+        se construyen completos.
+        """
+        # Medidores en orden (groupby ordena): los bloqueos de los lotes se toman en orden global
+        rangos = frame.groupby('deviceid')['fecha'].agg(['min', 'max'])
+        estados = {e.deviceid: e for e in self.db.query(MRollupEstado).filter(
+            MRollupEstado.deviceid.in_(rangos.index.tolist())
+        ).all()}
+
+        ids, desdes, hastas = [], [], []
+        for deviceid, rango in rangos.iterrows():
+            estado = estados.get(deviceid)
+            desde = hasta = None
+            if estado is not None and estado.fecha_max is not None:
+                desde = rango['min'].normalize()
+                hasta = rango['max'].normalize() + pd.Timedelta(days=1)
+                corte = pd.Timestamp(estado.fecha_max).normalize()
+                if hasta > corte:
+                    desde = min(desde, corte)
+                desde, hasta = desde.to_pydatetime(), hasta.to_pydatetime()
+            ids.append(deviceid)
+            desdes.append(desde)
+            hastas.append(hasta)
+
+        for i in range(0, len(ids), self.ROLLUP_REFRESH_BATCH):
+            self._rebuild_rollups(ids[i:i + self.ROLLUP_REFRESH_BATCH],
+                                  desdes[i:i + self.ROLLUP_REFRESH_BATCH],
+                                  hastas[i:i + self.ROLLUP_REFRESH_BATCH])
+
+    def _rebuild_rollups(self, device_ids: List[str], desdes: List[Optional[datetime]], hastas: List[Optional[datetime]]):
+        """
+        Recalcula los agregados de cada medidor en su rango de días [desde, hasta) (None = sin límite)
+        y actualiza su marca de agua. No confirma la transacción: los medidores quedan bloqueados
+        (bloqueo consultivo) hasta que termine, para que una carga y un refresh_rollups simultáneos
+        no borren e inserten los mismos agregados a la vez.
+        """
+        self._lock_devices("m_lecturas_rollup", device_ids)
+        params = {
+            'ids': device_ids,
+            'desdes': [d or self.ROLLUP_FECHA_MIN for d in desdes],
+            'hastas': [h or self.ROLLUP_FECHA_MAX for h in hastas],
+            'ahora': datetime.now()
+        }
+        rangos = "unnest(CAST(:ids AS varchar[]), CAST(:desdes AS timestamp[]), CAST(:hastas AS timestamp[])) AS r(deviceid, desde, hasta)"
+
+        self.db.execute(text(f"""
+        DELETE FROM public.m_lecturas_hora h
+        USING {rangos}
+        WHERE h.deviceid = r.deviceid AND h.hora >= r.desde AND h.hora < r.hasta
+        """), params)
+        self.db.execute(text(f"""
+        DELETE FROM public.m_lecturas_dia d
+        USING {rangos}
+        WHERE d.deviceid = r.deviceid AND d.dia >= r.desde AND d.dia < r.hasta
+        """), params)
+
+        self.db.execute(text(f"""
+        INSERT INTO public.m_lecturas_hora (deviceid, hora, kwh_sum, kvarh_sum, kwhd_max, kwhd_max_fecha, ultima_lectura, lecturas)
+        SELECT l.deviceid,
+               date_trunc('hour', l.fecha),
+               SUM(l.kwhd),
+               SUM(l.kvarhd),
+               MAX(l.kwhd),
+               (ARRAY_AGG(l.fecha ORDER BY l.kwhd DESC, l.fecha))[1],
+               MAX(l.fecha),
+               COUNT(*)
+        FROM {rangos}
+        JOIN public.m_lecturas l ON l.deviceid = r.deviceid AND l.fecha >= r.desde AND l.fecha < r.hasta
+        GROUP BY l.deviceid, date_trunc('hour', l.fecha)
+        """), params)
+
+        self.db.execute(text(f"""
+        INSERT INTO public.m_lecturas_dia (deviceid, dia, kwh_sum, kvarh_sum, kwhd_max, kwhd_max_fecha, lecturas)
+        SELECT h.deviceid,
+               h.hora::date,
+               SUM(h.kwh_sum),
+               SUM(h.kvarh_sum),
+               MAX(h.kwhd_max),
+               (ARRAY_AGG(h.kwhd_max_fecha ORDER BY h.kwhd_max DESC, h.kwhd_max_fecha))[1],
+               SUM(h.lecturas)
+        FROM {rangos}
+        JOIN public.m_lecturas_hora h ON h.deviceid = r.deviceid AND h.hora >= r.desde AND h.hora < r.hasta
+        GROUP BY h.deviceid, h.hora::date
+        """), params)
+
+        self.db.execute(text(f"""
+        INSERT INTO public.m_rollup_estado (deviceid, fecha_max, actualizado)
+        SELECT r.deviceid,
+               (SELECT MAX(h.ultima_lectura) FROM public.m_lecturas_hora h WHERE h.deviceid = r.deviceid),
+               :ahora
+        FROM {rangos}
+        ON CONFLICT (deviceid) DO UPDATE
+        SET fecha_max = EXCLUDED.fecha_max, actualizado = EXCLUDED.actualizado
+        """), params)
+
+    def get_period_aggregates(self, device_ids: List[str], start_date: datetime, end_date: datetime) -> List[dict]:
+        """
+        Agrega las lecturas de varios medidores en [start_date, end_date) usando el agregado más
+        grueso que responde de forma exacta: días completos desde m_lecturas_dia, horas completas
+        desde m_lecturas_hora y los bordes (o lo posterior a la marca de agua) desde m_lecturas.
+
+        Cada fila contiene: deviceid, total_kwh, total_kvarh, lecturas, dia_min, dia_max,
+        kwhd_max y kwhd_max_fecha (primera lectura con el máximo). Los medidores sin
+        lecturas en el periodo no aparecen.
+        """
+        if not device_ids:
+            return []
+
+        start = pd.Timestamp(start_date)
+        end = pd.Timestamp(end_date)
+        hora_ini, dia_ini = start.ceil('h'), start.ceil('D')
+        hora_fin, dia_fin = end.floor('h'), end.floor('D')
+
+        estados = dict(self.db.query(MRollupEstado.deviceid, func.coalesce(MRollupEstado.fecha_max, MRollupEstado.actualizado)).filter(
+            MRollupEstado.deviceid.in_(device_ids)
+        ).all())
+
+        # Por medidor, las horas completas agregadas llegan hasta hora_corte y los días hasta dia_corte
+        horas_corte, dias_corte = [], []
+        for deviceid in device_ids:
+            corte = estados.get(deviceid)
+            if corte is None:
+                horas_corte.append(hora_ini)
+                dias_corte.append(dia_ini)
+            else:
+                corte = pd.Timestamp(corte)
+                horas_corte.append(max(hora_ini, min(hora_fin, corte.floor('h'))))
+                dias_corte.append(max(dia_ini, min(dia_fin, corte.floor('D'))))
+
+        query = text("""
+        WITH limites AS (
+            SELECT * FROM unnest(CAST(:ids AS varchar[]), CAST(:horas_corte AS timestamp[]), CAST(:dias_corte AS timestamp[]))
+                AS t(deviceid, hora_corte, dia_corte)
+        ),
+        segmentos AS (
+            SELECT d.deviceid, d.dia, d.kwh_sum AS kwh, d.kvarh_sum AS kvarh, d.lecturas, d.kwhd_max, d.kwhd_max_fecha
+            FROM limites t
+            JOIN public.m_lecturas_dia d
+              ON d.deviceid = t.deviceid AND d.dia >= :dia_ini AND d.dia < t.dia_corte
+            UNION ALL
+            SELECT h.deviceid, h.hora::date, h.kwh_sum, h.kvarh_sum, h.lecturas, h.kwhd_max, h.kwhd_max_fecha
+            FROM limites t
+            JOIN public.m_lecturas_hora h
+              ON h.deviceid = t.deviceid
+             AND ((h.hora >= :hora_ini AND h.hora < LEAST(CAST(:dia_ini AS timestamp), t.hora_corte))
+                  OR (h.hora >= t.dia_corte AND h.hora < t.hora_corte))
+            UNION ALL
+            SELECT l.deviceid, l.fecha::date, l.kwhd, l.kvarhd, 1, l.kwhd, l.fecha
+            FROM limites t
+            JOIN public.m_lecturas l
+              ON l.deviceid = t.deviceid
+             AND ((l.fecha >= :start_date AND l.fecha < :cabeza_fin) OR (l.fecha >= t.hora_corte AND l.fecha < :end_date))
+            WHERE (l.fecha >= :start_date AND l.fecha < :cabeza_fin) OR (l.fecha >= :hora_corte_min AND l.fecha < :end_date)
+        )
+        SELECT DISTINCT ON (deviceid)
+               deviceid,
+               SUM(kwh) OVER w AS total_kwh,
+               SUM(kvarh) OVER w AS total_kvarh,
+               SUM(lecturas) OVER w AS lecturas,
+               MIN(dia) OVER w AS dia_min,
+               MAX(dia) OVER w AS dia_max,
+               kwhd_max,
+               kwhd_max_fecha
+        FROM segmentos
+        WINDOW w AS (PARTITION BY deviceid)
+        ORDER BY deviceid, kwhd_max DESC, kwhd_max_fecha
+        """)
+
+        return self.db.execute(query, {
+            'ids': list(device_ids),
+            'horas_corte': [h.to_pydatetime() for h in horas_corte],
+            'dias_corte': [d.to_pydatetime() for d in dias_corte],
+            'hora_corte_min': min(horas_corte).to_pydatetime(),
+            'start_date': start.to_pydatetime(),
+            'end_date': end.to_pydatetime(),
+            'cabeza_fin': min(hora_ini, end).to_pydatetime(),
+            'hora_ini': hora_ini.to_pydatetime(),
+            'dia_ini': dia_ini.to_pydatetime()
+        }).mappings().all()
+
     def get_readings_by_date(self, device_id: str, target_date: datetime):
-        """Obtiene lecturas de un día completo (00:00 a 23:59)."""
-        start = target_date.replace(hour=0, minute=0, second=0)
-        end = target_date.replace(hour=23, minute=59, second=59)
-        
-        return self.db.query(MLectura).filter(
-            MLectura.deviceid == device_id,
-            MLectura.fecha >= start,
-            MLectura.fecha <= end
-        ).order_by(MLectura.fecha).all()
+        """Obtiene lecturas de un día completo [00:00, 00:00 del día siguiente)."""
+        start = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        return self.get_readings_range(device_id, start, start + timedelta(days=1))
     
     def get_readings_range(self, device_id: str, start_date: datetime, end_date: datetime):
         """Obtiene todas las lecturas en un rango de fechas (optimizado para consultas masivas)."""
@@ -38,19 +365,439 @@ class EnergyRepository:
             MLectura.fecha < end_date
         ).order_by(MLectura.fecha).all()
 
+    # Métodos para la curva base materializada (m_baseline)
+
+    BASELINE_REFRESH_BATCH = 500  # medidores por sentencia al reconstruir curvas base
+
+    def get_baseline_profile(self, device_id: str, base_year: int, weekday: Optional[int] = None) -> List[MBaseline]:
+        """
+        Obtiene la curva base materializada de un medidor para un año base
+        (672 filas: 7 días x 96 intervalos, o 96 si se indica el día ISODOW).
+        """
+        query = self.db.query(MBaseline).filter(
+            MBaseline.deviceid == device_id,
+            MBaseline.base_year == base_year
+        )
+        if weekday is not None:
+            query = query.filter(MBaseline.weekday == weekday)
+        return query.order_by(MBaseline.weekday, MBaseline.slot).all()
+
+    def ensure_baseline(self, device_id: str, base_year: int) -> bool:
+        """
+        Garantiza que la curva base de un medidor esté al día. Solo consulta el índice
+        para comparar la última lectura del año con la marca de agua guardada y, si cambió,
+        no existe la curva o está marcada como desactualizada, la actualiza.
+        Retorna True si el medidor tiene curva base para el año.
+        """
+        estado = self.db.query(MBaselineEstado).filter(
+            MBaselineEstado.deviceid == device_id,
+            MBaselineEstado.base_year == base_year
+        ).first()
+
+        fecha_max = self.db.query(func.max(MLectura.fecha)).filter(
+            MLectura.deviceid == device_id,
+            MLectura.fecha >= datetime(base_year, 1, 1),
+            MLectura.fecha < datetime(base_year + 1, 1, 1)
+        ).scalar()
+
+        if estado is None or estado.sucio or fecha_max != estado.fecha_max:
+            if fecha_max is None and estado is None:
+                return False
+            self.refresh_baselines(base_year, [device_id])
+        return fecha_max is not None
+
+    def mark_baselines_stale(self, device_ids: List[str], base_years: Optional[List[int]] = None) -> int:
+        """
+        Marca como desactualizadas las curvas base de los medidores (de todos sus años o de los
+        indicados), para cargas hechas por fuera del repositorio: se reconstruyen al consultarlas.
+        """
+        filtro = "AND base_year = ANY(:base_years)" if base_years is not None else ""
+        try:
+            count = self.db.execute(text(f"""
+            UPDATE public.m_baseline_estado SET sucio = true
+            WHERE deviceid = ANY(:device_ids) {filtro}
+            """), {'device_ids': list(device_ids), 'base_years': list(base_years or [])}).rowcount
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return count
+
+    def refresh_baselines(self, base_year: int, device_ids: Optional[List[str]] = None,
+                          rebuild: Optional[List[str]] = None, verify: bool = False) -> dict:
+        """
+        Construye o actualiza en bloque las curvas base de un año para la flota
+        (o para los medidores indicados).
+
+        La vigencia de cada curva se comprueba con una búsqueda por índice de la última lectura
+        del año del medidor (sin recorrer el año):
+
+        - Medidores sin curva, marcados como desactualizados (mark_baselines_stale) o cuya última
+          lectura es anterior a la marca de agua: se construye completa con un GROUP BY.
+        - Medidores con lecturas posteriores a la marca de agua: se combinan solo las
+          lecturas nuevas con la media/desviación guardadas (fórmula de Chan).
+        - Medidores que ya no tienen lecturas en el año: se elimina su curva.
+        - Los medidores indicados en `rebuild` se reconstruyen completos siempre.
+
+        Con `verify` (actualización explícita) también se cuentan las lecturas del año de cada
+        medidor y se reconstruyen las curvas cuyo conteo no coincide (lecturas antiguas
+        modificadas o borradas por fuera de la aplicación).
+
+        Cada bloque de medidores se actualiza con un bloqueo consultivo por medidor y año, de modo
+        que dos actualizaciones concurrentes del mismo medidor se aplican una después de la otra.
+        """
+        forzados = set(rebuild or [])
+        estados = self._baseline_freshness(base_year, device_ids, verify)
+        acciones_previas = {e['deviceid']: self._baseline_action(e, forzados, verify) for e in estados}
+        pendientes = sorted(d for d, accion in acciones_previas.items() if accion)
+
+        resumen = {'rebuilt': 0, 'incremental': 0, 'removed': 0}
+        try:
+            for i in range(0, len(pendientes), self.BASELINE_REFRESH_BATCH):
+                lote = pendientes[i:i + self.BASELINE_REFRESH_BATCH]
+                self._lock_devices(f"m_baseline:{base_year}", lote)
+
+                # Se revisa de nuevo con el bloqueo tomado: otra actualización pudo terminar antes
+                acciones = {'rebuild': [], 'incremental': [], 'remove': []}
+                for e in self._baseline_freshness(base_year, lote, verify):
+                    accion = self._baseline_action(e, forzados, verify)
+                    if accion:
+                        acciones[accion].append(e)
+
+                reconstruir = [e['deviceid'] for e in acciones['rebuild']]
+                if acciones['incremental']:
+                    incrementales = [e['deviceid'] for e in acciones['incremental']]
+                    self._merge_new_baseline_readings(base_year, incrementales)
+                    if verify:
+                        conteos = dict(self.db.query(MBaselineEstado.deviceid, MBaselineEstado.lecturas).filter(
+                            MBaselineEstado.base_year == base_year,
+                            MBaselineEstado.deviceid.in_(incrementales)
+                        ).all())
+                        reconstruir += [e['deviceid'] for e in acciones['incremental']
+                                        if conteos.get(e['deviceid']) != e['lecturas']]
+                if reconstruir:
+                    self._rebuild_baselines(base_year, reconstruir)
+                if acciones['remove']:
+                    self._drop_baselines(base_year, [e['deviceid'] for e in acciones['remove']])
+
+                self.db.commit()
+                resumen['rebuilt'] += len(set(reconstruir))
+                resumen['incremental'] += len(acciones['incremental'])
+                resumen['removed'] += len(acciones['remove'])
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+        return {
+            'base_year': base_year,
+            **resumen,
+            'unchanged': sum(1 for e in estados if e['fecha_max'] is not None and not acciones_previas[e['deviceid']])
+        }
+
+    def _baseline_freshness(self, base_year: int, device_ids: Optional[List[str]], exact: bool):
+        """
+        Por medidor (los indicados o todos): última lectura del año base (búsqueda por índice) y la
+        marca de agua de su curva. Con `exact` también el número de lecturas del año (recorre el año).
+        """
+        params = {
+            'base_year': base_year,
+            'base_start': datetime(base_year, 1, 1),
+            'base_end': datetime(base_year + 1, 1, 1),
+        }
+        if device_ids is not None:
+            medidores = "unnest(CAST(:device_ids AS varchar[])) AS d(deviceid)"
+            params['device_ids'] = list(device_ids)
+        else:
+            medidores = "public.medidor d"
+
+        lecturas = "NULL::bigint"
+        if exact:
+            lecturas = """(SELECT COUNT(*) FROM public.m_lecturas l
+                 WHERE l.deviceid = d.deviceid AND l.fecha >= :base_start AND l.fecha < :base_end)"""
+
+        return self.db.execute(text(f"""
+        SELECT d.deviceid,
+               (SELECT MAX(l.fecha) FROM public.m_lecturas l
+                 WHERE l.deviceid = d.deviceid AND l.fecha >= :base_start AND l.fecha < :base_end) AS fecha_max,
+               {lecturas} AS lecturas,
+               e.lecturas AS estado_lecturas, e.fecha_max AS estado_fecha_max, e.sucio
+        FROM {medidores}
+        LEFT JOIN public.m_baseline_estado e
+          ON e.deviceid = d.deviceid AND e.base_year = :base_year
+        """), params).mappings().all()
+
+    @staticmethod
+    def _baseline_action(estado, forzados: set, exact: bool) -> Optional[str]:
+        """Acción sobre la curva base de un medidor: 'rebuild', 'incremental', 'remove' o None (al día)."""
+        if estado['fecha_max'] is None:
+            return 'remove' if estado['estado_fecha_max'] is not None else None
+        if (estado['deviceid'] in forzados or estado['estado_fecha_max'] is None or estado['sucio']
+                or estado['fecha_max'] < estado['estado_fecha_max']):
+            return 'rebuild'
+        if estado['fecha_max'] > estado['estado_fecha_max']:
+            return 'incremental'
+        if exact and estado['lecturas'] != estado['estado_lecturas']:
+            return 'rebuild'
+        return None
+
+    def _lock_devices(self, recurso: str, device_ids: List[str]):
+        """
+        Toma (hasta el fin de la transacción) un bloqueo consultivo por medidor sobre `recurso`,
+        en orden de deviceid para que dos transacciones con medidores en común no se bloqueen
+        mutuamente.
+        """
+        if not device_ids:
+            return
+        self.db.execute(text("""
+        SELECT pg_advisory_xact_lock(hashtext(:recurso), hashtext(d.deviceid))
+        FROM (SELECT deviceid FROM unnest(CAST(:device_ids AS varchar[])) AS u(deviceid) ORDER BY deviceid) d
+        """), {'recurso': recurso, 'device_ids': sorted(set(device_ids))}).all()
+
+    def _rebuild_baselines(self, base_year: int, device_ids: List[str]):
+        """
+        Recalcula desde cero la curva base de los medidores indicados. Se llama con el bloqueo
+        de los medidores tomado (_lock_devices).
+        """
+        params = {
+            'base_year': base_year,
+            'base_start': datetime(base_year, 1, 1),
+            'base_end': datetime(base_year + 1, 1, 1),
+            'device_ids': list(device_ids),
+            'ahora': datetime.now(),
+        }
+        self.db.execute(text("""
+        DELETE FROM public.m_baseline
+        WHERE base_year = :base_year AND deviceid = ANY(:device_ids)
+        """), params)
+        self.db.execute(text("""
+        INSERT INTO public.m_baseline (deviceid, base_year, weekday, slot, mean, std, count)
+        SELECT l.deviceid, :base_year,
+               EXTRACT(ISODOW FROM l.fecha)::int AS weekday,
+               (EXTRACT(HOUR FROM l.fecha) * 4 + FLOOR(EXTRACT(MINUTE FROM l.fecha) / 15))::int AS slot,
+               AVG(l.kwhd), STDDEV_SAMP(l.kwhd), COUNT(*)
+        FROM public.m_lecturas l
+        WHERE l.fecha >= :base_start AND l.fecha < :base_end AND l.deviceid = ANY(:device_ids)
+        GROUP BY l.deviceid, 3, 4
+        """), params)
+        self.db.execute(text("""
+        INSERT INTO public.m_baseline_estado (deviceid, base_year, lecturas, fecha_max, actualizado, sucio)
+        SELECT l.deviceid, :base_year, COUNT(*), MAX(l.fecha), :ahora, false
+        FROM public.m_lecturas l
+        WHERE l.fecha >= :base_start AND l.fecha < :base_end AND l.deviceid = ANY(:device_ids)
+        GROUP BY l.deviceid
+        ON CONFLICT (deviceid, base_year) DO UPDATE
+        SET lecturas = EXCLUDED.lecturas, fecha_max = EXCLUDED.fecha_max, actualizado = EXCLUDED.actualizado,
+            sucio = false
+        """), params)
+
+    def _drop_baselines(self, base_year: int, device_ids: List[str]):
+        """Elimina la curva base y la marca de agua de medidores que ya no tienen lecturas en el año."""
+        params = {'base_year': base_year, 'device_ids': list(device_ids)}
+        self.db.execute(text("""
+        DELETE FROM public.m_baseline WHERE base_year = :base_year AND deviceid = ANY(:device_ids)
+        """), params)
+        self.db.execute(text("""
+        DELETE FROM public.m_baseline_estado WHERE base_year = :base_year AND deviceid = ANY(:device_ids)
+        """), params)
+
+    def _merge_new_baseline_readings(self, base_year: int, device_ids: List[str]):
+        """
+        Incorpora a la curva base las lecturas posteriores a la marca de agua de cada
+        medidor, combinando conteo, media y desviación estándar sin releer el año completo.
+        """
+        params = {
+            'base_year': base_year,
+            'base_end': datetime(base_year + 1, 1, 1),
+            'device_ids': list(device_ids),
+            'ahora': datetime.now(),
+        }
+        self.db.execute(text("""
+        WITH nuevas AS (
+            SELECT l.deviceid,
+                   EXTRACT(ISODOW FROM l.fecha)::int AS weekday,
+                   (EXTRACT(HOUR FROM l.fecha) * 4 + FLOOR(EXTRACT(MINUTE FROM l.fecha) / 15))::int AS slot,
+                   COUNT(*) AS n,
+                   AVG(l.kwhd) AS mean,
+                   COALESCE(VAR_SAMP(l.kwhd), 0) * (COUNT(*) - 1) AS m2
+            FROM public.m_lecturas l
+            JOIN public.m_baseline_estado e
+              ON e.deviceid = l.deviceid AND e.base_year = :base_year
+            WHERE l.deviceid = ANY(:device_ids) AND l.fecha > e.fecha_max AND l.fecha < :base_end
+            GROUP BY l.deviceid, 2, 3
+        )
+        INSERT INTO public.m_baseline (deviceid, base_year, weekday, slot, mean, std, count)
+        SELECT n.deviceid, :base_year, n.weekday, n.slot,
+               CASE WHEN b.count IS NULL THEN n.mean
+                    ELSE (b.mean * b.count + n.mean * n.n) / (b.count + n.n) END,
+               CASE WHEN COALESCE(b.count, 0) + n.n < 2 THEN NULL
+                    ELSE SQRT((COALESCE(b.std ^ 2 * (b.count - 1), 0) + n.m2
+                               + COALESCE((n.mean - b.mean) ^ 2 * b.count * n.n / (b.count + n.n), 0))
+                              / (COALESCE(b.count, 0) + n.n - 1)) END,
+               COALESCE(b.count, 0) + n.n
+        FROM nuevas n
+        LEFT JOIN public.m_baseline b
+          ON b.deviceid = n.deviceid AND b.base_year = :base_year
+         AND b.weekday = n.weekday AND b.slot = n.slot
+        ON CONFLICT (deviceid, base_year, weekday, slot) DO UPDATE
+        SET mean = EXCLUDED.mean, std = EXCLUDED.std, count = EXCLUDED.count
+        """), params)
+        self.db.execute(text("""
+        UPDATE public.m_baseline_estado e
+        SET lecturas = e.lecturas + n.lecturas, fecha_max = n.fecha_max, actualizado = :ahora
+        FROM (
+            SELECT l.deviceid, COUNT(*) AS lecturas, MAX(l.fecha) AS fecha_max
+            FROM public.m_lecturas l
+            JOIN public.m_baseline_estado e2
+              ON e2.deviceid = l.deviceid AND e2.base_year = :base_year
+            WHERE l.deviceid = ANY(:device_ids) AND l.fecha > e2.fecha_max AND l.fecha < :base_end
+            GROUP BY l.deviceid
+        ) n
+        WHERE e.deviceid = n.deviceid AND e.base_year = :base_year
+        """), params)
+
+    def get_fleet_outlier_curves(self, base_year: int, start_date: datetime, end_date: datetime, threshold: float,
+                                 device_ids: Optional[List[str]] = None):
+        """
+        Calcula en PostgreSQL, para todos los medidores activos (o los indicados en device_ids),
+        la desviación de cada lectura del rango [start_date, end_date) contra la curva base
+        materializada (día de la semana e intervalo de 15 minutos) del año base, y retorna solo
+        las lecturas de los días-medidor cuya desviación máxima absoluta supera el umbral.
+
+        Cada fila contiene: deviceid, dia, time_str, value, mean y std,
+        ordenadas por medidor, día y hora.
+        """
+        params = {
+            'base_year': base_year,
+            'start_date': start_date,
+            'end_date': end_date,
+            'threshold': threshold
+        }
+        device_filter = ""
+        if device_ids is not None:
+            device_filter = "AND l.deviceid = ANY(:device_ids)"
+            params['device_ids'] = list(device_ids)
+
+        query = text(f"""
+        WITH desviaciones AS (
+            SELECT l.deviceid,
+                   l.fecha::date AS dia,
+                   l.fecha,
+                   l.kwhd AS value,
+                   b.mean,
+                   b.std,
+                   CASE
+                       WHEN b.mean <> 0 THEN (l.kwhd - b.mean) / b.mean * 100
+                       WHEN l.kwhd <> 0 THEN 'Infinity'::float8
+                       ELSE 0
+                   END AS percentage_diff
+            FROM public.m_lecturas l
+            JOIN public.medidor m ON m.deviceid = l.deviceid AND m.desactivado IS NULL
+            JOIN public.m_baseline b
+              ON b.deviceid = l.deviceid
+             AND b.base_year = :base_year
+             AND b.weekday = EXTRACT(ISODOW FROM l.fecha)::int
+             AND b.slot = (EXTRACT(HOUR FROM l.fecha) * 4 + FLOOR(EXTRACT(MINUTE FROM l.fecha) / 15))::int
+            WHERE l.fecha >= :start_date AND l.fecha < :end_date {device_filter}
+        ),
+        marcadas AS (
+            SELECT d.*,
+                   MAX(ABS(d.percentage_diff)) OVER (PARTITION BY d.deviceid, d.dia) AS max_deviation
+            FROM desviaciones d
+        )
+        SELECT deviceid, dia, to_char(fecha, 'HH24:MI') AS time_str, value, mean, std
+        FROM marcadas
+        WHERE max_deviation >= :threshold
+        ORDER BY deviceid, dia, fecha
+        """)
+
+        return self.db.execute(query, params).mappings().all()
+
+    def get_device_day_curve(self, device_id: str, base_year: int, day_start: datetime, day_end: datetime):
+        """
+        Curva de un medidor en [day_start, day_end) con la curva base materializada del año base
+        (mean y std en None en los intervalos sin curva base). Filas: time_str, value, mean, std.
+        """
+        return self.db.execute(text("""
+        SELECT to_char(l.fecha, 'HH24:MI') AS time_str, l.kwhd AS value, b.mean, b.std
+        FROM public.m_lecturas l
+        LEFT JOIN public.m_baseline b
+          ON b.deviceid = l.deviceid
+         AND b.base_year = :base_year
+         AND b.weekday = EXTRACT(ISODOW FROM l.fecha)::int
+         AND b.slot = (EXTRACT(HOUR FROM l.fecha) * 4 + FLOOR(EXTRACT(MINUTE FROM l.fecha) / 15))::int
+        WHERE l.deviceid = :device_id AND l.fecha >= :day_start AND l.fecha < :day_end
+        ORDER BY l.fecha
+        """), {
+            'device_id': device_id,
+            'base_year': base_year,
+            'day_start': day_start,
+            'day_end': day_end
+        }).mappings().all()
+
+    def get_fleet_period_energy(self, current_start: datetime, current_end: datetime,
+                                previous_start: datetime, previous_end: datetime):
+        """
+        Calcula, para todos los medidores activos, la energía (kWh) y el número de lecturas de
+        dos periodos [inicio, fin) con una consulta por periodo sobre los agregados.
+
+        Cada fila contiene: deviceid, description, customerid, current_kwh, current_count,
+        previous_kwh y previous_count (kWh en None si el medidor no tiene lecturas en el periodo).
+        """
+        medidores = self.db.query(Medidor.deviceid, Medidor.description, Medidor.customerid).filter(
+            Medidor.desactivado.is_(None)
+        ).all()
+        device_ids = [m.deviceid for m in medidores]
+
+        actual = {r['deviceid']: r for r in self.get_period_aggregates(device_ids, current_start, current_end)}
+        anterior = {r['deviceid']: r for r in self.get_period_aggregates(device_ids, previous_start, previous_end)}
+
+        rows = []
+        for m in medidores:
+            cur, prev = actual.get(m.deviceid), anterior.get(m.deviceid)
+            if cur is None and prev is None:
+                continue
+            rows.append({
+                'deviceid': m.deviceid,
+                'description': m.description,
+                'customerid': m.customerid,
+                'current_kwh': cur['total_kwh'] if cur else None,
+                'current_count': cur['lecturas'] if cur else 0,
+                'previous_kwh': prev['total_kwh'] if prev else None,
+                'previous_count': prev['lecturas'] if prev else 0
+            })
+        return rows
+
     def get_historical_year_data(self, device_id: str, year: int):
-        """Obtiene todas las lecturas de un año para calcular la baseline."""
+        """Obtiene todas las lecturas de un año [1 de enero, 1 de enero siguiente) para calcular la baseline."""
         return self.db.query(MLectura).filter(
             MLectura.deviceid == device_id,
-            extract('year', MLectura.fecha) == year
+            MLectura.fecha >= datetime(year, 1, 1),
+            MLectura.fecha < datetime(year + 1, 1, 1)
         ).all()
     
     def get_available_years(self, device_id: str):
-        """Retorna lista de años disponibles para un dispositivo."""
-        years = self.db.query(extract('year', MLectura.fecha)).filter(
-            MLectura.deviceid == device_id
-        ).distinct().all()
-        return sorted([int(y[0]) for y in years])
+        """
+        Retorna lista de años disponibles para un dispositivo.
+        Recorre el índice (deviceid, fecha) saltando de año en año: una búsqueda por año
+        con datos en lugar de leer todas las lecturas del medidor.
+        """
+        years = self.db.execute(text("""
+            WITH RECURSIVE anios AS (
+                SELECT date_trunc('year', MIN(fecha)) AS inicio
+                FROM public.m_lecturas
+                WHERE deviceid = :device_id
+                UNION ALL
+                SELECT (
+                    SELECT date_trunc('year', MIN(l.fecha))
+                    FROM public.m_lecturas l
+                    WHERE l.deviceid = :device_id AND l.fecha >= a.inicio + interval '1 year'
+                )
+                FROM anios a
+                WHERE a.inicio IS NOT NULL
+            )
+            SELECT EXTRACT(YEAR FROM inicio)::int FROM anios WHERE inicio IS NOT NULL
+        """), {'device_id': device_id}).scalars().all()
+        return sorted(years)
 
     # Nuevos métodos para la tabla medidor
     def get_medidor(self, device_id: str) -> Optional[Medidor]:
@@ -65,6 +812,10 @@ class EnergyRepository:
         """Obtiene medidores activos (donde desactivado es NULL)."""
         return self.db.query(Medidor).filter(Medidor.desactivado.is_(None)).all()
     
+    def get_medidores_by_ids(self, device_ids: List[str]) -> List[Medidor]:
+        """Obtiene los medidores de una lista de deviceid."""
+        return self.db.query(Medidor).filter(Medidor.deviceid.in_(list(device_ids))).all()
+
     def count_active_medidores(self) -> int:
         """Cuenta el número de medidores activos."""
         return self.db.query(Medidor).filter(Medidor.desactivado.is_(None)).count()
@@ -160,30 +911,64 @@ class EnergyRepository:
             joinedload(Medidor.localidad).joinedload(Localidad.municipio).joinedload(Municipio.departamento)
         ).all()
     
-    def search_medidores(self, search_term: str) -> List[Medidor]:
+    def get_period_summary_batch(self, start_date, end_date, device_ids: Optional[List[str]] = None,
+                                 departamento: Optional[str] = None, municipio: Optional[str] = None,
+                                 localidad: Optional[str] = None) -> List[dict]:
         """
-        Búsqueda flexible de medidores por:
-        - Device ID
-        - Descripción
-        - Localidad
-        - Municipio
-        - Departamento
+        Obtiene en una sola consulta, para varios medidores, la energía total (kWh), el número de
+        lecturas, la potencia promedio y la potencia máxima (kW) con su fecha en un periodo.
+        Los medidores se indican por lista de deviceid y/o por filtro geográfico (nombre parcial
+        de departamento, municipio o localidad, igual que las búsquedas por nombre).
+        Los medidores sin lecturas en el periodo no aparecen en el resultado.
         """
-        return self.db.query(Medidor).join(
-            Localidad, Medidor.id_loc == Localidad.id_loc, isouter=True
-        ).join(
-            Municipio, Localidad.id_mun == Municipio.id_mun, isouter=True
-        ).join(
-            Departamento, Municipio.id_dep == Departamento.id_dep, isouter=True
-        ).filter(
-            (Medidor.deviceid.ilike(f"%{search_term}%")) |
-            (Medidor.description.ilike(f"%{search_term}%")) |
-            (Localidad.localidad.ilike(f"%{search_term}%")) |
-            (Municipio.municipio.ilike(f"%{search_term}%")) |
-            (Departamento.departamento.ilike(f"%{search_term}%"))
-        ).options(
-            joinedload(Medidor.localidad).joinedload(Localidad.municipio).joinedload(Municipio.departamento)
-        ).all()
+        start_date, end_date = self._period_days(start_date, end_date)
+
+        if departamento or municipio or localidad:
+            query = self.db.query(Medidor.deviceid).join(
+                Localidad, Medidor.id_loc == Localidad.id_loc
+            ).join(
+                Municipio, Localidad.id_mun == Municipio.id_mun
+            ).join(
+                Departamento, Municipio.id_dep == Departamento.id_dep
+            )
+            if departamento:
+                query = query.filter(Departamento.departamento.ilike(f"%{departamento}%"))
+            if municipio:
+                query = query.filter(Municipio.municipio.ilike(f"%{municipio}%"))
+            if localidad:
+                query = query.filter(Localidad.localidad.ilike(f"%{localidad}%"))
+            if device_ids:
+                query = query.filter(Medidor.deviceid.in_(device_ids))
+            device_ids = [d for (d,) in query.all()]
+
+        period = {
+            'start_date': start_date.strftime("%Y-%m-%d"),
+            'end_date': end_date.strftime("%Y-%m-%d"),
+            'period_days': (end_date.date() - start_date.date()).days + 1
+        }
+
+        return [
+            {
+                'device_id': row['deviceid'],
+                'total_energy_kwh': row['total_kwh'],
+                'reading_count': row['lecturas'],
+                'average_power_kw': row['total_kwh'] / 0.25 / row['lecturas'],
+                'max_power_kw': row['kwhd_max'] / 0.25,
+                'max_kwhd': row['kwhd_max'],
+                'datetime': row['kwhd_max_fecha'],
+                **period
+            }
+            for row in self.get_period_aggregates(device_ids or [], start_date, end_date + timedelta(days=1))
+        ]
+
+    def _period_days(self, start_date, end_date):
+        """Normaliza un periodo de días (YYYY-MM-DD o datetime) a medianoche del primer y último día."""
+        if isinstance(start_date, str):
+            start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, "%Y-%m-%d")
+        return (start_date.replace(hour=0, minute=0, second=0, microsecond=0),
+                end_date.replace(hour=0, minute=0, second=0, microsecond=0))
 
     def get_max_power_in_period(self, device_id: str, start_date: str, end_date: str):
         """
@@ -191,48 +976,26 @@ class EnergyRepository:
         La potencia se calcula como: kwhd / 0.25 (asumiendo lecturas cada 15 minutos)
         """
         try:
-            # Convertir fechas a objetos datetime si son strings
-            if isinstance(start_date, str):
-                start_date = datetime.strptime(start_date, "%Y-%m-%d")
-            if isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, "%Y-%m-%d")
-            
-            # Ajustar fechas para incluir todo el rango con horas
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
+            start_date, end_date = self._period_days(start_date, end_date)
+
             print(f"[DEBUG] Buscando potencia máxima para device_id='{device_id}' desde {start_date} hasta {end_date}")
-            
-            # Consulta para obtener el máximo valor de kwhd en el periodo
-            max_kwhd = self.db.query(func.max(MLectura.kwhd)).filter(
-                MLectura.deviceid == device_id,
-                MLectura.fecha >= start_date,
-                MLectura.fecha <= end_date
-            ).scalar()
-            
-            if max_kwhd is None:
+
+            # Máximo kwhd del periodo y su fecha, desde los agregados
+            rows = self.get_period_aggregates([device_id], start_date, end_date + timedelta(days=1))
+            if not rows:
                 return None
-            
-            # Calcular potencia máxima (kW) = kwhd / 0.25
-            max_power_kw = max_kwhd / 0.25
-            
-            # Obtener también la fecha y hora del máximo
-            max_record = self.db.query(MLectura).filter(
-                MLectura.deviceid == device_id,
-                MLectura.fecha >= start_date,
-                MLectura.fecha <= end_date,
-                MLectura.kwhd == max_kwhd
-            ).first()
-            
+
+            max_kwhd = rows[0]['kwhd_max']
+
             return {
                 'device_id': device_id,
-                'max_power_kw': max_power_kw,
+                'max_power_kw': max_kwhd / 0.25,
                 'max_kwhd': max_kwhd,
-                'datetime': max_record.fecha if max_record else None,
+                'datetime': rows[0]['kwhd_max_fecha'],
                 'start_date': start_date.strftime("%Y-%m-%d"),
                 'end_date': end_date.strftime("%Y-%m-%d")
             }
-            
+
         except Exception as e:
             print(f"Error en get_max_power_in_period: {e}")
             return None
@@ -243,40 +1006,24 @@ class EnergyRepository:
         La energía se calcula como la suma de todos los valores kwhd en el periodo.
         """
         try:
-            # Convertir fechas a objetos datetime si son strings
-            if isinstance(start_date, str):
-                start_date = datetime.strptime(start_date, "%Y-%m-%d")
-            if isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, "%Y-%m-%d")
-            
-            # Ajustar fechas para incluir todo el rango con horas
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
+            start_date, end_date = self._period_days(start_date, end_date)
+
             print(f"[DEBUG] Buscando energía para device_id='{device_id}' desde {start_date} hasta {end_date}")
-            
-            # Consulta para obtener la suma total de kwhd en el periodo
-            total_energy = self.db.query(func.sum(MLectura.kwhd)).filter(
-                MLectura.deviceid == device_id,
-                MLectura.fecha >= start_date,
-                MLectura.fecha <= end_date
-            ).scalar()
-            
+
+            # Suma de kwhd y conteo de lecturas del periodo, desde los agregados
+            rows = self.get_period_aggregates([device_id], start_date, end_date + timedelta(days=1))
+            total_energy = rows[0]['total_kwh'] if rows else None
+
             print(f"[DEBUG] Total energy encontrado: {total_energy}")
-            
+
             if total_energy is None:
                 return None
-            
-            # Obtener también el conteo de lecturas
-            reading_count = self.db.query(func.count(MLectura.kwhd)).filter(
-                MLectura.deviceid == device_id,
-                MLectura.fecha >= start_date,
-                MLectura.fecha <= end_date
-            ).scalar()
-            
+
+            reading_count = rows[0]['lecturas']
+
             # Calcular promedio si hay lecturas
             avg_power_kw = (total_energy / 0.25 / reading_count) if reading_count > 0 else 0
-            
+
             return {
                 'device_id': device_id,
                 'total_energy_kwh': total_energy,
@@ -286,7 +1033,219 @@ class EnergyRepository:
                 'end_date': end_date.strftime("%Y-%m-%d"),
                 'period_days': (end_date.date() - start_date.date()).days + 1
             }
-            
+
         except Exception as e:
             print(f"Error en get_total_energy_in_period: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_available_data_summary(self, limit: int = 10) -> List[dict]:
+        """
+        Resumen de los medidores con más lecturas: primer y último día con datos y total de lecturas,
+        calculado desde los agregados diarios (y las lecturas posteriores a la marca de agua).
+        """
+        medidores = {m.deviceid: m.description for m in self.db.query(Medidor.deviceid, Medidor.description).all()}
+        rows = self.get_period_aggregates(list(medidores), self.ROLLUP_FECHA_MIN, self.ROLLUP_FECHA_MAX)
+        rows = sorted(rows, key=lambda r: r['lecturas'], reverse=True)[:limit]
+        return [
+            {
+                'deviceid': r['deviceid'],
+                'description': medidores[r['deviceid']],
+                'fecha_min': r['dia_min'],
+                'fecha_max': r['dia_max'],
+                'total_lecturas': r['lecturas']
+            }
+            for r in rows
+        ]
+
+    # Métodos para la caché persistente de análisis (m_analisis_cache)
+    def get_cached_analysis(self, clave: str) -> Optional[dict]:
+        """Retorna el análisis guardado con la clave si no ha vencido."""
+        try:
+            resultado = self.db.query(MAnalisisCache.resultado).filter(
+                MAnalisisCache.clave == clave,
+                MAnalisisCache.expira > datetime.now()
+            ).scalar()
+        except Exception:
+            self.db.rollback()
+            raise
+        return json.loads(resultado) if resultado is not None else None
+
+    def save_cached_analysis(self, clave: str, analysis: dict, ttl_seconds: int, deviceid: str,
+                             fecha, base_year: Optional[int], model_id: str):
+        """Guarda (o reemplaza) un análisis y elimina de paso los vencidos."""
+        ahora = datetime.now()
+        try:
+            self.db.execute(text("DELETE FROM public.m_analisis_cache WHERE expira <= :ahora"), {'ahora': ahora})
+            self.db.execute(text("""
+                INSERT INTO public.m_analisis_cache (clave, deviceid, fecha, base_year, model_id, resultado, creado, expira)
+                VALUES (:clave, :deviceid, :fecha, :base_year, :model_id, :resultado, :creado, :expira)
+                ON CONFLICT (clave) DO UPDATE
+                SET resultado = EXCLUDED.resultado, creado = EXCLUDED.creado, expira = EXCLUDED.expira
+            """), {
+                'clave': clave,
+                'deviceid': deviceid,
+                'fecha': pd.to_datetime(fecha).date(),
+                'base_year': base_year,
+                'model_id': model_id,
+                'resultado': json.dumps(analysis, ensure_ascii=False),
+                'creado': ahora,
+                'expira': ahora + timedelta(seconds=ttl_seconds)
+            })
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def count_cached_analyses(self) -> int:
+        """Número de análisis vigentes en la caché persistente."""
+        return self.db.query(func.count(MAnalisisCache.clave)).filter(
+            MAnalisisCache.expira > datetime.now()
+        ).scalar()
+
+    # --- Sesiones del chat ---
+
+    def get_chat_session(self, session_id: str) -> Optional[dict]:
+        """Retorna el estado guardado de la sesión si no ha vencido."""
+        try:
+            estado = self.db.query(MChatSesion.estado).filter(
+                MChatSesion.id == session_id,
+                MChatSesion.expira > datetime.now()
+            ).scalar()
+        except Exception:
+            self.db.rollback()
+            raise
+        return json.loads(estado) if estado is not None else None
+
+    def save_chat_session(self, session_id: str, estado: dict, ttl_seconds: int):
+        """Guarda (o reemplaza) el estado de una sesión y elimina de paso las vencidas."""
+        ahora = datetime.now()
+        try:
+            self.db.execute(text("DELETE FROM public.m_chat_sesiones WHERE expira <= :ahora"), {'ahora': ahora})
+            self.db.execute(text("""
+                INSERT INTO public.m_chat_sesiones (id, estado, actualizado, expira)
+                VALUES (:id, :estado, :actualizado, :expira)
+                ON CONFLICT (id) DO UPDATE
+                SET estado = EXCLUDED.estado, actualizado = EXCLUDED.actualizado, expira = EXCLUDED.expira
+            """), {
+                'id': session_id,
+                'estado': json.dumps(estado, ensure_ascii=False, default=str),
+                'actualizado': ahora,
+                'expira': ahora + timedelta(seconds=ttl_seconds)
+            })
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def delete_chat_session(self, session_id: str):
+        try:
+            self.db.execute(text("DELETE FROM public.m_chat_sesiones WHERE id = :id"), {'id': session_id})
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    # --- Trabajos en segundo plano ---
+
+    def create_job(self, job_id: str, tipo: str, clave: str, parametros: dict,
+                   propietario: Optional[str] = None) -> MTrabajo:
+        """Registra un trabajo pendiente del proceso `propietario`."""
+        ahora = datetime.now()
+        job = MTrabajo(
+            id=job_id, tipo=tipo, clave=clave,
+            parametros=json.dumps(parametros, ensure_ascii=False),
+            estado='pendiente', procesados=0, anomalias=0,
+            creado=ahora, actualizado=ahora, propietario=propietario
+        )
+        try:
+            self.db.add(job)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return job
+
+    def get_job(self, job_id: str) -> Optional[MTrabajo]:
+        return self.db.query(MTrabajo).filter(MTrabajo.id == job_id).first()
+
+    def find_reusable_job(self, tipo: str, clave: str, completed_since: datetime,
+                          alive_since: Optional[datetime] = None) -> Optional[MTrabajo]:
+        """
+        Trabajo con los mismos parámetros que sigue pendiente o en curso (con latido posterior a
+        alive_since, si se indica), o que terminó correctamente después de completed_since (el más reciente).
+        """
+        activo = MTrabajo.estado.in_(['pendiente', 'en_curso'])
+        if alive_since is not None:
+            activo = activo & (MTrabajo.actualizado >= alive_since)
+        return self.db.query(MTrabajo).filter(
+            MTrabajo.tipo == tipo,
+            MTrabajo.clave == clave,
+            activo | ((MTrabajo.estado == 'completado') & (MTrabajo.terminado >= completed_since))
+        ).order_by(MTrabajo.creado.desc()).first()
+
+    def update_job(self, job_id: str, active_only: bool = False, **campos) -> bool:
+        """
+        Actualiza el estado, progreso o resultado de un trabajo (campos de MTrabajo). Con active_only
+        solo si sigue pendiente o en curso; retorna False si no se actualizó (p. ej. ya fue cancelado).
+        """
+        campos['actualizado'] = datetime.now()
+        query = self.db.query(MTrabajo).filter(MTrabajo.id == job_id)
+        if active_only:
+            query = query.filter(MTrabajo.estado.in_(['pendiente', 'en_curso']))
+        try:
+            count = query.update(campos, synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return count > 0
+
+    def list_jobs(self, limit: int = 50) -> List[MTrabajo]:
+        """Trabajos más recientes primero."""
+        return self.db.query(MTrabajo).order_by(MTrabajo.creado.desc()).limit(limit).all()
+
+    def touch_jobs(self, job_ids: List[str]) -> None:
+        """Latido: renueva la fecha de actualización de los trabajos activos indicados."""
+        if not job_ids:
+            return
+        try:
+            self.db.query(MTrabajo).filter(
+                MTrabajo.id.in_(list(job_ids)),
+                MTrabajo.estado.in_(['pendiente', 'en_curso'])
+            ).update({'actualizado': datetime.now()}, synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+    def active_job_owners(self) -> List[str]:
+        """Procesos propietarios de trabajos pendientes o en curso."""
+        return [p for (p,) in self.db.query(MTrabajo.propietario).filter(
+            MTrabajo.estado.in_(['pendiente', 'en_curso']),
+            MTrabajo.propietario.isnot(None)
+        ).distinct().all()]
+
+    def mark_interrupted_jobs(self, stale_before: datetime, owners: Optional[List[str]] = None) -> int:
+        """
+        Marca como interrumpidos los trabajos pendientes o en curso sin latido desde stale_before,
+        o cuyo proceso propietario (owners) ya terminó.
+        """
+        ahora = datetime.now()
+        huerfano = MTrabajo.actualizado < stale_before
+        if owners:
+            huerfano = huerfano | MTrabajo.propietario.in_(list(owners))
+        try:
+            count = self.db.query(MTrabajo).filter(
+                MTrabajo.estado.in_(['pendiente', 'en_curso']),
+                huerfano
+            ).update({
+                'estado': 'interrumpido',
+                'error': 'El proceso que ejecutaba el trabajo terminó antes de completarlo',
+                'terminado': ahora,
+                'actualizado': ahora
+            }, synchronize_session=False)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return count
@@ -1,20 +1,34 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 from app.core.config import settings
 from app.api import endpoints
-from app.data.database import engine, Base
+from app.data.database import engine
+from app.data.partitions import setup_schema
+from app.core.container import init_container, shutdown_container
+from app.core.metrics import MetricsMiddleware
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
-# Inicializar Tablas (Opcional: mejor usar migraciones como Alembic en prod)
-Base.metadata.create_all(bind=engine)
+# Inicializar Tablas y particiones de m_lecturas (Opcional: mejor usar migraciones como Alembic en prod)
+setup_schema(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Objetos compartidos durante toda la vida de la aplicación (cliente Gemini, prompts, observadores, cachés)
+    app.state.container = init_container()
+    # Los trabajos huérfanos (de una ejecución anterior o de un proceso sin latido) ya no tienen hilo que los termine
+    app.state.container.jobs.mark_interrupted()
+    yield
+    await shutdown_container()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
-    version=settings.PROJECT_VERSION
+    version=settings.PROJECT_VERSION,
+    lifespan=lifespan
 )
 
 # Configuración CORS
@@ -24,8 +38,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Duración por etapa de cada solicitud (/metrics y encabezado Server-Timing)
+app.add_middleware(MetricsMiddleware)
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
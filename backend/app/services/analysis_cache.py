@@ -0,0 +1,134 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import pandas as pd
+
+from app.core.config import settings
+
+# Versión de la clave: incrementarla cuando cambie el prompt o el formato del análisis
+ANALYSIS_CACHE_VERSION = 1
+
+# Columnas de la curva combinada que determinan el análisis
+CURVE_COLUMNS = ['time_str', 'value', 'mean', 'std']
+
+
+def analysis_cache_key(device_id: str, target_date: str, base_year: Optional[int], model_id: str,
+                       merged_df: pd.DataFrame, estado_general: str) -> str:
+    """
+    Clave direccionada por contenido (sha256) de un análisis: medidor, fecha, año base,
+    modelo y hash de la curva real vs esperada con su estado calculado.
+    """
+    columns = [c for c in CURVE_COLUMNS if c in merged_df.columns]
+    curva = merged_df[columns].to_json(orient='split', index=False, double_precision=10)
+    contenido = json.dumps({
+        'v': ANALYSIS_CACHE_VERSION,
+        'device_id': device_id,
+        'fecha': str(pd.to_datetime(target_date).date()),
+        'base_year': base_year,
+        'model_id': model_id,
+        'estado': estado_general,
+        'curva': hashlib.sha256(curva.encode('utf-8')).hexdigest()
+    }, sort_keys=True)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Caché de análisis de curvas de carga en dos niveles:
+
+    - Memoria: LRU acotado a `capacity` entradas con vencimiento `ttl_seconds`.
+    - Persistente: tabla m_analisis_cache, a través del repositorio que se pase a get/put,
+      compartida entre procesos y reinicios. Los fallos de este nivel no interrumpen el análisis.
+    """
+
+    def __init__(self, capacity: int = 512, ttl_seconds: int = 7 * 24 * 3600):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, repo=None) -> Optional[Any]:
+        """Retorna el análisis guardado o None. Un acierto en la tabla se promueve a memoria."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expira = entry
+                if expira > time.time():
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self.expirations += 1
+
+        if repo is not None:
+            try:
+                value = repo.get_cached_analysis(key)
+            except Exception as e:
+                print(f"[INFO] Caché de análisis no disponible en base de datos: {e}")
+                value = None
+            if value is not None:
+                with self._lock:
+                    self.db_hits += 1
+                self._remember(key, copy.deepcopy(value))
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any, repo=None, **meta):
+        """Guarda un análisis en memoria y, si se pasa el repositorio, en la tabla (meta: deviceid, fecha, base_year, model_id)."""
+        self._remember(key, copy.deepcopy(value))
+        with self._lock:
+            self.stores += 1
+        if repo is not None:
+            try:
+                repo.save_cached_analysis(key, value, ttl_seconds=self.ttl_seconds, **meta)
+            except Exception as e:
+                print(f"[INFO] No se pudo persistir el análisis en caché: {e}")
+
+    def _remember(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'ttl_seconds': self.ttl_seconds,
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else None
+            }
+
+
+# Instancia compartida por el proceso
+analysis_cache = AnalysisCache(
+    capacity=settings.ANALYSIS_CACHE_SIZE,
+    ttl_seconds=settings.ANALYSIS_CACHE_TTL_SECONDS
+)
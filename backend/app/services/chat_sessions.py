@@ -0,0 +1,127 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.core.config import settings
+
+
+class ChatSessionStore:
+    """
+    Estado de las conversaciones del chat por id de sesión del cliente, para que una consulta de
+    seguimiento ("¿y en septiembre?", "muéstrame el segundo") reutilice lo ya resuelto:
+
+    - Confirmación pendiente (búsqueda de anomalías), último análisis de consulta y última lista
+      mostrada (medidores encontrados, anomalías o el trabajo que las busca).
+    - Memoria: LRU acotado a `capacity` sesiones que vencen tras `ttl_seconds` sin actividad.
+    - Persistente (si `persist`): tabla m_chat_sesiones, a través del repositorio que se pase a
+      get/put, compartida entre procesos y reinicios. Los fallos de este nivel no interrumpen el chat.
+
+    El estado solo guarda referencias en JSON (medidor, fechas, año base, id de trabajo): las curvas
+    y los análisis se recuperan de la caché de análisis y de la tabla de trabajos.
+    """
+
+    def __init__(self, capacity: int = 2048, ttl_seconds: int = 2 * 3600, persist: bool = True):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: str, repo=None) -> dict:
+        """Retorna una copia del estado de la sesión ({} si es nueva o venció)."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                state, expira = entry
+                if expira > time.time():
+                    self._entries.move_to_end(session_id)
+                    self.memory_hits += 1
+                    return copy.deepcopy(state)
+                del self._entries[session_id]
+                self.expirations += 1
+
+        if repo is not None and self.persist:
+            try:
+                state = repo.get_chat_session(session_id)
+            except Exception as e:
+                print(f"[INFO] Sesiones del chat no disponibles en base de datos: {e}")
+                state = None
+            if state is not None:
+                with self._lock:
+                    self.db_hits += 1
+                self._remember(session_id, copy.deepcopy(state))
+                return state
+
+        with self._lock:
+            self.misses += 1
+        return {}
+
+    def put(self, session_id: str, state: dict, repo=None):
+        """Guarda el estado de la sesión (y renueva su vencimiento)."""
+        self._remember(session_id, copy.deepcopy(state))
+        with self._lock:
+            self.stores += 1
+        if repo is not None and self.persist:
+            try:
+                repo.save_chat_session(session_id, state, ttl_seconds=self.ttl_seconds)
+            except Exception as e:
+                print(f"[INFO] No se pudo persistir la sesión del chat: {e}")
+
+    def delete(self, session_id: str, repo=None) -> bool:
+        with self._lock:
+            existia = self._entries.pop(session_id, None) is not None
+        if repo is not None and self.persist:
+            try:
+                repo.delete_chat_session(session_id)
+            except Exception as e:
+                print(f"[INFO] No se pudo eliminar la sesión del chat: {e}")
+        return existia
+
+    def _remember(self, session_id: str, state: dict):
+        with self._lock:
+            self._entries[session_id] = (state, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.db_hits + self.misses
+            return {
+                'sessions': len(self._entries),
+                'capacity': self.capacity,
+                'ttl_seconds': self.ttl_seconds,
+                'persist': self.persist,
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round((self.memory_hits + self.db_hits) / lookups, 4) if lookups else None
+            }
+
+
+# Instancia compartida por el proceso
+chat_sessions = ChatSessionStore(
+    capacity=settings.CHAT_SESSION_SIZE,
+    ttl_seconds=settings.CHAT_SESSION_TTL_SECONDS,
+    persist=settings.CHAT_SESSION_PERSIST
+)
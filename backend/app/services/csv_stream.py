@@ -0,0 +1,75 @@
+import csv
+import io
+from typing import BinaryIO, Iterator, Sequence
+
+import pandas as pd
+
+from app.core.config import settings
+
+# Columnas de lectura reconocidas en los CSV de carga/histórico
+CSV_COLUMNS = ('timestamp', 'value', 'kvarhd')
+NUMERIC_COLUMNS = ('value', 'kvarhd')
+
+
+def _normalize_column(name: str) -> str:
+    return name.lower().strip()
+
+
+def read_csv_header(fileobj: BinaryIO) -> dict:
+    """
+    Lee solo la línea de encabezado y retorna el mapeo {nombre normalizado: nombre original}.
+    Deja el archivo posicionado al inicio.
+    """
+    first_line = fileobj.readline()
+    fileobj.seek(0)
+    if isinstance(first_line, bytes):
+        first_line = first_line.decode('utf-8-sig')
+    header = next(csv.reader(io.StringIO(first_line)), [])
+    return {_normalize_column(col): col for col in header}
+
+
+def iter_csv_batches(
+    fileobj: BinaryIO,
+    columns: Sequence[str] = CSV_COLUMNS,
+    required: Sequence[str] = ('timestamp',),
+    chunk_rows: int = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Lee un CSV en bloques sin cargarlo completo en memoria.
+
+    Solo se parsean las columnas solicitadas (si existen en el archivo); los encabezados se
+    normalizan una sola vez y cada bloque se entrega tipado: 'timestamp' como datetime64
+    (NaT si es inválido) y 'value'/'kvarhd' como float64 (NaN si es inválido).
+    El índice de cada bloque continúa la numeración de filas del archivo (0 = primera fila de datos).
+
+    Args:
+        fileobj: archivo binario (por ejemplo UploadFile.file).
+        columns: columnas a leer.
+        required: columnas obligatorias; si falta alguna se lanza ValueError.
+        chunk_rows: filas por bloque (por defecto settings.CSV_CHUNK_ROWS).
+    """
+    header = read_csv_header(fileobj)
+    for col in required:
+        if col not in header:
+            raise ValueError(f"Columna requerida '{col}' no encontrada en el CSV")
+
+    wanted = [col for col in columns if col in header]
+    rename = {header[col]: col for col in wanted}
+    dtype = {header[col]: 'object' for col in wanted if col not in NUMERIC_COLUMNS}
+
+    reader = pd.read_csv(
+        fileobj,
+        usecols=list(rename.keys()),
+        dtype=dtype,
+        chunksize=chunk_rows or settings.CSV_CHUNK_ROWS,
+        encoding='utf-8-sig'
+    )
+
+    for chunk in reader:
+        chunk = chunk.rename(columns=rename)
+        if 'timestamp' in chunk.columns:
+            chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], errors='coerce')
+        for col in NUMERIC_COLUMNS:
+            if col in chunk.columns:
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+        yield chunk
@@ -0,0 +1,98 @@
+import json
+import math
+from typing import Iterable, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # Declarada en requirements.txt; sin ella Accept: application/x-msgpack responde 406
+    msgpack = None
+
+# Eje fijo de las curvas diarias: 96 intervalos de 15 minutos (slot i = i * 15 minutos desde las 00:00)
+SLOTS_PER_DAY = 96
+SLOT_MINUTES = 15
+# Campos del eje de tiempo: implícitos en la posición del arreglo, no se repiten en la codificación columnar
+AXIS_FIELDS = ('time_str', 'timestamp')
+
+# Modos de curvas en las respuestas: lista de puntos (formato original), columnas paralelas o sin curvas
+CURVE_MODES = ('records', 'columnar', 'none')
+
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+
+
+def _slot(time_str: str) -> int:
+    horas, minutos = time_str.split(':')[:2]
+    return int(horas) * 4 + int(minutos) // SLOT_MINUTES
+
+
+def columnar_curve(chart_data: List[dict]) -> dict:
+    """
+    Codifica una curva (lista de puntos con time_str y value, mean, std, percentage_diff, ...) como
+    arreglos paralelos de 96 posiciones sobre el eje fijo de intervalos; los intervalos sin
+    lectura quedan en null.
+    """
+    campos = [campo for campo in chart_data[0] if campo not in AXIS_FIELDS] if chart_data else []
+    columnas = {campo: [None] * SLOTS_PER_DAY for campo in campos}
+    for punto in chart_data:
+        slot = _slot(punto['time_str'])
+        for campo in campos:
+            columnas[campo][slot] = punto.get(campo)
+    return {
+        'encoding': 'columnar',
+        'slots': SLOTS_PER_DAY,
+        'slot_minutes': SLOT_MINUTES,
+        **columnas
+    }
+
+
+def curve_url(device_id: str, fecha: str, base_year: int) -> str:
+    return f"/curves/{device_id}/{fecha}?base_year={base_year}"
+
+
+def shape_outliers(resultados: Iterable[dict], curves: str, base_year: int) -> List[dict]:
+    """
+    Aplica el modo de curvas a resultados de find_outlier_devices:
+    - records: sin cambios (chart_data como lista de puntos).
+    - columnar: chart_data como arreglos paralelos de 96 intervalos.
+    - none: solo el resumen, con curve_url para pedir la curva en /curves.
+    """
+    if curves == 'records':
+        return list(resultados)
+    shaped = []
+    for resultado in resultados:
+        resumen = {k: v for k, v in resultado.items() if k != 'chart_data'}
+        if curves == 'columnar':
+            resumen['chart_data'] = columnar_curve(resultado['chart_data'])
+        else:
+            resumen['curve_url'] = curve_url(resultado['device_id'], resultado['fecha'], base_year)
+        shaped.append(resumen)
+    return shaped
+
+
+def finite(value):
+    """Reemplaza floats no finitos (desviación infinita cuando la media base es 0) por None, recursivamente."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: finite(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [finite(v) for v in value]
+    return value
+
+
+def dumps_json(payload) -> str:
+    """JSON válido (sin Infinity/NaN) sin pasar por jsonable_encoder."""
+    try:
+        return json.dumps(payload, ensure_ascii=False, default=str, allow_nan=False)
+    except ValueError:
+        return json.dumps(finite(payload), ensure_ascii=False, default=str)
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    return bool(accept) and MSGPACK_MEDIA_TYPE in accept
+
+
+def dumps_msgpack(payload) -> bytes:
+    """MessagePack del payload (requiere el paquete opcional msgpack)."""
+    if msgpack is None:
+        raise RuntimeError("MessagePack no disponible: instale el paquete 'msgpack'")
+    return msgpack.packb(payload, default=str, use_bin_type=True)
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Umbrales de clasificación (porcentaje de desviación respecto a la curva base)
+# NORMAL: variaciones menores al 20%
+# ALERTA: variaciones entre el -70% y -21% o 21% y 70%
+# CRITICO: variaciones menores al -71% o mayores al 71%
+ALERT_THRESHOLD_LOW = -70
+ALERT_THRESHOLD_HIGH = 70
+ALERT_RANGE_START = 21.0001
+CRITICAL_THRESHOLD_LOW = -71
+CRITICAL_THRESHOLD_HIGH = 71
+
+
+def percentage_deviation(actual, expected) -> np.ndarray:
+    """
+    Calcula la desviación porcentual ((real - esperado) / esperado) * 100 de forma vectorizada.
+    Si el esperado es 0: la desviación es +inf cuando el real es distinto de 0, y 0 cuando ambos son 0.
+    """
+    actual = np.asarray(actual, dtype=float)
+    expected = np.asarray(expected, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = (actual - expected) / expected * 100
+
+    zero_mean = expected == 0
+    deviation[zero_mean] = np.where(actual[zero_mean] != 0, np.inf, 0.0)
+    return deviation
+
+
+def classify_device_days(actual, expected, group_index=None, n_groups: int = None) -> dict:
+    """
+    Clasifica muchos días-medidor en una sola pasada de NumPy.
+
+    Args:
+        actual: valores reales de todos los intervalos, concatenados.
+        expected: valores esperados (media de la curva base) alineados con `actual`.
+        group_index: código entero (0..n_groups-1) del día-medidor de cada intervalo.
+            Si se omite, todos los intervalos pertenecen a un único día-medidor.
+        n_groups: cantidad de días-medidor (por defecto max(group_index) + 1).
+
+    Returns:
+        dict con:
+            - percentage_diff: desviación porcentual por intervalo.
+            - estado: NORMAL / ALERTA / CRITICO por día-medidor.
+            - max_deviation: máxima desviación absoluta por día-medidor (NaN si no tiene intervalos).
+    """
+    deviation = percentage_deviation(actual, expected)
+
+    if group_index is None:
+        group_index = np.zeros(deviation.shape[0], dtype=np.intp)
+        n_groups = 1
+    else:
+        group_index = np.asarray(group_index, dtype=np.intp)
+        if n_groups is None:
+            n_groups = int(group_index.max()) + 1 if group_index.size else 0
+
+    critical = (deviation < CRITICAL_THRESHOLD_LOW) | (deviation > CRITICAL_THRESHOLD_HIGH)
+    alert = ((deviation >= ALERT_THRESHOLD_LOW) & (deviation <= -ALERT_RANGE_START)) | \
+            ((deviation >= ALERT_RANGE_START) & (deviation <= ALERT_THRESHOLD_HIGH))
+
+    has_critical = np.bincount(group_index, weights=critical, minlength=n_groups) > 0
+    has_alert = np.bincount(group_index, weights=alert, minlength=n_groups) > 0
+
+    estado = np.where(has_critical, 'CRITICO', np.where(has_alert, 'ALERTA', 'NORMAL'))
+
+    max_deviation = np.full(n_groups, np.nan)
+    np.fmax.at(max_deviation, group_index, np.abs(deviation))
+
+    return {
+        'percentage_diff': deviation,
+        'estado': estado,
+        'max_deviation': max_deviation
+    }
@@ -1,155 +1,289 @@
+import asyncio
 import pandas as pd
+import numpy as np
 import json
 from google import genai
+from starlette.concurrency import run_in_threadpool
 
+from app.core.config import settings
+from app.core.metrics import stage
 from app.data.repositories import EnergyRepository
 from app.data.models import MLectura, Medidor
+from app.services.event_bus import EventBus
 from app.services.observers import Subject, AuditLoggerObserver, CriticalAlertObserver
+from app.services.llm_gateway import GeminiGateway
+from app.services.parallel_scan import iter_parallel_outlier_scan, scan_workers
+from app.services.deviation_classifier import classify_device_days
+from app.services.analysis_cache import AnalysisCache, analysis_cache as default_analysis_cache, analysis_cache_key
+from app.services.meter_registry import MeterRecord, MeterRegistry, meter_registry as default_meter_registry
+
+# Nombres de día (pandas day_name) en orden ISODOW y etiquetas HH:MM de los 96 intervalos de 15 minutos
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+SLOT_LABELS = [f"{slot // 4:02d}:{(slot % 4) * 15:02d}" for slot in range(96)]
 
 class EnergyService(Subject):
-    def find_outlier_devices(self, base_year: int, start_date: str, end_date: str, threshold: float = 20.0):
+    def find_outlier_devices(self, base_year: int, start_date: str, end_date: str, threshold: float = 20.0,
+                             progress=None, chunk_size: int = None, workers: int = None):
         """
         Busca medidores con desviaciones mayores al umbral en el rango de fechas dado, usando el año base.
-        Versión optimizada: consulta en lote y procesamiento eficiente.
+        Las curvas base materializadas (m_baseline) se actualizan solo para los medidores con lecturas
+        nuevas y la comparación se ejecuta en la base de datos para toda la flota en una sola consulta,
+        que retorna únicamente las curvas de los días-medidor que superan el umbral.
         Devuelve una lista de dicts con device_id, fecha, desviación máxima, curva de carga diaria.
+
+        Con `progress` (trabajos en segundo plano) la flota se recorre en bloques de `chunk_size`
+        medidores y tras cada bloque se llama progress(procesados, total, anomalias) con el número de
+        anomalías encontradas hasta ese momento; el callback puede lanzar una excepción para cancelar
+        la búsqueda.
+
+        Con `workers` > 1 (por defecto OUTLIER_SCAN_WORKERS) los bloques se reparten entre procesos,
+        cada uno con su propia conexión; el resultado y su orden son los mismos. Las estadísticas por
+        proceso quedan en self.last_scan_stats.
         """
-        from datetime import datetime, timedelta
-        start = pd.to_datetime(start_date)
-        end = pd.to_datetime(end_date)
-        
+        from datetime import timedelta
+        start = pd.to_datetime(start_date).to_pydatetime()
+        end = pd.to_datetime(end_date).to_pydatetime()
+
         print(f"[INFO] Buscando anomalías para {start_date} a {end_date} (umbral: {threshold}%)")
-        
-        # Obtener todos los medidores activos
-        medidores = self.repo.get_active_medidores()
-        print(f"[INFO] Analizando {len(medidores)} medidores...")
-        
-        resultados = []
-        dias = pd.date_range(start, end, freq='D')
-        
-        # Optimización 1: Consultar todas las lecturas del período de una vez por medidor
-        for idx, medidor in enumerate(medidores, 1):
-            if idx % 10 == 0:
-                print(f"[PROGRESS] Procesados {idx}/{len(medidores)} medidores...")
-            
-            try:
-                # Obtener todas las lecturas del período en una sola consulta
-                all_readings = self.repo.get_readings_range(
-                    medidor.deviceid, 
-                    start, 
-                    end + timedelta(days=1)
+
+        medidores = {m.deviceid: m for m in self.registry.active()}
+        chunk_size = chunk_size or settings.JOB_SCAN_CHUNK_DEVICES
+        workers = scan_workers(workers)
+
+        if progress is None and not (workers > 1 and len(medidores) > chunk_size):
+            self.last_scan_stats = None
+            with stage('baseline'):
+                baseline_refresh = self.repo.refresh_baselines(base_year)
+            print(f"[INFO] Curvas base {base_year}: {baseline_refresh}")
+
+            with stage('db_fetch'):
+                rows = self.repo.get_fleet_outlier_curves(
+                    base_year=base_year,
+                    start_date=start,
+                    end_date=end + timedelta(days=1),
+                    threshold=threshold
                 )
-                
-                if not all_readings:
-                    continue
-                
-                # Convertir a DataFrame
-                df_all = pd.DataFrame([{
-                    'fecha': d.fecha,
-                    'time_str': d.fecha.strftime('%H:%M'),
-                    'value': d.kwhd,
-                    'date': d.fecha.date()
-                } for d in all_readings])
-                
-                # Obtener baseline del año base (solo una vez por medidor)
-                hist_orm = self.repo.get_historical_year_data(medidor.deviceid, base_year)
-                if not hist_orm:
-                    continue
-                
-                df_hist = pd.DataFrame([{'timestamp': d.fecha, 'val': d.kwhd} for d in hist_orm])
-                
-                # Procesar cada día
-                for dia in dias:
-                    target_day_name = dia.day_name()
-                    
-                    # Filtrar lecturas del día
-                    df_dia = df_all[df_all['date'] == dia.date()].copy()
-                    if df_dia.empty:
-                        continue
-                    
-                    # Calcular baseline para este día de la semana
-                    baseline_day = self._calculate_baseline(df_hist, target_day_name)
-                    if baseline_day.empty:
-                        continue
-                    
-                    # Merge con baseline
-                    merged = pd.merge(
-                        df_dia[['time_str', 'value']], 
-                        baseline_day[['time_str', 'mean', 'std']], 
-                        on='time_str', 
-                        how='inner'
-                    )
-                    
-                    if merged.empty or 'mean' not in merged.columns:
-                        continue
-                    
-                    # Calcular desviaciones
-                    merged['percentage_diff'] = merged.apply(
-                        lambda row: ((row['value'] - row['mean']) / row['mean']) * 100 
-                        if row['mean'] != 0 else float('inf'), 
-                        axis=1
-                    )
-                    
-                    max_dev = merged['percentage_diff'].abs().max()
-                    
-                    if max_dev >= threshold:
-                        resultados.append({
-                            'device_id': medidor.deviceid,
-                            'fecha': dia.strftime('%Y-%m-%d'),
-                            'max_deviation': max_dev,
-                            'chart_data': merged.to_dict(orient='records'),
-                            'medidor_info': {
-                                'description': medidor.description,
-                                'devicetype': medidor.devicetype,
-                                'customerid': medidor.customerid,
-                                'usergroup': medidor.usergroup
-                            }
-                        })
-            
-            except Exception as e:
-                print(f"[ERROR] Error procesando medidor {medidor.deviceid}: {str(e)}")
-                continue
-        
+            resultados = self._outlier_results(rows, medidores)
+        else:
+            # Bloques de medidores; se unen en el orden de los bloques aunque terminen en otro orden
+            por_bloque = {}
+            anomalias = 0
+            if progress is not None:
+                progress(0, len(medidores), 0)
+            for slice_index, procesados, total, bloque in self._iter_outlier_slices(
+                    base_year, start, end + timedelta(days=1), threshold, medidores, chunk_size, workers):
+                por_bloque[slice_index] = bloque
+                anomalias += len(bloque)
+                if progress is not None:
+                    progress(procesados, total, anomalias)
+            resultados = [r for i in sorted(por_bloque) for r in por_bloque[i]]
+
         print(f"[INFO] Análisis completado. {len(resultados)} anomalías detectadas.")
         return resultados
-    def __init__(self, repository: EnergyRepository):
-        super().__init__()
+
+    def iter_outlier_devices(self, base_year: int, start_date: str, end_date: str, threshold: float = 20.0,
+                             chunk_size: int = None, workers: int = None):
+        """
+        Versión incremental de find_outlier_devices para respuestas en streaming: genera
+        (procesados, total, resultados_del_bloque) a medida que termina cada bloque de medidores,
+        sin acumular los resultados. Genera primero (0, total, []). Con búsqueda en paralelo los
+        bloques llegan en el orden en que terminan.
+        """
+        from datetime import timedelta
+        start = pd.to_datetime(start_date).to_pydatetime()
+        end = pd.to_datetime(end_date).to_pydatetime()
+
+        print(f"[INFO] Buscando anomalías (streaming) para {start_date} a {end_date} (umbral: {threshold}%)")
+
+        medidores = {m.deviceid: m for m in self.registry.active()}
+        yield 0, len(medidores), []
+        for _, procesados, total, bloque in self._iter_outlier_slices(
+                base_year, start, end + timedelta(days=1), threshold, medidores,
+                chunk_size or settings.JOB_SCAN_CHUNK_DEVICES, scan_workers(workers)):
+            yield procesados, total, bloque
+
+    def _iter_outlier_slices(self, base_year: int, start, end, threshold: float, medidores: dict,
+                             chunk_size: int, workers: int):
+        """Genera (indice_bloque, procesados, total, resultados) por bloque de medidores, en este proceso o en paralelo."""
+        device_ids = sorted(medidores)
+        self.last_scan_stats = None
+        if workers > 1 and len(device_ids) > chunk_size:
+            self.last_scan_stats = {}
+            yield from iter_parallel_outlier_scan(
+                device_ids, base_year, start, end, threshold,
+                workers=workers, chunk_size=chunk_size, stats=self.last_scan_stats
+            )
+            return
+
+        for n, i in enumerate(range(0, len(device_ids), chunk_size)):
+            bloque = device_ids[i:i + chunk_size]
+            with stage('baseline'):
+                self.repo.refresh_baselines(base_year, device_ids=bloque)
+            with stage('db_fetch'):
+                rows = self.repo.get_fleet_outlier_curves(
+                    base_year=base_year,
+                    start_date=start,
+                    end_date=end,
+                    threshold=threshold,
+                    device_ids=bloque
+                )
+            yield n, i + len(bloque), len(device_ids), self._outlier_results(rows, medidores)
+
+    def get_outlier_curve(self, device_id: str, fecha: str, base_year: int) -> dict:
+        """
+        Curva de un día-medidor contra su curva base, con la misma desviación y estado que
+        find_outlier_devices (para pedir las curvas bajo demanda en lugar de incluirlas en la búsqueda).
+        """
+        from datetime import timedelta
+        medidor = self.validate_device(device_id)
+        dia = pd.to_datetime(fecha).normalize().to_pydatetime()
+
+        with stage('baseline'):
+            self.repo.refresh_baselines(base_year, device_ids=[device_id])
+        with stage('db_fetch'):
+            rows = self.repo.get_device_day_curve(device_id, base_year, dia, dia + timedelta(days=1))
+        with stage('to_dataframe'):
+            curva = pd.DataFrame(rows, columns=['time_str', 'value', 'mean', 'std'])
+        if curva.empty:
+            raise ValueError(f"No hay lecturas del medidor {device_id} el {dia:%Y-%m-%d}")
+
+        with stage('classify'):
+            curva[['mean', 'std']] = curva[['mean', 'std']].astype(float)
+            clasificacion = classify_device_days(curva['value'].to_numpy(), curva['mean'].to_numpy())
+            curva['percentage_diff'] = clasificacion['percentage_diff']
+        return {
+            'device_id': device_id,
+            'fecha': dia.strftime('%Y-%m-%d'),
+            'base_year': base_year,
+            'max_deviation': float(clasificacion['max_deviation'][0]),
+            'estado': str(clasificacion['estado'][0]),
+            'chart_data': curva.astype(object).where(curva.notna(), None).to_dict(orient='records'),
+            'medidor_info': {
+                'description': medidor.description,
+                'devicetype': medidor.devicetype,
+                'customerid': medidor.customerid,
+                'usergroup': medidor.usergroup
+            }
+        }
+
+    def _outlier_results(self, rows, medidores: dict) -> list:
+        """Clasifica las curvas de los días-medidor que superan el umbral y arma el resultado por día."""
+        with stage('to_dataframe'):
+            curvas = pd.DataFrame(rows, columns=['deviceid', 'dia', 'time_str', 'value', 'mean', 'std'])
+        with stage('classify'):
+            grupos = curvas.groupby(['deviceid', 'dia'], sort=False)
+            clasificacion = classify_device_days(
+                curvas['value'].to_numpy(),
+                curvas['mean'].to_numpy(),
+                group_index=grupos.ngroup().to_numpy(),
+                n_groups=grupos.ngroups
+            )
+            curvas['percentage_diff'] = clasificacion['percentage_diff']
+
+        resultados = []
+        for idx, ((device_id, dia), curva) in enumerate(grupos):
+            medidor = medidores.get(device_id)
+            resultados.append({
+                'device_id': device_id,
+                'fecha': dia.strftime('%Y-%m-%d'),
+                'max_deviation': float(clasificacion['max_deviation'][idx]),
+                'estado': str(clasificacion['estado'][idx]),
+                'chart_data': curva[['time_str', 'value', 'mean', 'std', 'percentage_diff']].to_dict(orient='records'),
+                'medidor_info': {
+                    'description': medidor.description if medidor else None,
+                    'devicetype': medidor.devicetype if medidor else None,
+                    'customerid': medidor.customerid if medidor else None,
+                    'usergroup': medidor.usergroup if medidor else None
+                }
+            })
+        return resultados
+
+    # Opciones disponibles: 'gemini-2.0-flash' (principios de 2025), 'gemini-2.5-flash' (mediados de 2025, recomendada)
+    GEMINI_MODEL_ID = 'gemini-2.5-flash'
+    GEMINI_FALLBACK_MODEL_ID = 'gemini-2.0-flash'
+
+    def __init__(self, repository: EnergyRepository, genai_client: genai.Client = None,
+                 observers: list = None, analysis_cache: AnalysisCache = None, llm: GeminiGateway = None,
+                 registry: MeterRegistry = None, event_bus: EventBus = None):
+        """
+        Las dependencias opcionales (cliente de Gemini, observadores, caché, gateway async, registro
+        de medidores y bus de eventos) las inyecta el contenedor de la aplicación; si no se pasan, se
+        crean como antes (sin bus, los observadores se notifican en la misma llamada).
+        """
+        super().__init__(event_bus)
         self.repo = repository
+        self.genai_client = genai_client
+        self.analysis_cache = analysis_cache or default_analysis_cache
+        self.registry = registry or default_meter_registry
+        self._llm = llm
+        self.last_scan_stats = None
         # Adjuntar observadores (Patrón Observer)
-        self.attach(AuditLoggerObserver())
-        self.attach(CriticalAlertObserver())
+        for observer in (observers if observers is not None else [AuditLoggerObserver(), CriticalAlertObserver()]):
+            self.attach(observer)
+
+    @property
+    def llm(self) -> GeminiGateway:
+        """Gateway async de Gemini (el del contenedor o uno propio de esta instancia)."""
+        if self._llm is None:
+            self._llm = GeminiGateway(self._get_genai_client, settings.GEMINI_MAX_CONCURRENCY, settings.GEMINI_TIMEOUT_SECONDS)
+        return self._llm
+
+    def _get_genai_client(self) -> genai.Client:
+        if self.genai_client is None:
+            import os
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY no está configurada en variables de entorno.")
+            self.genai_client = genai.Client(api_key=api_key)
+        return self.genai_client
 
     def process_csv_upload(self, df: pd.DataFrame, device_id: str):
+        """Carga las lecturas de un DataFrame CSV (timestamp, value y opcionalmente kvarhd) para un medidor."""
+        df.columns = [c.lower().strip() for c in df.columns]
+        for col in ['timestamp', 'value']:
+            if col not in df.columns:
+                raise ValueError(f"Columna requerida '{col}' no encontrada en el CSV")
+        return self.process_csv_batches([df], device_id)
+
+    def process_csv_batches(self, batches, device_id: str):
         """
-        [OMITIDO TEMPORALMENTE]
-        Este método está deshabilitado temporalmente para omitir el procesamiento de archivos CSV.
-        Concéntrate en los datos obtenidos desde la base de datos.
+        Carga por bloques las lecturas de un CSV para un medidor.
+        Las filas con fecha o valor inválidos se rechazan y se reportan con su número de línea;
+        el resto de cada bloque se inserta/actualiza en bloque a través del repositorio.
         """
-        # self.validate_device(device_id)
-        # readings = []
-        # required_columns = ['timestamp', 'value']
-        # df.columns = [c.lower().strip() for c in df.columns]
-        # for col in required_columns:
-        #     if col not in df.columns:
-        #         raise ValueError(f"Columna requerida '{col}' no encontrada en el CSV")
-        # for _, row in df.iterrows():
-        #     try:
-        #         fecha = pd.to_datetime(row['timestamp'])
-        #         kvar = row.get('kvarhd', 0.0)
-        #         readings.append(MLectura(
-        #             fecha=fecha,
-        #             deviceid=device_id,
-        #             kwhd=float(row['value']),
-        #             kvarhd=float(kvar)
-        #         ))
-        #     except Exception as e:
-        #         raise ValueError(f"Error procesando fila: {row.to_dict()}. Error: {e}")
-        # self.repo.bulk_insert_readings(readings)
-        # return {"status": "success", "records": len(readings)}
-        return {"status": "omitted", "records": 0, "msg": "Procesamiento de CSV omitido temporalmente."}
-
-    def validate_device(self, device_id: str) -> Medidor:
-        """Valida que el dispositivo exista en la tabla medidor."""
-        medidor = self.repo.get_medidor(device_id)
+        self.validate_device(device_id)
+
+        report = {'status': 'success', 'records': 0, 'received': 0, 'inserted': 0, 'updated': 0,
+                  'batches': 0, 'rejected': 0, 'rejected_rows': []}
+
+        for batch in batches:
+            frame = pd.DataFrame({
+                'fecha': pd.to_datetime(batch['timestamp'], errors='coerce'),
+                'deviceid': device_id,
+                'kwhd': pd.to_numeric(batch['value'], errors='coerce'),
+                'kvarhd': pd.to_numeric(batch['kvarhd'], errors='coerce').fillna(0.0) if 'kvarhd' in batch.columns else 0.0
+            })
+            # Número de línea en el archivo (la línea 1 es el encabezado)
+            frame.index = batch.index + 2
+
+            invalid_fecha = frame['fecha'].isna()
+            invalid_value = ~invalid_fecha & ~np.isfinite(frame['kwhd'])
+            rejected_rows = [{'row': int(i), 'reason': "Fecha inválida"} for i in frame.index[invalid_fecha]]
+            rejected_rows += [{'row': int(i), 'reason': "Valor kWh inválido"} for i in frame.index[invalid_value]]
+
+            batch_report = self.repo.bulk_upsert_readings(frame[~(invalid_fecha | invalid_value)])
+
+            for key in ['records', 'inserted', 'updated', 'batches']:
+                report[key] += batch_report[key]
+            report['received'] += len(batch)
+            report['rejected'] += len(rejected_rows) + batch_report['rejected']
+            report['rejected_rows'] = (report['rejected_rows'] + rejected_rows + batch_report['rejected_rows'])[:self.repo.MAX_REJECTED_ROWS_REPORTED]
+
+        return report
+
+    def validate_device(self, device_id: str) -> MeterRecord:
+        """Valida que el dispositivo exista en la tabla medidor (consulta el registro en memoria)."""
+        medidor = self.registry.get(device_id)
         if not medidor:
             raise ValueError(f"Dispositivo {device_id} no encontrado en la tabla medidor")
         return medidor
@@ -161,28 +295,204 @@ class EnergyService(Subject):
             raise ValueError("Columna 'timestamp' no encontrada en el archivo.")
         
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-        years = df['timestamp'].dt.year.unique().tolist()
+        return self.get_years_from_batches([df])
+
+    def get_years_from_batches(self, batches):
+        """Extrae los años únicos de la columna 'timestamp' en una sola pasada sobre bloques de un CSV."""
+        years = set()
+        for batch in batches:
+            years.update(int(y) for y in batch['timestamp'].dt.year.dropna().unique())
         return {"years": sorted(years)}
 
     def _calculate_baseline(self, df_hist: pd.DataFrame, target_day_name: str):
-        """Calcula la curva base a partir de un DataFrame histórico."""
-        df_hist['ts'] = pd.to_datetime(df_hist['timestamp'])
-        df_hist['day_name'] = df_hist['ts'].dt.day_name()
-        df_hist['time_str'] = df_hist['ts'].dt.strftime('%H:%M')
-        
-        if 'value' in df_hist.columns and 'val' not in df_hist.columns:
-            df_hist.rename(columns={'value': 'val'}, inplace=True)
+        """Calcula la curva base de un día de la semana a partir de un DataFrame histórico."""
+        profile = self._build_baseline_profile(df_hist)
+        return self._baseline_for_weekday(profile, DAY_NAMES.index(target_day_name) + 1)
+
+    def _build_baseline_profile(self, df_hist: pd.DataFrame) -> pd.DataFrame:
+        """
+        Construye el perfil completo (weekday, slot, mean, std, count) de un histórico,
+        con las mismas claves que la tabla m_baseline (ISODOW e intervalo de 15 minutos).
+        """
+        ts = pd.to_datetime(df_hist['timestamp'])
+        values = df_hist['val'] if 'val' in df_hist.columns else df_hist['value']
 
-        baseline = df_hist.groupby(['day_name', 'time_str'])['val'].agg(['mean', 'std']).reset_index()
-        return baseline[baseline['day_name'] == target_day_name].copy()
+        profile = values.groupby([
+            (ts.dt.dayofweek + 1).rename('weekday'),
+            (ts.dt.hour * 4 + ts.dt.minute // 15).rename('slot')
+        ]).agg(['mean', 'std', 'count'])
+        return profile.reset_index()
+
+    def _accumulate_baseline_profile(self, acc, df_hist: pd.DataFrame) -> pd.DataFrame:
+        """
+        Combina un bloque de histórico con los acumulados (n, mean, m2) por (weekday, slot),
+        usando la fórmula de Chan para la varianza.
+        """
+        ts = df_hist['timestamp']
+        part = df_hist['value'].groupby([
+            (ts.dt.dayofweek + 1).rename('weekday'),
+            (ts.dt.hour * 4 + ts.dt.minute // 15).rename('slot')
+        ]).agg(['count', 'mean', 'var'])
+        part = pd.DataFrame({
+            'n': part['count'],
+            'mean': part['mean'],
+            'm2': (part['var'] * (part['count'] - 1)).fillna(0.0)
+        })
+        if acc is None:
+            return part
+
+        a, b = acc.align(part, join='outer', fill_value=0.0)
+        n = a['n'] + b['n']
+        delta = b['mean'] - a['mean']
+        return pd.DataFrame({
+            'n': n,
+            'mean': a['mean'] + delta * b['n'] / n,
+            'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n
+        })
+
+    def _finalize_baseline_profile(self, acc: pd.DataFrame) -> pd.DataFrame:
+        """Convierte los acumulados (n, mean, m2) en el perfil (weekday, slot, mean, std, count)."""
+        acc = acc[acc['n'] > 0]
+        std = np.sqrt(acc['m2'] / (acc['n'] - 1)).where(acc['n'] > 1)
+        return pd.DataFrame({
+            'mean': acc['mean'],
+            'std': std,
+            'count': acc['n'].astype(int)
+        }).reset_index()
+
+    def _baseline_for_weekday(self, profile: pd.DataFrame, weekday: int) -> pd.DataFrame:
+        """Selecciona del perfil los 96 intervalos de un día de la semana (ISODOW)."""
+        baseline = profile[profile['weekday'] == weekday].copy()
+        baseline['time_str'] = [SLOT_LABELS[s] for s in baseline['slot']]
+        return baseline
+
+    def _load_baseline(self, device_id: str, base_year: int, weekday: int) -> pd.DataFrame:
+        """Lee de m_baseline la curva base de un medidor para un día de la semana."""
+        if not self.repo.ensure_baseline(device_id, base_year):
+            return pd.DataFrame(columns=['weekday', 'slot', 'mean', 'std', 'count', 'time_str'])
+
+        rows = self.repo.get_baseline_profile(device_id, base_year, weekday)
+        profile = pd.DataFrame({
+            'weekday': [r.weekday for r in rows],
+            'slot': [r.slot for r in rows],
+            'mean': [r.mean for r in rows],
+            'std': [r.std for r in rows],
+            'count': [r.count for r in rows]
+        })
+        return self._baseline_for_weekday(profile, weekday)
+
+    def _readings_to_dataframe(self, data_orm) -> pd.DataFrame:
+        """Convierte lecturas ORM en un DataFrame (time_str, value, slot) para cruzar con la baseline."""
+        return pd.DataFrame({
+            'time_str': [d.fecha.strftime('%H:%M') for d in data_orm],
+            'value': [d.kwhd for d in data_orm],
+            'slot': [d.fecha.hour * 4 + d.fecha.minute // 15 for d in data_orm]
+        })
+
+    def _get_gemini_analysis(self, device_id: str, medidor: Medidor, target_date_str: str, target_day_name: str, merged_df: pd.DataFrame, calculated_estado_general: str, base_year: int = None):
+        """
+        Consulta a la API de Gemini para el análisis (google-genai moderno).
+        Los análisis exitosos se guardan en la caché por contenido (medidor, fecha, año base,
+        modelo y curva combinada): repetir un análisis ya hecho no vuelve a llamar al modelo.
+        Los del modelo alternativo no se guardan, para no servirlos después como del modelo principal.
+        """
+        cache_key = analysis_cache_key(device_id, target_date_str, base_year, self.GEMINI_MODEL_ID, merged_df, calculated_estado_general)
+        cached = self.analysis_cache.get(cache_key, self.repo)
+        if cached is not None:
+            print(f"[INFO] Análisis de {device_id} {target_date_str} obtenido de la caché")
+            return cached
 
-    def _get_gemini_analysis(self, device_id: str, medidor: Medidor, target_date_str: str, target_day_name: str, merged_df: pd.DataFrame, calculated_estado_general: str):
-        """Consulta a la API de Gemini para el análisis (google-genai moderno)."""
         import os
         api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        if self.genai_client is None and not api_key:
             raise ValueError("GEMINI_API_KEY no está configurada en variables de entorno.")
 
+        prompt = self._build_gemini_prompt(device_id, medidor, target_date_str, target_day_name, merged_df, calculated_estado_general)
+
+        try:
+            # Cliente compartido de la aplicación o, sin contenedor, uno nuevo con el SDK
+            client = self.genai_client or genai.Client(api_key=api_key)
+            
+            model_id = self.GEMINI_MODEL_ID
+
+            try:
+                with stage('llm'):
+                    response = client.models.generate_content(
+                        model=model_id,
+                        contents=prompt
+                    )
+                print(f"✅ Análisis completado con {model_id}")
+            except Exception as e:
+                print(f"Error: {e}")
+                print("Tip: Verifica si tu API Key tiene acceso a la versión 2.5, si no, prueba con la 2.0")
+                # Fallback a gemini-2.0-flash
+                model_id = self.GEMINI_FALLBACK_MODEL_ID
+                with stage('llm'):
+                    response = client.models.generate_content(
+                        model=model_id,
+                        contents=prompt
+                    )
+                print(f"✅ Análisis completado con {model_id} (fallback)")
+
+            analysis = self._parse_gemini_response(response.text)
+
+            # Solo se guardan los análisis exitosos (no la respuesta de error) del modelo de la clave
+            if model_id == self.GEMINI_MODEL_ID:
+                self.analysis_cache.put(cache_key, analysis, self.repo, deviceid=device_id, fecha=target_date_str,
+                                        base_year=base_year, model_id=model_id)
+            return analysis
+                    
+        except Exception as e:
+            print(f"Error consultando Gemini: {str(e)}")
+            return self._gemini_error_analysis(e, calculated_estado_general)
+
+    async def _get_gemini_analysis_async(self, device_id: str, medidor: Medidor, target_date_str: str, target_day_name: str, merged_df: pd.DataFrame, calculated_estado_general: str, base_year: int = None):
+        """
+        Versión async de _get_gemini_analysis: usa el cliente async con el límite de concurrencia
+        y el plazo del gateway; la caché (que puede consultar la base de datos) corre en el threadpool.
+        Si vence el plazo no se reintenta con el modelo alternativo.
+        """
+        cache_key = analysis_cache_key(device_id, target_date_str, base_year, self.GEMINI_MODEL_ID, merged_df, calculated_estado_general)
+        cached = await run_in_threadpool(self.analysis_cache.get, cache_key, self.repo)
+        if cached is not None:
+            print(f"[INFO] Análisis de {device_id} {target_date_str} obtenido de la caché")
+            return cached
+
+        import os
+        if self._llm is None and self.genai_client is None and not os.getenv("GEMINI_API_KEY"):
+            raise ValueError("GEMINI_API_KEY no está configurada en variables de entorno.")
+
+        prompt = self._build_gemini_prompt(device_id, medidor, target_date_str, target_day_name, merged_df, calculated_estado_general)
+
+        try:
+            model_id = self.GEMINI_MODEL_ID
+            try:
+                response = await self.llm.generate_content(model_id, prompt)
+                print(f"✅ Análisis completado con {model_id}")
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                print(f"Error: {e}")
+                model_id = self.GEMINI_FALLBACK_MODEL_ID
+                response = await self.llm.generate_content(model_id, prompt)
+                print(f"✅ Análisis completado con {model_id} (fallback)")
+
+            analysis = self._parse_gemini_response(response.text)
+
+            if model_id == self.GEMINI_MODEL_ID:
+                await run_in_threadpool(self.analysis_cache.put, cache_key, analysis, self.repo, deviceid=device_id,
+                                        fecha=target_date_str, base_year=base_year, model_id=model_id)
+            return analysis
+
+        except asyncio.TimeoutError:
+            print(f"Error consultando Gemini: plazo de {self.llm.timeout_seconds}s vencido")
+            return self._gemini_error_analysis(f"Tiempo de espera agotado ({self.llm.timeout_seconds}s)", calculated_estado_general)
+        except Exception as e:
+            print(f"Error consultando Gemini: {str(e)}")
+            return self._gemini_error_analysis(e, calculated_estado_general)
+
+    def _build_gemini_prompt(self, device_id: str, medidor: Medidor, target_date_str: str, target_day_name: str, merged_df: pd.DataFrame, calculated_estado_general: str) -> str:
+        """Construye el prompt del análisis de la curva de carga."""
         sample_data = merged_df.set_index('time_str')[['value', 'mean']].to_string()
 
         prompt = f"""
@@ -304,60 +614,38 @@ EXAMPLE 2 - Estado ALERTA:
 </output_constraints>
         """
 
-        try:
-            # Inicializar el Cliente con el nuevo SDK
-            client = genai.Client(api_key=api_key)
-            
-            # Opciones disponibles (descomenta la que quieras usar):
-            # model_id = 'gemini-2.0-flash'  # Versión de principios de 2025
-            model_id = 'gemini-2.5-flash'  # Versión de mediados de 2025 (Recomendada)
+        return prompt
 
-            try:
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=prompt
-                )
-                print(f"✅ Análisis completado con {model_id}")
-            except Exception as e:
-                print(f"Error: {e}")
-                print("Tip: Verifica si tu API Key tiene acceso a la versión 2.5, si no, prueba con la 2.0")
-                # Fallback a gemini-2.0-flash
-                model_id = 'gemini-2.0-flash'
-                response = client.models.generate_content(
-                    model=model_id,
-                    contents=prompt
-                )
-                print(f"✅ Análisis completado con {model_id} (fallback)")
-            
-            response_text = response.text.strip()
-            
-            # Limpiar la respuesta si tiene markdown o texto extra
-            if response_text.startswith('```json'):
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif response_text.startswith('```'):
-                response_text = response_text.split('```')[1].strip()
-            
-            # Intentar parsear JSON
-            try:
-                return json.loads(response_text)
-            except json.JSONDecodeError:
-                # Si falla, buscar el primer objeto JSON en la respuesta
-                import re
-                json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group())
-                else:
-                    raise ValueError("No se encontró JSON válido en la respuesta")
-                    
-        except Exception as e:
-            print(f"Error consultando Gemini: {str(e)}")
-            return {
-                "resumen": "No se pudo completar el análisis con IA.",
-                "habitos": "N/A",
-                "anomalias": [str(e)],
-                "recomendacion": "Verificar conectividad o API Key.",
-                "estado_general": calculated_estado_general
-            }
+    def _parse_gemini_response(self, response_text: str) -> dict:
+        """Extrae el objeto JSON del análisis de la respuesta de Gemini."""
+        response_text = response_text.strip()
+        
+        # Limpiar la respuesta si tiene markdown o texto extra
+        if response_text.startswith('```json'):
+            response_text = response_text.split('```json')[1].split('```')[0].strip()
+        elif response_text.startswith('```'):
+            response_text = response_text.split('```')[1].strip()
+        
+        # Intentar parsear JSON
+        try:
+            return json.loads(response_text)
+        except json.JSONDecodeError:
+            # Si falla, buscar el primer objeto JSON en la respuesta
+            import re
+            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+            if json_match:
+                return json.loads(json_match.group())
+            raise ValueError("No se encontró JSON válido en la respuesta")
+
+    def _gemini_error_analysis(self, error, calculated_estado_general: str) -> dict:
+        """Análisis de reemplazo cuando Gemini no responde (no se guarda en caché)."""
+        return {
+            "resumen": "No se pudo completar el análisis con IA.",
+            "habitos": "N/A",
+            "anomalias": [str(error)],
+            "recomendacion": "Verificar conectividad o API Key.",
+            "estado_general": calculated_estado_general
+        }
 
     def _build_analysis_payload(self, device_id: str, medidor: Medidor, target_day_name: str, merged_df: pd.DataFrame, analysis: dict):
         """Construye el diccionario de respuesta final."""
@@ -373,115 +661,128 @@ EXAMPLE 2 - Estado ALERTA:
             "chart_data": merged_df.to_dict(orient='records'),
             "analysis": analysis
         }
-        self.notify("ANALYSIS_DONE", payload)
+        with stage('observers'):
+            self.notify("ANALYSIS_DONE", payload)
         return payload
 
     def _determine_overall_state(self, merged_df: pd.DataFrame) -> str:
         """Determina el estado general (NORMAL, ALERTA, CRITICO) basado en las variaciones."""
-        
-        # Ensure 'mean' column exists to avoid division by zero or KeyError
         if 'mean' not in merged_df.columns:
-            return "DESCONOCIDO" # Or raise an error, depending on desired behavior
-
-        # Calculate percentage difference for each point, handling potential division by zero
-        # Replace 0 values in 'mean' with NaN to avoid division by zero, then fill NaNs in percentage_diff
-        # For our specific thresholds, we consider significant deviations from 0 baseline as critical or alert
-        percentage_diff = []
-        for index, row in merged_df.iterrows():
-            if row['mean'] != 0:
-                percentage_diff.append(((row['value'] - row['mean']) / row['mean']) * 100)
-            else:
-                # If mean is 0, any non-zero value is a significant deviation
-                if row['value'] != 0:
-                    # Assign a large dummy value to trigger critical/alert if 'value' is present
-                    percentage_diff.append(float('inf'))
-                else:
-                    percentage_diff.append(0.0) # If both are 0, no difference
-        
-        merged_df['percentage_diff'] = percentage_diff
-
-        # Define thresholds
-        NORMAL_THRESHOLD_MAX = 20
-        ALERT_THRESHOLD_LOW = -70
-        ALERT_THRESHOLD_HIGH = 70
-        CRITICAL_THRESHOLD_LOW = -71
-        CRITICAL_THRESHOLD_HIGH = 71
-
-        # Check for critical state first
-        if (merged_df['percentage_diff'] < CRITICAL_THRESHOLD_LOW).any() or \
-           (merged_df['percentage_diff'] > CRITICAL_THRESHOLD_HIGH).any():
-            return "CRITICO"
-        
-        # Check for alert state
-        # The condition needs to be adjusted for the ranges given by the user
-        # ALERTA  variaciones entre el -70% y -21% o 21% y 70%
-        if (merged_df['percentage_diff'].apply(lambda x: ALERT_THRESHOLD_LOW <= x <= -21.0001)).any() or \
-           (merged_df['percentage_diff'].apply(lambda x: 21.0001 <= x <= ALERT_THRESHOLD_HIGH)).any():
-            return "ALERTA"
-            
-        # If not critical or alert, it's normal
-        return "NORMAL"
+            return "DESCONOCIDO"
+
+        result = classify_device_days(merged_df['value'].to_numpy(), merged_df['mean'].to_numpy())
+        merged_df['percentage_diff'] = result['percentage_diff']
+        return str(result['estado'][0])
 
     def analyze_day(self, device_id: str, target_date_str: str, base_year: int):
         """Análisis usando datos históricos de la base de datos."""
+        medidor, target_day_name, merged, calculated_estado_general = self._prepare_day_analysis(device_id, target_date_str, base_year)
+
+        analysis = self._get_gemini_analysis(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general, base_year)
+
+        return self._build_analysis_payload(device_id, medidor, target_day_name, merged, analysis)
+
+    async def analyze_day_async(self, device_id: str, target_date_str: str, base_year: int):
+        """Versión async de analyze_day: la base de datos corre en el threadpool y Gemini con el cliente async."""
+        medidor, target_day_name, merged, calculated_estado_general = await run_in_threadpool(
+            self._prepare_day_analysis, device_id, target_date_str, base_year)
+
+        analysis = await self._get_gemini_analysis_async(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general, base_year)
+
+        return self._build_analysis_payload(device_id, medidor, target_day_name, merged, analysis)
+
+    def _prepare_day_analysis(self, device_id: str, target_date_str: str, base_year: int):
+        """Lecturas del día combinadas con la curva base materializada; retorna (medidor, día, curva, estado)."""
         target_date = pd.to_datetime(target_date_str)
         medidor = self.validate_device(device_id)
         
-        data_orm = self.repo.get_readings_by_date(device_id, target_date)
+        with stage('db_fetch'):
+            data_orm = self.repo.get_readings_by_date(device_id, target_date)
         if not data_orm:
             raise ValueError(f"No hay datos para {target_date_str} (ID: {device_id})")
         
-        df_real = pd.DataFrame([{'time_str': d.fecha.strftime('%H:%M'), 'value': d.kwhd} for d in data_orm])
+        with stage('to_dataframe'):
+            df_real = self._readings_to_dataframe(data_orm)
 
-        hist_orm = self.repo.get_historical_year_data(device_id, base_year)
-        if not hist_orm:
-            raise ValueError(f"No hay datos históricos del año base {base_year}")
-            
-        df_hist = pd.DataFrame([{'timestamp': d.fecha, 'val': d.kwhd} for d in hist_orm])
-        
         target_day_name = target_date.day_name()
-        baseline_day = self._calculate_baseline(df_hist, target_day_name)
+        with stage('baseline'):
+            baseline_day = self._load_baseline(device_id, base_year, target_date.isoweekday())
+        if baseline_day.empty:
+            raise ValueError(f"No hay datos históricos del año base {base_year}")
 
-        merged = pd.merge(df_real, baseline_day[['time_str', 'mean', 'std']], on='time_str', how='inner')
+        with stage('merge'):
+            merged = pd.merge(df_real, baseline_day[['slot', 'mean', 'std']], on='slot', how='inner').drop(columns='slot')
         
-        calculated_estado_general = self._determine_overall_state(merged)
+        with stage('classify'):
+            calculated_estado_general = self._determine_overall_state(merged)
+        return medidor, target_day_name, merged, calculated_estado_general
 
-        analysis = self._get_gemini_analysis(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general)
+    def analyze_day_with_df(self, device_id: str, target_date_str: str, base_year: int, base_df: pd.DataFrame):
+        """Análisis usando un DataFrame como histórico."""
+        base_df.columns = [c.lower().strip() for c in base_df.columns]
+        base_df['timestamp'] = pd.to_datetime(base_df['timestamp'])
+        return self.analyze_day_with_batches(device_id, target_date_str, base_year, [base_df])
+
+    def analyze_day_with_batches(self, device_id: str, target_date_str: str, base_year: int, batches):
+        """
+        Análisis usando como histórico un CSV leído por bloques (timestamp, value).
+        La curva base se acumula bloque a bloque (conteo, media y M2 por día/intervalo),
+        por lo que la memoria no depende del tamaño del archivo.
+        """
+        medidor, target_day_name, merged, calculated_estado_general = self._prepare_day_analysis_with_batches(
+            device_id, target_date_str, base_year, batches)
+
+        analysis = self._get_gemini_analysis(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general, base_year)
 
         return self._build_analysis_payload(device_id, medidor, target_day_name, merged, analysis)
 
-    def analyze_day_with_df(self, device_id: str, target_date_str: str, base_year: int, base_df: pd.DataFrame):
-        """Análisis usando un DataFrame como histórico."""
+    async def analyze_day_with_batches_async(self, device_id: str, target_date_str: str, base_year: int, batches):
+        """Versión async de analyze_day_with_batches (lectura del archivo y base de datos en el threadpool)."""
+        medidor, target_day_name, merged, calculated_estado_general = await run_in_threadpool(
+            self._prepare_day_analysis_with_batches, device_id, target_date_str, base_year, batches)
+
+        analysis = await self._get_gemini_analysis_async(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general, base_year)
+
+        return self._build_analysis_payload(device_id, medidor, target_day_name, merged, analysis)
+
+    def _prepare_day_analysis_with_batches(self, device_id: str, target_date_str: str, base_year: int, batches):
+        """Lecturas del día combinadas con la curva base acumulada desde el archivo; retorna (medidor, día, curva, estado)."""
         target_date = pd.to_datetime(target_date_str)
         medidor = self.validate_device(device_id)
 
-        data_orm = self.repo.get_readings_by_date(device_id, target_date)
+        with stage('db_fetch'):
+            data_orm = self.repo.get_readings_by_date(device_id, target_date)
         if not data_orm:
             raise ValueError(f"No hay datos para {target_date_str} (ID: {device_id})")
         
-        df_real = pd.DataFrame([{'time_str': d.fecha.strftime('%H:%M'), 'value': d.kwhd} for d in data_orm])
-
-        base_df.columns = [c.lower().strip() for c in base_df.columns]
-        base_df['timestamp'] = pd.to_datetime(base_df['timestamp'])
-        df_hist = base_df[base_df['timestamp'].dt.year == base_year].copy()
-        
-        if df_hist.empty:
-            raise ValueError(f"No hay datos para el año base {base_year} en el archivo proporcionado.")
-
+        with stage('to_dataframe'):
+            df_real = self._readings_to_dataframe(data_orm)
+
+        # Incluye la lectura del archivo por bloques
+        with stage('baseline'):
+            acc = None
+            for batch in batches:
+                df_hist = batch[batch['timestamp'].dt.year == base_year]
+                if not df_hist.empty:
+                    acc = self._accumulate_baseline_profile(acc, df_hist)
+
+            if acc is None:
+                raise ValueError(f"No hay datos para el año base {base_year} en el archivo proporcionado.")
+
+            profile = self._finalize_baseline_profile(acc)
+            baseline_day = self._baseline_for_weekday(profile, target_date.isoweekday())
         target_day_name = target_date.day_name()
-        baseline_day = self._calculate_baseline(df_hist, target_day_name)
-
-        merged = pd.merge(df_real, baseline_day[['time_str', 'mean', 'std']], on='time_str', how='inner')
 
-        calculated_estado_general = self._determine_overall_state(merged)
+        with stage('merge'):
+            merged = pd.merge(df_real, baseline_day[['slot', 'mean', 'std']], on='slot', how='inner').drop(columns='slot')
 
-        analysis = self._get_gemini_analysis(device_id, medidor, target_date_str, target_day_name, merged, calculated_estado_general)
-
-        return self._build_analysis_payload(device_id, medidor, target_day_name, merged, analysis)
+        with stage('classify'):
+            calculated_estado_general = self._determine_overall_state(merged)
+        return medidor, target_day_name, merged, calculated_estado_general
 
     def get_available_devices(self):
         """Obtiene lista de medidores disponibles."""
-        medidores = self.repo.get_active_medidores()
+        medidores = self.registry.active()
         return [
             {
                 "deviceid": m.deviceid,
@@ -498,56 +799,51 @@ EXAMPLE 2 - Estado ALERTA:
                             min_growth_percentage: float = 0.0):
         """
         Analiza el crecimiento de demanda entre dos periodos comparables.
+        La energía de ambos periodos se obtiene para toda la flota en una sola consulta;
+        el cálculo del crecimiento, el filtro y el orden se hacen sobre ese resultado.
         Retorna medidores ordenados por porcentaje de crecimiento.
         """
-        from datetime import datetime, timedelta
-        
-        # Obtener todos los medidores activos
-        medidores = self.repo.get_active_medidores()
-        growth_results = []
-        
-        for medidor in medidores:
-            try:
-                # Obtener energía total del periodo actual
-                current_energy = self.repo.get_total_energy_in_period(
-                    device_id=medidor.deviceid,
-                    start_date=current_period_start,
-                    end_date=current_period_end
-                )
-                
-                # Obtener energía total del periodo anterior
-                previous_energy = self.repo.get_total_energy_in_period(
-                    device_id=medidor.deviceid,
-                    start_date=previous_period_start,
-                    end_date=previous_period_end
-                )
-                
-                if current_energy and previous_energy:
-                    current_kwh = current_energy['total_energy_kwh']
-                    previous_kwh = previous_energy['total_energy_kwh']
-                    
-                    # Calcular crecimiento porcentual
-                    if previous_kwh > 0:
-                        growth_percentage = ((current_kwh - previous_kwh) / previous_kwh) * 100
-                        
-                        if growth_percentage >= min_growth_percentage:
-                            growth_results.append({
-                                'device_id': medidor.deviceid,
-                                'description': medidor.description,
-                                'customerid': medidor.customerid,
-                                'current_period_energy': current_kwh,
-                                'previous_period_energy': previous_kwh,
-                                'growth_kwh': current_kwh - previous_kwh,
-                                'growth_percentage': growth_percentage,
-                                'current_period': f"{current_period_start} a {current_period_end}",
-                                'previous_period': f"{previous_period_start} a {previous_period_end}"
-                            })
-                            
-            except Exception as e:
-                # Continuar con el siguiente medidor si hay error
-                continue
-        
-        # Ordenar por porcentaje de crecimiento descendente
-        growth_results.sort(key=lambda x: x['growth_percentage'], reverse=True)
-        
-        return growth_results
\ No newline at end of file
+        from datetime import timedelta
+
+        def period_bounds(start: str, end: str):
+            return pd.to_datetime(start).to_pydatetime(), pd.to_datetime(end).to_pydatetime() + timedelta(days=1)
+
+        current_start, current_end = period_bounds(current_period_start, current_period_end)
+        previous_start, previous_end = period_bounds(previous_period_start, previous_period_end)
+
+        with stage('db_fetch'):
+            rows = self.repo.get_fleet_period_energy(current_start, current_end, previous_start, previous_end)
+        if not rows:
+            return []
+
+        with stage('to_dataframe'):
+            # dtype object: conserva None en description/customerid (pandas los convertiría a NaN)
+            df = pd.DataFrame(rows, dtype=object)
+            df = df[df['current_kwh'].notna() & df['previous_kwh'].notna()]
+            df = df.astype({'current_kwh': float, 'previous_kwh': float})
+            df = df[df['previous_kwh'] > 0]
+
+        with stage('growth'):
+            df['growth_kwh'] = df['current_kwh'] - df['previous_kwh']
+            df['growth_percentage'] = df['growth_kwh'] / df['previous_kwh'] * 100
+            df = df[df['growth_percentage'] >= min_growth_percentage]
+
+            # Ordenar por porcentaje de crecimiento descendente
+            df = df.sort_values('growth_percentage', ascending=False, kind='stable')
+
+        current_period = f"{current_period_start} a {current_period_end}"
+        previous_period = f"{previous_period_start} a {previous_period_end}"
+        return [
+            {
+                'device_id': row.deviceid,
+                'description': row.description,
+                'customerid': row.customerid,
+                'current_period_energy': row.current_kwh,
+                'previous_period_energy': row.previous_kwh,
+                'growth_kwh': row.growth_kwh,
+                'growth_percentage': row.growth_percentage,
+                'current_period': current_period,
+                'previous_period': previous_period
+            }
+            for row in df.itertuples(index=False)
+        ]
\ No newline at end of file
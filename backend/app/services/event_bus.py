@@ -0,0 +1,247 @@
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core.metrics import record_stage
+
+# Políticas cuando la cola está llena
+OVERFLOW_POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+_STOP = object()
+
+
+class _Event:
+    __slots__ = ('event_type', 'data', 'observers', 'publicado')
+
+    def __init__(self, event_type: str, data: Any, observers: Sequence):
+        self.event_type = event_type
+        self.data = data
+        self.observers = observers
+        self.publicado = time.monotonic()
+
+
+def _sink_name(observer) -> str:
+    return type(observer).__name__
+
+
+class EventBus:
+    """
+    Entrega asíncrona de los eventos de Subject.notify a sus observadores, fuera del hilo de la solicitud:
+
+    - Cola acotada a `capacity` eventos; publish solo encola y retorna.
+    - `workers` hilos de despacho: cada uno toma un evento y los que ya estén en cola (hasta
+      `batch_size`) y entrega a cada observador (sink) su lote con update_batch, de modo que un
+      sink lento (correo, base de datos, webhook) paga su latencia una vez por lote.
+    - Cola llena según `overflow`: drop_new descarta el evento nuevo, drop_oldest descarta el más
+      antiguo y block espera hasta `block_seconds` (contrapresión) antes de descartarlo.
+    - Un error en un observador se cuenta y no afecta a los demás ni a la solicitud.
+    - Tras shutdown el bus queda cerrado: publish descarta (y cuenta) los eventos nuevos.
+
+    Los observadores reciben el mismo diccionario del evento (copia superficial): no deben modificarlo.
+    """
+
+    def __init__(self, capacity: int = 10000, workers: int = 1, batch_size: int = 100,
+                 overflow: str = 'drop_oldest', block_seconds: float = 0.05):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desbordamiento no válida: {overflow} (opciones: {', '.join(OVERFLOW_POLICIES)})")
+        self.capacity = capacity
+        self.batch_size = max(1, batch_size)
+        self.overflow = overflow
+        self.block_seconds = block_seconds
+        self._queue: "queue.Queue" = queue.Queue(maxsize=capacity)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0  # Eventos publicados y aún no entregados (en cola o en despacho)
+        self._enqueuing = 0  # Llamadas a publish que aún no terminan de encolar
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+        self.dispatched = 0
+        self.batches = 0
+        self.max_depth = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        self._sinks: Dict[str, dict] = {}
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"event-bus-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def publish(self, event_type: str, data: Any, observers: Sequence) -> bool:
+        """
+        Encola el evento para los observadores dados. Retorna False si se descartó por cola llena
+        o porque el bus ya está cerrado.
+        """
+        if not observers:
+            return True
+        if isinstance(data, dict):
+            data = dict(data)
+        event = _Event(event_type, data, tuple(observers))
+
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self._enqueuing += 1
+        try:
+            if self.overflow == 'block':
+                self._queue.put(event, timeout=self.block_seconds)
+            elif self.overflow == 'drop_oldest':
+                self._put_dropping_oldest(event)
+            else:
+                self._queue.put_nowait(event)
+        except queue.Full:
+            self._discard()
+            return False
+        finally:
+            with self._lock:
+                self._enqueuing -= 1
+                if self._enqueuing == 0:
+                    self._idle.notify_all()
+        with self._lock:
+            self.published += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _put_dropping_oldest(self, event: _Event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    oldest = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if oldest is _STOP:
+                    self._queue.put(oldest)
+                    raise queue.Full
+                self._discard()
+
+    def _discard(self):
+        with self._lock:
+            self.dropped += 1
+            self._done(1)
+
+    def _done(self, count: int):
+        """Descuenta eventos terminados (llamar con el lock tomado)."""
+        self._pending -= count
+        if self._pending <= 0:
+            self._idle.notify_all()
+
+    def _worker(self):
+        while True:
+            event = self._queue.get()
+            if event is _STOP:
+                return
+            batch = [event]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    event = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    stop = True
+                    break
+                batch.append(event)
+            try:
+                self._deliver(batch)
+            finally:
+                ahora = time.monotonic()
+                with self._lock:
+                    self.dispatched += len(batch)
+                    self.batches += 1
+                    for event in batch:
+                        latency = ahora - event.publicado
+                        self._latency_total += latency
+                        self._latency_max = max(self._latency_max, latency)
+                    self._done(len(batch))
+            if stop:
+                return
+
+    def _deliver(self, batch: List[_Event]):
+        """Agrupa el lote por observador y entrega a cada uno sus eventos en orden de publicación."""
+        por_sink: Dict[int, tuple] = {}
+        for event in batch:
+            for observer in event.observers:
+                por_sink.setdefault(id(observer), (observer, []))[1].append((event.event_type, event.data))
+        for observer, events in por_sink.values():
+            start = time.perf_counter()
+            error = None
+            try:
+                update_batch = getattr(observer, 'update_batch', None)
+                if update_batch is not None:
+                    update_batch(events)
+                else:
+                    for event_type, data in events:
+                        observer.update(event_type, data)
+            except Exception as e:
+                error = e
+                print(f"[INFO] Error entregando {len(events)} eventos a {_sink_name(observer)}: {e}")
+            elapsed = time.perf_counter() - start
+            record_stage('observer_delivery', elapsed)
+            with self._lock:
+                sink = self._sinks.setdefault(_sink_name(observer), {
+                    'delivered': 0, 'failed': 0, 'batches': 0, 'seconds': 0.0, 'last_error': None
+                })
+                sink['batches'] += 1
+                sink['seconds'] += elapsed
+                if error is None:
+                    sink['delivered'] += len(events)
+                else:
+                    sink['failed'] += len(events)
+                    sink['last_error'] = str(error)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se entreguen los eventos publicados. Retorna False si venció el plazo."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+    def shutdown(self, timeout: float = 5.0):
+        """
+        Cierra el bus, entrega lo que queda en cola (hasta `timeout` segundos) y detiene los hilos de
+        despacho. El cierre se marca bajo el lock antes de encolar _STOP, y se espera a que terminen
+        los publish en curso, de modo que ningún evento aceptado quede detrás de _STOP sin entregarse.
+        """
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            if self._closed:
+                return
+            self._closed = True
+            self._idle.wait_for(lambda: self._enqueuing == 0, timeout=timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            pendientes = self._pending
+        if pendientes > 0:
+            print(f"[INFO] Bus de eventos detenido con {pendientes} eventos sin entregar")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'running': not self._closed,
+                'capacity': self.capacity,
+                'workers': len(self._threads),
+                'batch_size': self.batch_size,
+                'overflow': self.overflow,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self.max_depth,
+                'pending': self._pending,
+                'published': self.published,
+                'dropped': self.dropped,
+                'dispatched': self.dispatched,
+                'batches': self.batches,
+                'avg_batch_size': round(self.dispatched / self.batches, 2) if self.batches else None,
+                'avg_delivery_ms': round(self._latency_total / self.dispatched * 1000, 3) if self.dispatched else None,
+                'max_delivery_ms': round(self._latency_max * 1000, 3),
+                'sinks': {
+                    name: {**sink, 'seconds': round(sink['seconds'], 4)} for name, sink in self._sinks.items()
+                }
+            }
@@ -0,0 +1,135 @@
+import copy
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Optional
+
+from app.core.config import settings
+from app.services.intent_parser import normalize
+
+_PUNCTUATION = re.compile(r'[^0-9a-z%/\-]+')
+_SPACES = re.compile(r'\s+')
+
+
+def _previous_month(today: date) -> date:
+    return (today.replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+# Expresiones de fecha relativa → fecha absoluta (anteayer antes que ayer, "mes pasado" antes que "mes")
+_RELATIVE_DATES = [
+    (re.compile(r'\b(?:antier|anteayer|antes de ayer)\b'), lambda today: (today - timedelta(days=2)).isoformat()),
+    (re.compile(r'\bayer\b'), lambda today: (today - timedelta(days=1)).isoformat()),
+    (re.compile(r'\bhoy\b'), lambda today: today.isoformat()),
+    (re.compile(r'\b(?:la\s+)?semana\s+(?:pasada|anterior)\b'),
+     lambda today: 'semana %d-W%02d' % (today - timedelta(days=7)).isocalendar()[:2]),
+    (re.compile(r'\besta\s+semana\b'), lambda today: 'semana %d-W%02d' % today.isocalendar()[:2]),
+    (re.compile(r'\b(?:el\s+)?mes\s+(?:pasado|anterior)\b'), lambda today: _previous_month(today).strftime('%Y-%m')),
+    (re.compile(r'\beste\s+mes\b'), lambda today: today.strftime('%Y-%m')),
+    (re.compile(r'\b(?:el\s+)?ano\s+(?:pasado|anterior)\b'), lambda today: f"ano {today.year - 1}"),
+    (re.compile(r'\beste\s+ano\b'), lambda today: f"ano {today.year}"),
+]
+
+
+def normalize_message(message: str, today: Optional[date] = None) -> str:
+    """
+    Forma canónica de una consulta del chat para la caché: minúsculas, sin tildes, puntuación y
+    espacios colapsados y fechas relativas ("ayer", "el mes pasado") reemplazadas por la fecha absoluta
+    del día en curso, de modo que la misma pregunta otro día no reutiliza un análisis con otra fecha.
+    """
+    today = today or date.today()
+    text = _SPACES.sub(' ', _PUNCTUATION.sub(' ', normalize(message))).strip()
+    for regex, anchor in _RELATIVE_DATES:
+        text = regex.sub(lambda _: anchor(today), text)
+    return text
+
+
+class IntentCache:
+    """
+    Caché en memoria del análisis de consultas del chat (query_type, medidor, fechas, ...) que
+    retorna Gemini, para no repetir la llamada al modelo con la misma pregunta:
+
+    - Clave: consulta normalizada (normalize_message) y modelo.
+    - LRU acotado a `capacity` entradas con vencimiento `ttl_seconds`.
+    - Al cambiar la versión del prompt de análisis se descartan todas las entradas.
+    """
+
+    def __init__(self, capacity: int = 1024, ttl_seconds: int = 24 * 3600):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.prompt_version = None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(message: str, model_id: str, today: Optional[date] = None) -> str:
+        return f"{model_id}|{normalize_message(message, today)}"
+
+    def _check_version(self, prompt_version):
+        """Descarta las entradas de una versión anterior del prompt (llamar con el lock tomado)."""
+        if prompt_version != self.prompt_version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.prompt_version = prompt_version
+
+    def get(self, key: str, prompt_version) -> Optional[dict]:
+        """Retorna una copia del análisis guardado o None."""
+        with self._lock:
+            self._check_version(prompt_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expira = entry
+                if expira > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict, prompt_version):
+        with self._lock:
+            self._check_version(prompt_version)
+            self._entries[key] = (copy.deepcopy(value), time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'capacity': self.capacity,
+                'ttl_seconds': self.ttl_seconds,
+                'prompt_version': self.prompt_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+# Instancia compartida por el proceso
+intent_cache = IntentCache(
+    capacity=settings.INTENT_CACHE_SIZE,
+    ttl_seconds=settings.INTENT_CACHE_TTL_SECONDS
+)
@@ -0,0 +1,402 @@
+"""
+Parser local (determinista) de las consultas del chat: tipo de consulta, medidor, lugar, fechas,
+año base y umbral, con un puntaje de confianza. Las consultas habituales ("energía del medidor X en
+agosto 2024") se resuelven sin pasar por Gemini; las ambiguas o incompletas quedan con confianza baja.
+
+Retorna el mismo formato que el análisis de Gemini (ver ChatService._build_query_analysis_prompt).
+"""
+
+import copy
+import re
+import unicodedata
+from calendar import monthrange
+from datetime import date
+from typing import List, Optional
+
+MONTHS = {
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7,
+    'agosto': 8, 'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12
+}
+MONTH_NAMES = ['', 'enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio',
+               'julio', 'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']
+
+# Palabras clave por tipo de consulta (texto en minúsculas y sin tildes)
+INTENT_KEYWORDS = {
+    'load_curve_comparison': ('curva de carga', 'comparar curva', 'compara la curva', 'analisis de curva',
+                              'comparacion de curva', 'patron diario', 'curva del'),
+    'max_power': ('potencia maxima', 'maxima potencia', 'potencia pico', 'pico de potencia', 'demanda pico',
+                  'demanda maxima', 'pico de demanda'),
+    'anomalies': ('anomalia', 'desviacion', 'outlier', 'anormal'),
+    'energy_consumption': ('energia', 'consumo', 'kwh', 'consumio', 'consumida', 'consumido'),
+}
+# Ante un empate gana el tipo más específico; energy_consumption es el más genérico
+# ("anomalías de consumo" es una búsqueda de anomalías)
+INTENT_PRIORITY = ('load_curve_comparison', 'max_power', 'anomalies', 'energy_consumption')
+
+# Datos que necesita cada tipo de consulta para ejecutarse sin preguntar
+REQUIRED_SLOTS = {
+    'energy_consumption': ('target', 'period'),
+    'max_power': ('device_id', 'period'),
+    'load_curve_comparison': ('device_id', 'day', 'base_year'),
+    'anomalies': ('period',),
+}
+
+DEFAULT_THRESHOLD = 20
+
+_MONTH = '(' + '|'.join(MONTHS) + ')'
+_YEAR_LINK = r'(?:\s+(?:de(?:l)?\s+)?(\d{4}))'
+
+_DEVICE_RE = re.compile(r'(?<!\d)\d{8}(?!\d)')
+_BASE_YEAR_RE = re.compile(
+    r'(?:ano\s+base|comparad[oa]s?\s+con(?:\s+el)?(?:\s+ano)?|respecto\s+al?(?:\s+ano)?|frente\s+al?(?:\s+ano)?'
+    r'|promedio(?:\s+(?:del|para\s+el|de))?(?:\s+ano)?|contra(?:\s+el)?(?:\s+ano)?|vs\.?)\s+(\d{4})\b'
+)
+# Comparación entre periodos: solo la usan las consultas con año base (anomalías y curva de carga)
+_COMPARISON_RE = re.compile(r'\b(?:vs\.?|versus|comparad[oa]s?\s+con|frente\s+al?|respecto\s+al?|contra)(?=\s|$)')
+BASE_YEAR_TYPES = ('anomalies', 'load_curve_comparison')
+_THRESHOLD_RE = re.compile(r'umbral\s+(?:de(?:l)?\s+)?(\d+(?:[.,]\d+)?)\s*%?|(\d+(?:[.,]\d+)?)\s*(?:%|por\s*ciento)')
+_DAY_RANGE_RE = re.compile(rf'\bdel?\s+(\d{{1,2}})\s+(?:al?|hasta\s+el)\s+(\d{{1,2}})\s+de\s+{_MONTH}{_YEAR_LINK}?')
+_MONTH_RANGE_RE = re.compile(rf'\b{_MONTH}(?:\s+(?:de(?:l)?\s+)?(\d{{4}}))?\s+(?:al?|y|hasta)\s+{_MONTH}{_YEAR_LINK}')
+_ISO_DATE_RE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+_SLASH_DATE_RE = re.compile(r'\b(\d{1,2})/(\d{1,2})/(\d{4})\b')
+_DAY_RE = re.compile(rf'\b(\d{{1,2}})\s+de\s+{_MONTH}{_YEAR_LINK}?')
+_MONTH_YEAR_RE = re.compile(rf'\b{_MONTH}{_YEAR_LINK}')
+_YEAR_RE = re.compile(r'\b(?:en|durante|del?)\s+(?:el\s+)?(?:ano\s+)?(\d{4})\b')
+_ANY_YEAR_RE = re.compile(r'\b(\d{4})\b')
+
+# Seguimientos dentro de una sesión: "¿y en septiembre?", "muéstrame el segundo"
+_FOLLOW_UP_RE = re.compile(r'^[\s¿¡]*(?:y|e|tambien|ahora|que\s+tal|lo\s+mismo|igual)\b')
+_MONTH_NO_YEAR_RE = re.compile(rf'\b{_MONTH}\b')
+_DAY_NO_YEAR_RE = re.compile(rf'\b(\d{{1,2}})\s+de\s+{_MONTH}\b')
+_ORDINAL_RE = re.compile(r'\b(primer[oa]?|segund[oa]|tercer[oa]?|cuart[oa]|quint[oa]|sext[oa]|se?ptim[oa]|octav[oa]'
+                         r'|noven[oa]|decim[oa]|ultim[oa])\b')
+_NUMBERED_RE = re.compile(r'(?:\b(?:el|la|numero|nro)\.?\s*|#)(\d{1,2})\b')
+ORDINALS = {'primer': 1, 'segund': 2, 'tercer': 3, 'cuart': 4, 'quint': 5, 'sext': 6, 'septim': 7, 'setim': 7,
+            'octav': 8, 'noven': 9, 'decim': 10, 'ultim': -1}
+ANALYSIS_KEYS = ('query_type', 'device_id', 'location_name', 'start_date', 'end_date', 'period_description',
+                 'additional_params')
+
+# Instrucciones al modelo, comandos o consultas fuera de alcance: siempre las revisa Gemini
+_SUSPICIOUS_RE = re.compile(
+    r'\b(ignore|ignora|olvida|forget|act\s+as|actua\s+como|system\s+prompt|instrucciones|instructions'
+    r'|sudo|rm\s+-|eval|exec|execute|drop\s+table|delete\s+from)\b'
+)
+
+# Palabras que terminan un nombre de lugar después de "en", "de", "del" o "desde"
+_PLACE_PREPOSITIONS = {'en', 'de', 'del', 'desde'}
+_PLACE_STOP_WORDS = {
+    'cual', 'fue', 'el', 'consumo', 'de', 'del', 'en', 'la', 'las', 'los', 'energia', 'medidor', 'medidores',
+    'durante', 'mes', 'ano', 'kwh', 'cuanto', 'cuanta', 'potencia', 'maxima', 'curva', 'carga', 'dia', 'que',
+    'total', 'periodo', 'consumio', 'y', 'a', 'al', 'entre', 'con', 'para', 'por', 'hasta'
+}
+
+# Respuesta que confirma la acción pendiente: el mensaje completo (sin tildes) son palabras de confirmación
+_CONFIRMATION_RE = re.compile(
+    r'^[\s¡!¿.,]*(?:(?:si|ok|okay|vale|dale|claro|confirmar|confirmo|confirmado|adelante|continuar|continua'
+    r'|proceder|procede|hazlo|yes|por\s+favor|de\s+acuerdo)\b[\s¡!.,]*)+$'
+)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin tildes (conserva la puntuación para fechas como 2025-10-20)."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _blank(text: str, match) -> str:
+    """Reemplaza el tramo reconocido por espacios (mismas posiciones) para no volver a reconocerlo."""
+    start, end = match.span()
+    return text[:start] + ' ' * (end - start) + text[end:]
+
+
+def _day(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def _month_bounds(year: int, month: int):
+    return date(year, month, 1), date(year, month, monthrange(year, month)[1])
+
+
+def _extract_periods(text: str) -> List[dict]:
+    """Periodos mencionados (del más específico al más general) como {kind, start, end, description}."""
+    periods = []
+
+    def add(kind, start, end, description):
+        if start is not None and end is not None and start <= end:
+            periods.append({'kind': kind, 'start': start, 'end': end, 'description': description})
+
+    for regex in (_DAY_RANGE_RE, _MONTH_RANGE_RE, _ISO_DATE_RE, _SLASH_DATE_RE, _DAY_RE, _MONTH_YEAR_RE, _YEAR_RE):
+        for match in list(regex.finditer(text)):
+            g = match.groups()
+            if regex is _DAY_RANGE_RE and g[3]:
+                year, month = int(g[3]), MONTHS[g[2]]
+                add('range', _day(year, month, int(g[0])), _day(year, month, int(g[1])),
+                    f"del {int(g[0])} al {int(g[1])} de {MONTH_NAMES[month]} de {year}")
+            elif regex is _MONTH_RANGE_RE:
+                end_year = int(g[3])
+                start_year = int(g[1]) if g[1] else end_year
+                first, last = MONTHS[g[0]], MONTHS[g[2]]
+                add('range', _month_bounds(start_year, first)[0], _month_bounds(end_year, last)[1],
+                    f"{MONTH_NAMES[first]} a {MONTH_NAMES[last]} {end_year}")
+            elif regex is _ISO_DATE_RE:
+                day = _day(int(g[0]), int(g[1]), int(g[2]))
+                add('day', day, day, day.isoformat() if day else None)
+            elif regex is _SLASH_DATE_RE:
+                day = _day(int(g[2]), int(g[1]), int(g[0]))
+                add('day', day, day, day.isoformat() if day else None)
+            elif regex is _DAY_RE and g[2]:
+                year, month = int(g[2]), MONTHS[g[1]]
+                day = _day(year, month, int(g[0]))
+                add('day', day, day, f"{int(g[0])} de {MONTH_NAMES[month]} de {year}")
+            elif regex is _MONTH_YEAR_RE:
+                year, month = int(g[1]), MONTHS[g[0]]
+                add('month', *_month_bounds(year, month), f"{MONTH_NAMES[month]} {year}")
+            elif regex is _YEAR_RE:
+                year = int(g[0])
+                add('year', date(year, 1, 1), date(year, 12, 31), f"año {year}")
+            else:
+                # Día o rango sin año: incompleto, no se usa como periodo
+                continue
+            text = _blank(text, match)
+    return periods
+
+
+def _extract_location(message: str) -> Optional[str]:
+    """Nombre de lugar después de "en", "de", "del" o "desde" (ej: "Consumo de Isla Múcura en abril 2024")."""
+    words = message.split()
+    for i, word in enumerate(words):
+        if normalize(word.strip('¿?.,;:')) not in _PLACE_PREPOSITIONS:
+            continue
+        place_words = []
+        for next_word in words[i + 1:]:
+            clean = next_word.strip('¿?¡!.,;:')
+            folded = normalize(clean)
+            if not clean or folded in _PLACE_STOP_WORDS or folded in MONTHS or any(c.isdigit() for c in clean):
+                break
+            place_words.append(clean)
+            if next_word != next_word.rstrip('?.,;:'):
+                break
+        place = ' '.join(place_words)
+        if len(place) > 3:  # Evitar lugares muy cortos
+            return place
+    return None
+
+
+def _query_type(text: str):
+    """(tipo, ambiguo): el tipo con más palabras clave; ambiguo si empatan dos tipos específicos."""
+    hits = {tipo: sum(1 for keyword in keywords if keyword in text) for tipo, keywords in INTENT_KEYWORDS.items()}
+    best = max(hits.values())
+    if best == 0:
+        return 'other', False
+    tied = [tipo for tipo in INTENT_PRIORITY if hits[tipo] == best]
+    specific = [tipo for tipo in tied if tipo != 'energy_consumption']
+    return tied[0], len(specific) > 1
+
+
+def parse_intent(message: str) -> dict:
+    """
+    Analiza la consulta con expresiones regulares precompiladas y retorna el análisis en el formato
+    de Gemini más `confidence` (0 a 1):
+
+    - 0.4 si el tipo de consulta es claro (0.2 si empatan dos tipos específicos, 0 si no se reconoce).
+    - Hasta 0.6 según los datos requeridos por el tipo que se encontraron (medidor, periodo, año base).
+    - Se resta si hay varios medidores o periodos distintos, o si el medidor se identifica solo por
+      un lugar (hay que buscarlo).
+    - Se resta 0.5 si el mensaje pide una comparación ("vs", "comparado con", "frente a") o menciona
+      otro año que el tipo de consulta no usa ("consumo en 2024 vs 2023"): no se responde solo una parte.
+    - 0 si el mensaje parece contener instrucciones al modelo o comandos.
+    """
+    text = normalize(message)
+    query_type, ambiguous = _query_type(text)
+    comparison = bool(_COMPARISON_RE.search(text))
+
+    device_ids = list(dict.fromkeys(_DEVICE_RE.findall(text)))
+    for match in list(_DEVICE_RE.finditer(text)):
+        text = _blank(text, match)
+
+    additional_params = {}
+    base_year_match = _BASE_YEAR_RE.search(text)
+    if base_year_match:
+        additional_params['base_year'] = int(base_year_match.group(1))
+        text = _blank(text, base_year_match)
+
+    threshold_match = _THRESHOLD_RE.search(text)
+    if threshold_match:
+        value = float((threshold_match.group(1) or threshold_match.group(2)).replace(',', '.'))
+        additional_params['threshold'] = int(value) if value.is_integer() else value
+        text = _blank(text, threshold_match)
+
+    periods = _extract_periods(text)
+    distinct_periods = {(p['start'], p['end']) for p in periods}
+
+    device_id = device_ids[0] if device_ids else None
+    location_name = _extract_location(message) if not device_id and query_type == 'energy_consumption' else None
+
+    start_date = end_date = period_description = None
+    slots = {'device_id': bool(device_id), 'target': bool(device_id or location_name)}
+
+    if query_type == 'load_curve_comparison':
+        day = next((p for p in periods if p['kind'] == 'day'), None)
+        if day:
+            start_date, period_description = day['start'].isoformat(), day['description']
+            if 'base_year' not in additional_params:
+                # Año base: otro año mencionado distinto al de la fecha analizada
+                other_years = [int(y) for y in _ANY_YEAR_RE.findall(text) if int(y) != day['start'].year]
+                if other_years:
+                    additional_params['base_year'] = other_years[-1]
+        slots['day'] = day is not None
+        distinct_periods = {(p['start'], p['end']) for p in periods if p['kind'] == 'day'}
+    elif periods:
+        period = periods[0]
+        start_date, end_date = period['start'].isoformat(), period['end'].isoformat()
+        period_description = period['description']
+        if query_type == 'anomalies':
+            # Sin año base explícito: el año anterior al periodo consultado
+            additional_params.setdefault('base_year', period['start'].year - 1)
+            additional_params.setdefault('threshold', DEFAULT_THRESHOLD)
+    slots['period'] = start_date is not None and end_date is not None
+    slots['base_year'] = 'base_year' in additional_params
+
+    # Años mencionados que no cubre el periodo ni son el año base (p. ej. el segundo año de una comparación)
+    if start_date:
+        used_years = set(range(int(start_date[:4]), int((end_date or start_date)[:4]) + 1))
+        used_years.add(additional_params.get('base_year'))
+        unused_years = [y for y in _ANY_YEAR_RE.findall(text) if int(y) not in used_years]
+    else:
+        unused_years = []
+    if query_type not in BASE_YEAR_TYPES and base_year_match:
+        # "vs 2023" en una consulta que no compara: ese año no se usa
+        unused_years.append(base_year_match.group(1))
+    unanswered = unused_years or (comparison and query_type not in BASE_YEAR_TYPES)
+
+    if query_type == 'other':
+        confidence = 0.0
+    else:
+        required = REQUIRED_SLOTS[query_type]
+        confidence = (0.2 if ambiguous else 0.4) + 0.6 * sum(slots[s] for s in required) / len(required)
+        if len(device_ids) > 1:
+            confidence -= 0.3
+        if len(distinct_periods) > 1:
+            confidence -= 0.3
+        if location_name:
+            confidence -= 0.1
+        if unanswered:
+            confidence -= 0.5
+    if _SUSPICIOUS_RE.search(text):
+        confidence = 0.0
+
+    return {
+        "query_type": query_type,
+        "device_id": device_id,
+        "location_name": location_name,
+        "start_date": start_date,
+        "end_date": end_date,
+        "period_description": period_description,
+        "additional_params": additional_params,
+        "confidence": round(max(confidence, 0.0), 2)
+    }
+
+
+def is_confirmation(message: str) -> bool:
+    """
+    Indica si el mensaje confirma la acción pendiente ("sí", "ok, adelante", "Sí, confirmar").
+    Se compara el mensaje completo: una consulta que contiene "si" ("muéstrame el análisis...") no confirma.
+    """
+    return bool(_CONFIRMATION_RE.match(normalize(message)))
+
+
+def parse_ordinal(message: str) -> Optional[int]:
+    """
+    Posición elegida de una lista mostrada antes ("muéstrame el segundo", "el 3", "el último"):
+    desde 1, -1 para el último; None si el mensaje no es una selección.
+    """
+    text = normalize(message)
+    if len(text.split()) > 6 or _DEVICE_RE.search(text) or _MONTH_NO_YEAR_RE.search(text):
+        return None
+    match = _ORDINAL_RE.search(text)
+    if match:
+        return ORDINALS[match.group(1).rstrip('oa')]
+    match = _NUMBERED_RE.search(text)
+    if match and int(match.group(1)) > 0:
+        return int(match.group(1))
+    return None
+
+
+def resolve_follow_up(message: str, previous: Optional[dict]) -> Optional[dict]:
+    """
+    Completa una consulta de seguimiento con el análisis anterior de la sesión: "¿y en septiembre?"
+    (mismo medidor, otro mes del mismo año), "y el medidor 36075004", "¿y con umbral de 30%?".
+    Retorna None si el mensaje no es un seguimiento del mismo tipo de consulta o no cambia nada.
+    """
+    if not previous or previous.get('query_type') not in REQUIRED_SLOTS:
+        return None
+    text = normalize(message)
+    if _SUSPICIOUS_RE.search(text):
+        return None
+    parsed = parse_intent(message)
+    query_type = previous['query_type']
+    if parsed['query_type'] not in ('other', query_type):
+        return None
+    if not (_FOLLOW_UP_RE.match(text) or parsed['query_type'] == 'other' or parsed['confidence'] < 1.0):
+        return None
+
+    merged = copy.deepcopy({key: previous.get(key) for key in ANALYSIS_KEYS})
+    params = merged['additional_params'] = dict(merged.get('additional_params') or {})
+    params.pop('confirmed', None)
+    changed = False
+
+    if parsed['device_id']:
+        merged['device_id'], merged['location_name'] = parsed['device_id'], None
+        changed = True
+    elif parsed['location_name']:
+        merged['device_id'], merged['location_name'] = None, parsed['location_name']
+        changed = True
+
+    previous_year = int(previous['start_date'][:4]) if previous.get('start_date') else None
+    new_year = None
+    if parsed['start_date']:
+        merged['start_date'], merged['end_date'] = parsed['start_date'], parsed['end_date']
+        merged['period_description'] = parsed['period_description']
+        new_year = int(parsed['start_date'][:4])
+    elif previous_year:
+        # Fecha o mes sin año: el año de la consulta anterior
+        day_match = _DAY_NO_YEAR_RE.search(text)
+        month_match = _MONTH_NO_YEAR_RE.search(text)
+        if day_match and query_type == 'load_curve_comparison':
+            month = MONTHS[day_match.group(2)]
+            day = _day(previous_year, month, int(day_match.group(1)))
+            if day:
+                merged['start_date'] = day.isoformat()
+                merged['period_description'] = f"{day.day} de {MONTH_NAMES[month]} de {previous_year}"
+                new_year = previous_year
+        elif month_match and query_type != 'load_curve_comparison':
+            month = MONTHS[month_match.group(1)]
+            start, end = _month_bounds(previous_year, month)
+            merged['start_date'], merged['end_date'] = start.isoformat(), end.isoformat()
+            merged['period_description'] = f"{MONTH_NAMES[month]} {previous_year}"
+            new_year = previous_year
+    if new_year is not None:
+        changed = True
+        if query_type == 'load_curve_comparison':
+            merged['end_date'] = None
+
+    base_year_match = _BASE_YEAR_RE.search(text)
+    if base_year_match:
+        params['base_year'] = int(base_year_match.group(1))
+        changed = True
+    elif query_type == 'anomalies' and new_year and params.get('base_year') == previous_year - 1:
+        # El año base por defecto sigue al periodo consultado
+        params['base_year'] = new_year - 1
+    threshold_match = _THRESHOLD_RE.search(text)
+    if threshold_match:
+        value = float((threshold_match.group(1) or threshold_match.group(2)).replace(',', '.'))
+        params['threshold'] = int(value) if value.is_integer() else value
+        changed = True
+
+    if not changed:
+        return None
+    merged['confidence'] = 1.0
+    return merged
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from app.data.database import SessionLocal
+from app.data.models import MTrabajo
+from app.data.repositories import EnergyRepository
+
+JOB_ACTIVE_STATES = ('pendiente', 'en_curso')
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro de un trabajo cuando se solicitó su cancelación."""
+
+
+def job_key(tipo: str, parametros: dict) -> str:
+    """Clave de deduplicación: sha256 del tipo y los parámetros del trabajo."""
+    contenido = json.dumps({'tipo': tipo, 'parametros': parametros}, sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def job_to_dict(job: MTrabajo, reused: bool = False) -> dict:
+    """Estado y progreso de un trabajo (sin el resultado)."""
+    return {
+        'job_id': job.id,
+        'type': job.tipo,
+        'status': job.estado,
+        'params': json.loads(job.parametros),
+        'processed': job.procesados,
+        'total': job.total,
+        'progress': round(job.procesados / job.total * 100, 1) if job.total else (100.0 if job.estado == 'completado' else 0.0),
+        'anomalies': job.anomalias,
+        'error': job.error,
+        'created_at': job.creado,
+        'started_at': job.iniciado,
+        'updated_at': job.actualizado,
+        'finished_at': job.terminado,
+        'reused': reused
+    }
+
+
+class JobManager:
+    """
+    Trabajos largos en segundo plano (búsqueda de anomalías de la flota) con un pool acotado de hilos.
+
+    - Cada trabajo queda registrado en m_trabajos con su estado, progreso y resultado, de modo
+      que se puede consultar y releer después de la solicitud que lo creó.
+    - Un trabajo con los mismos parámetros que sigue pendiente o en curso, o que terminó hace
+      menos de JOB_RESULT_REUSE_SECONDS, se reutiliza en lugar de calcularse de nuevo.
+    - La cancelación se revisa entre bloques de medidores; un trabajo pendiente se cancela de inmediato.
+      Cada bloque actualiza el progreso solo si el trabajo sigue activo en m_trabajos, de modo que
+      también se detiene cuando otro proceso lo cancela (o lo marca como interrumpido), y su estado
+      final nunca sobrescribe esa cancelación.
+
+    Los trabajos corren en el proceso que los creó (su propietario, equipo:pid), que renueva cada
+    `heartbeat_seconds` la fecha de actualización de sus trabajos activos. Un trabajo activo sin
+    latido durante `stale_seconds` quedó huérfano (su proceso terminó) y se marca como interrumpido,
+    igual que al iniciar los de un proceso anterior de este equipo (mark_interrupted); los trabajos
+    vivos de otros procesos no se tocan.
+    """
+
+    def __init__(self, service_factory: Callable, session_factory=SessionLocal,
+                 max_workers: int = 2, reuse_seconds: int = 600,
+                 heartbeat_seconds: float = 30.0, stale_seconds: float = 120.0):
+        self._service_factory = service_factory
+        self._session_factory = session_factory
+        self.reuse_seconds = reuse_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="jobs")
+        self._lock = threading.Lock()
+        self._cancel_events = {}
+        self._futures = {}
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="jobs-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    @contextmanager
+    def _repository(self):
+        db = self._session_factory()
+        try:
+            yield EnergyRepository(db)
+        finally:
+            db.close()
+
+    def submit_outlier_scan(self, base_year: int, start_date: str, end_date: str, threshold: float) -> dict:
+        """Encola una búsqueda de anomalías de la flota (o reutiliza una igual) y retorna su estado."""
+        parametros = {
+            'base_year': int(base_year),
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+            'threshold': float(threshold)
+        }
+        return self._submit('outliers', parametros, self._run_outlier_scan)
+
+    def _submit(self, tipo: str, parametros: dict, target: Callable) -> dict:
+        clave = job_key(tipo, parametros)
+        with self._lock, self._repository() as repo:
+            ahora = datetime.now()
+            existente = repo.find_reusable_job(tipo, clave, ahora - timedelta(seconds=self.reuse_seconds),
+                                               alive_since=ahora - timedelta(seconds=self.stale_seconds))
+            if existente is not None:
+                print(f"[INFO] Trabajo {existente.id} reutilizado ({existente.estado})")
+                return job_to_dict(existente, reused=True)
+
+            job = repo.create_job(uuid.uuid4().hex, tipo, clave, parametros, propietario=self.owner)
+            self._cancel_events[job.id] = threading.Event()
+            self._futures[job.id] = self._executor.submit(self._run, job.id, target, parametros)
+            print(f"[INFO] Trabajo {job.id} ({tipo}) encolado")
+            return job_to_dict(job)
+
+    def _run(self, job_id: str, target: Callable, parametros: dict) -> str:
+        """Ejecuta un trabajo en un hilo del pool y registra su estado final."""
+        cancel_event = self._cancel_events[job_id]
+        try:
+            if cancel_event.is_set():
+                raise JobCancelled()
+            if not self._update(job_id, estado='en_curso', iniciado=datetime.now()):
+                # Cancelado (o interrumpido) desde otro proceso antes de empezar
+                raise JobCancelled()
+
+            def progress(procesados: int, total: int, anomalias: int):
+                # Solo el progreso: el resultado se guarda una vez, al terminar
+                activo = self._update(job_id, procesados=procesados, total=total, anomalias=anomalias)
+                if cancel_event.is_set() or not activo:
+                    raise JobCancelled()
+
+            with self._repository() as repo:
+                resultado = target(self._service_factory(repo.db), parametros, progress)
+
+            completado = self._update(
+                job_id, estado='completado', terminado=datetime.now(), anomalias=len(resultado),
+                resultado=json.dumps(resultado, ensure_ascii=False, default=str)
+            )
+            if not completado:
+                raise JobCancelled()
+            print(f"[INFO] Trabajo {job_id} completado")
+            return 'completado'
+        except JobCancelled:
+            self._update(job_id, estado='cancelado', terminado=datetime.now())
+            print(f"[INFO] Trabajo {job_id} cancelado")
+            return 'cancelado'
+        except Exception as e:
+            print(f"[INFO] Trabajo {job_id} terminó con error: {e}")
+            self._update(job_id, estado='error', error=str(e), terminado=datetime.now())
+            return 'error'
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+
+    def _run_outlier_scan(self, service, parametros: dict, progress: Callable) -> list:
+        return service.find_outlier_devices(
+            base_year=parametros['base_year'],
+            start_date=parametros['start_date'],
+            end_date=parametros['end_date'],
+            threshold=parametros['threshold'],
+            progress=progress
+        )
+
+    def _update(self, job_id: str, **campos) -> bool:
+        """Actualiza el trabajo solo si sigue activo; retorna False si otro proceso lo terminó."""
+        with self._repository() as repo:
+            return repo.update_job(job_id, active_only=True, **campos)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._repository() as repo:
+            job = repo.get_job(job_id)
+            return job_to_dict(job) if job else None
+
+    def get_result(self, job_id: str) -> Optional[tuple]:
+        """Retorna (estado, resultado) del trabajo; el resultado es None si no ha terminado correctamente."""
+        with self._repository() as repo:
+            job = repo.get_job(job_id)
+            if job is None:
+                return None
+            resultado = json.loads(job.resultado) if job.estado == 'completado' and job.resultado else None
+            return job_to_dict(job), resultado
+
+    def list_recent(self, limit: int = 50) -> list:
+        with self._repository() as repo:
+            return [job_to_dict(job) for job in repo.list_jobs(limit)]
+
+    def cancel(self, job_id: str) -> Optional[dict]:
+        """
+        Solicita la cancelación: un trabajo pendiente no llega a ejecutarse y uno en curso
+        se detiene al terminar el bloque de medidores actual.
+        """
+        with self._lock:
+            cancel_event = self._cancel_events.get(job_id)
+            if cancel_event is not None:
+                cancel_event.set()
+            future = self._futures.get(job_id)
+            retirado = future is not None and future.cancel()
+            if retirado:
+                self._cancel_events.pop(job_id, None)
+                self._futures.pop(job_id, None)
+
+        with self._repository() as repo:
+            job = repo.get_job(job_id)
+            if job is None:
+                return None
+            if job.estado in JOB_ACTIVE_STATES and (cancel_event is None or retirado):
+                # No está en el pool de este proceso o se retiró de la cola antes de empezar
+                repo.update_job(job_id, active_only=True, estado='cancelado', terminado=datetime.now())
+                repo.db.refresh(job)
+            return job_to_dict(job)
+
+    def future(self, job_id: str) -> Optional[Future]:
+        """Future del trabajo si está pendiente o en curso en este proceso (para esperarlo)."""
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def _heartbeat_loop(self):
+        """Renueva el latido de los trabajos de este proceso y marca los huérfanos de otros procesos."""
+        while not self._stop.wait(self.heartbeat_seconds):
+            with self._lock:
+                job_ids = list(self._futures)
+            try:
+                with self._repository() as repo:
+                    repo.touch_jobs(job_ids)
+                    count = repo.mark_interrupted_jobs(datetime.now() - timedelta(seconds=self.stale_seconds))
+                if count:
+                    print(f"[INFO] {count} trabajos sin latido marcados como interrumpidos")
+            except Exception as e:
+                print(f"[INFO] No se pudo renovar el latido de los trabajos: {e}")
+
+    def _dead_local_owners(self, owners: list) -> list:
+        """Propietarios de este equipo cuyo proceso ya no existe (o un proceso anterior con el mismo pid)."""
+        host = socket.gethostname()
+        muertos = []
+        for owner in owners:
+            owner_host, _, pid = owner.rpartition(':')
+            if owner_host != host or not pid.isdigit():
+                continue
+            if int(pid) == os.getpid():
+                # Al iniciar este proceso aún no tiene trabajos: son de una ejecución anterior
+                muertos.append(owner)
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                muertos.append(owner)
+            except PermissionError:
+                pass
+        return muertos
+
+    def mark_interrupted(self) -> int:
+        """
+        Al iniciar: marca como interrumpidos los trabajos pendientes o en curso que ya no tienen
+        proceso que los ejecute (sin latido reciente, o de un proceso terminado de este equipo).
+        """
+        with self._repository() as repo:
+            owners = self._dead_local_owners(repo.active_job_owners())
+            count = repo.mark_interrupted_jobs(datetime.now() - timedelta(seconds=self.stale_seconds), owners)
+        if count:
+            print(f"[INFO] {count} trabajos sin terminar marcados como interrumpidos")
+        return count
+
+    def shutdown(self):
+        """Cancela los trabajos en curso (se detienen en el siguiente bloque) y descarta los pendientes."""
+        self._stop.set()
+        with self._lock:
+            for cancel_event in self._cancel_events.values():
+                cancel_event.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
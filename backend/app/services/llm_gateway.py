@@ -0,0 +1,62 @@
+import asyncio
+from typing import Callable
+
+from google import genai
+
+from app.core.metrics import stage
+
+
+class GeminiGateway:
+    """
+    Llamadas asíncronas a Gemini (cliente `aio` del SDK) para los endpoints async.
+
+    - Limita las llamadas simultáneas con un semáforo (`max_concurrency`); las demás esperan turno
+      sin ocupar hilos del servidor.
+    - Cada llamada tiene un plazo (`timeout_seconds`) que incluye la espera por el semáforo;
+      al vencer se lanza asyncio.TimeoutError.
+    """
+
+    def __init__(self, client_factory: Callable[[], genai.Client], max_concurrency: int = 8, timeout_seconds: float = 60.0):
+        self._client_factory = client_factory
+        self.max_concurrency = max_concurrency
+        self.timeout_seconds = timeout_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.timeouts = 0
+
+    async def generate_content(self, model: str, contents: str, timeout: float = None):
+        """Equivalente async de client.models.generate_content con límite de concurrencia y plazo."""
+        client = self._client_factory()
+        try:
+            return await asyncio.wait_for(self._call(client, model, contents), timeout or self.timeout_seconds)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            print(f"[INFO] Llamada a {model} cancelada por plazo ({timeout or self.timeout_seconds}s)")
+            raise
+
+    async def _call(self, client: genai.Client, model: str, contents: str):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+        try:
+            with stage('llm'):
+                return await client.aio.models.generate_content(model=model, contents=contents)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'timeout_seconds': self.timeout_seconds,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'calls': self.calls,
+            'timeouts': self.timeouts
+        }
@@ -0,0 +1,268 @@
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.data.database import SessionLocal
+from app.data.models import Departamento, Localidad, Medidor, Municipio
+from app.services.search_index import SearchIndex
+
+
+class MeterRecord(NamedTuple):
+    """Metadatos de un medidor (mismos atributos que las columnas de Medidor)."""
+    deviceid: str
+    id_loc: Optional[str]
+    devicetype: Optional[str]
+    description: Optional[str]
+    connectiontype: Optional[str]
+    customerid: Optional[str]
+    usergroup: Optional[str]
+    ipaddress: Optional[str]
+    port: Optional[int]
+    activado: Optional[datetime]
+    desactivado: Optional[datetime]
+    tc_rel: Optional[str]
+    tp_rel: Optional[str]
+    ke: Optional[float]
+    id_cen: Optional[str]
+
+
+class LocalidadRecord(NamedTuple):
+    id_loc: str
+    id_mun: str
+    localidad: str
+    clas_politica: Optional[str]
+    latitud: Optional[float]
+    longitud: Optional[float]
+    id_empresa: Optional[int]
+
+
+class MunicipioRecord(NamedTuple):
+    id_mun: str
+    id_dep: str
+    municipio: Optional[str]
+
+
+class DepartamentoRecord(NamedTuple):
+    id_dep: str
+    departamento: Optional[str]
+
+
+def _rows(db, model, record):
+    columns = [getattr(model, field) for field in record._fields]
+    return [record(*row) for row in db.query(*columns).order_by(columns[0]).all()]
+
+
+def _group(items, key) -> Dict[str, Tuple]:
+    grupos = {}
+    for item in items:
+        grupos.setdefault(key(item), []).append(item)
+    return {k: tuple(v) for k, v in grupos.items()}
+
+
+class RegistrySnapshot:
+    """Copia inmutable de medidores y geografía con índices por id y listas padre → hijos."""
+
+    __slots__ = ('medidores', 'localidades', 'municipios', 'departamentos', 'activos',
+                 'medidores_por_localidad', 'localidades_por_municipio', 'municipios_por_departamento',
+                 'cargado')
+
+    def __init__(self, medidores: List[MeterRecord], localidades: List[LocalidadRecord],
+                 municipios: List[MunicipioRecord], departamentos: List[DepartamentoRecord]):
+        self.medidores = {m.deviceid: m for m in medidores}
+        self.localidades = {l.id_loc: l for l in localidades}
+        self.municipios = {m.id_mun: m for m in municipios}
+        self.departamentos = {d.id_dep: d for d in departamentos}
+        self.activos = tuple(m for m in medidores if m.desactivado is None)
+        self.medidores_por_localidad = _group(medidores, lambda m: m.id_loc)
+        self.localidades_por_municipio = _group(localidades, lambda l: l.id_mun)
+        self.municipios_por_departamento = _group(municipios, lambda m: m.id_dep)
+        self.cargado = time.monotonic()
+
+
+def _contains(value: Optional[str], term: str) -> bool:
+    """Equivalente a ILIKE '%term%' (term ya en minúsculas)."""
+    return value is not None and term in value.lower()
+
+
+class MeterRegistry:
+    """
+    Registro en memoria (por proceso) de medidores, localidades, municipios y departamentos.
+
+    - Se carga completo en el primer uso con una consulta por tabla; las búsquedas por id y
+      los recorridos padre → hijos son accesos a diccionarios, sin ir a la base de datos.
+    - Se recarga cada `refresh_seconds` en un hilo aparte (las solicitudes siguen usando la copia
+      anterior mientras tanto) o de inmediato con refresh(); invalidate() descarta la copia y la
+      siguiente consulta la recarga.
+    """
+
+    def __init__(self, session_factory=SessionLocal, refresh_seconds: int = 300):
+        self._session_factory = session_factory
+        self.refresh_seconds = refresh_seconds
+        self._snapshot: Optional[RegistrySnapshot] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._index: Optional[SearchIndex] = None
+        self._index_lock = threading.Lock()
+        self.loads = 0
+
+    def refresh(self) -> RegistrySnapshot:
+        """Recarga el registro desde la base de datos."""
+        inicio = time.perf_counter()
+        db = self._session_factory()
+        try:
+            snapshot = RegistrySnapshot(
+                _rows(db, Medidor, MeterRecord),
+                _rows(db, Localidad, LocalidadRecord),
+                _rows(db, Municipio, MunicipioRecord),
+                _rows(db, Departamento, DepartamentoRecord)
+            )
+        finally:
+            db.close()
+        with self._lock:
+            self._snapshot = snapshot
+            self.loads += 1
+        print(f"[INFO] Registro de medidores cargado: {len(snapshot.medidores)} medidores, "
+              f"{len(snapshot.localidades)} localidades ({(time.perf_counter() - inicio) * 1000:.0f} ms)")
+        return snapshot
+
+    def invalidate(self):
+        """Descarta la copia en memoria (por ejemplo, después de modificar medidores o geografía)."""
+        with self._lock:
+            self._snapshot = None
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+            self.search_index()
+        except Exception as e:
+            print(f"[INFO] No se pudo recargar el registro de medidores: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    @property
+    def snapshot(self) -> RegistrySnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+            if snapshot is None:
+                return self.refresh()
+        if time.monotonic() - snapshot.cargado > self.refresh_seconds:
+            with self._lock:
+                start = not self._refreshing
+                self._refreshing = True
+            if start:
+                threading.Thread(target=self._background_refresh, name="meter-registry", daemon=True).start()
+        return snapshot
+
+    # --- Medidores ---
+
+    def get(self, device_id: str) -> Optional[MeterRecord]:
+        return self.snapshot.medidores.get(device_id)
+
+    def exists(self, device_id: str) -> bool:
+        return device_id in self.snapshot.medidores
+
+    def active(self) -> Tuple[MeterRecord, ...]:
+        """Medidores activos (desactivado en NULL), ordenados por deviceid."""
+        return self.snapshot.activos
+
+    def count_active(self) -> int:
+        return len(self.snapshot.activos)
+
+    # --- Geografía ---
+
+    def localidad(self, id_loc: Optional[str]) -> Optional[LocalidadRecord]:
+        return self.snapshot.localidades.get(id_loc)
+
+    def municipio(self, id_mun: Optional[str]) -> Optional[MunicipioRecord]:
+        return self.snapshot.municipios.get(id_mun)
+
+    def departamento(self, id_dep: Optional[str]) -> Optional[DepartamentoRecord]:
+        return self.snapshot.departamentos.get(id_dep)
+
+    def location(self, medidor: MeterRecord) -> Tuple[Optional[LocalidadRecord], Optional[MunicipioRecord], Optional[DepartamentoRecord]]:
+        """(localidad, municipio, departamento) de un medidor; None en los niveles que no tenga."""
+        snapshot = self.snapshot
+        localidad = snapshot.localidades.get(medidor.id_loc)
+        municipio = snapshot.municipios.get(localidad.id_mun) if localidad else None
+        departamento = snapshot.departamentos.get(municipio.id_dep) if municipio else None
+        return localidad, municipio, departamento
+
+    def localidades(self) -> List[LocalidadRecord]:
+        return list(self.snapshot.localidades.values())
+
+    def municipios(self) -> List[MunicipioRecord]:
+        return list(self.snapshot.municipios.values())
+
+    def departamentos(self) -> List[DepartamentoRecord]:
+        return list(self.snapshot.departamentos.values())
+
+    def search_localidades(self, name: str) -> List[LocalidadRecord]:
+        term = name.lower()
+        return [l for l in self.snapshot.localidades.values() if _contains(l.localidad, term)]
+
+    def search_municipios(self, name: str) -> List[MunicipioRecord]:
+        term = name.lower()
+        return [m for m in self.snapshot.municipios.values() if _contains(m.municipio, term)]
+
+    def medidores_by_localidad(self, name: str) -> List[MeterRecord]:
+        """Medidores de las localidades cuyo nombre contiene `name`."""
+        snapshot = self.snapshot
+        return [m for l in self.search_localidades(name) for m in snapshot.medidores_por_localidad.get(l.id_loc, ())]
+
+    def medidores_by_municipio(self, name: str) -> List[MeterRecord]:
+        """Medidores de los municipios cuyo nombre contiene `name`."""
+        snapshot = self.snapshot
+        return [m
+                for mun in self.search_municipios(name)
+                for l in snapshot.localidades_por_municipio.get(mun.id_mun, ())
+                for m in snapshot.medidores_por_localidad.get(l.id_loc, ())]
+
+    def medidores_by_departamento(self, name: str) -> List[MeterRecord]:
+        """Medidores de los departamentos cuyo nombre contiene `name`."""
+        snapshot = self.snapshot
+        term = name.lower()
+        return [m
+                for d in snapshot.departamentos.values() if _contains(d.departamento, term)
+                for mun in snapshot.municipios_por_departamento.get(d.id_dep, ())
+                for l in snapshot.localidades_por_municipio.get(mun.id_mun, ())
+                for m in snapshot.medidores_por_localidad.get(l.id_loc, ())]
+
+    def search_index(self) -> SearchIndex:
+        """Índice de búsqueda de la copia vigente (se construye una vez por recarga)."""
+        snapshot = self.snapshot
+        index = self._index
+        if index is None or index.snapshot is not snapshot:
+            with self._index_lock:
+                index = self._index
+                if index is None or index.snapshot is not snapshot:
+                    inicio = time.perf_counter()
+                    index = self._index = SearchIndex(snapshot)
+                    print(f"[INFO] Índice de búsqueda construido ({(time.perf_counter() - inicio) * 1000:.0f} ms)")
+        return index
+
+    def search(self, search_term: str, limit: Optional[int] = None, offset: int = 0):
+        """Búsqueda por relevancia de medidores (ver SearchIndex.search)."""
+        return self.search_index().search(search_term, limit=limit, offset=offset)
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'loaded': snapshot is not None,
+            'medidores': len(snapshot.medidores) if snapshot else 0,
+            'activos': len(snapshot.activos) if snapshot else 0,
+            'localidades': len(snapshot.localidades) if snapshot else 0,
+            'municipios': len(snapshot.municipios) if snapshot else 0,
+            'departamentos': len(snapshot.departamentos) if snapshot else 0,
+            'age_seconds': round(time.monotonic() - snapshot.cargado, 1) if snapshot else None,
+            'refresh_seconds': self.refresh_seconds,
+            'loads': self.loads
+        }
+
+
+# Instancia compartida por el proceso
+meter_registry = MeterRegistry(refresh_seconds=settings.METER_REGISTRY_REFRESH_SECONDS)
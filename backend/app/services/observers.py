@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, List
+from typing import Any, List, Tuple
 from datetime import datetime
 
 # Interfaz Observador
@@ -8,6 +8,11 @@ class Observer(ABC):
     def update(self, event_type: str, data: Any):
         pass
 
+    def update_batch(self, events: List[Tuple[str, Any]]):
+        """Varios eventos juntos (bus de eventos); por defecto se entregan uno a uno a update."""
+        for event_type, data in events:
+            self.update(event_type, data)
+
 # Observador 1: Logger de Auditoría
 class AuditLoggerObserver(Observer):
     def update(self, event_type: str, data: Any):
@@ -15,6 +20,15 @@ class AuditLoggerObserver(Observer):
         status = data.get('analysis', {}).get('estado_general', 'N/A')
         print(f"[AUDIT] {datetime.now()} | Event: {event_type} | Device: {dev} | Status: {status}")
 
+    def update_batch(self, events: List[Tuple[str, Any]]):
+        # Una sola escritura por lote
+        ahora = datetime.now()
+        print("\n".join(
+            f"[AUDIT] {ahora} | Event: {event_type} | Device: {data.get('device_id', 'unknown')} | "
+            f"Status: {data.get('analysis', {}).get('estado_general', 'N/A')}"
+            for event_type, data in events
+        ))
+
 # Observador 2: Sistema de Alertas Críticas
 class CriticalAlertObserver(Observer):
     def update(self, event_type: str, data: Any):
@@ -23,14 +37,29 @@ class CriticalAlertObserver(Observer):
             anomalias = len(analysis.get('anomalias', []))
             print(f"🚨 [ALERTA MAIL] Enviando aviso a administrador... {anomalias} anomalías en {data.get('device_id')}")
 
+    def update_batch(self, events: List[Tuple[str, Any]]):
+        # Un solo aviso por lote con todos los medidores en estado crítico
+        criticos = [data for _, data in events if data.get('analysis', {}).get('estado_general') == 'CRITICO']
+        if len(criticos) == 1:
+            self.update('ANALYSIS_DONE', criticos[0])
+        elif criticos:
+            detalle = ", ".join(f"{data.get('device_id')} ({len(data['analysis'].get('anomalias', []))} anomalías)"
+                                for data in criticos)
+            print(f"🚨 [ALERTA MAIL] Enviando aviso a administrador... {len(criticos)} medidores críticos: {detalle}")
+
 # Clase Sujeto (Observable)
 class Subject:
-    def __init__(self):
+    def __init__(self, event_bus=None):
+        """Con `event_bus` (EventBus) notify solo encola el evento y los observadores lo reciben en segundo plano."""
         self._observers: List[Observer] = []
+        self._event_bus = event_bus
 
     def attach(self, observer: Observer):
         self._observers.append(observer)
 
     def notify(self, event_type: str, data: Any):
+        if self._event_bus is not None:
+            self._event_bus.publish(event_type, data, self._observers)
+            return
         for observer in self._observers:
-            observer.update(event_type, data)
\ No newline at end of file
+            observer.update(event_type, data)
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+
+_worker_session_factory = None
+
+
+def scan_workers(workers: Optional[int] = None) -> int:
+    """Número de procesos de la búsqueda paralela (0 = uno por núcleo)."""
+    workers = settings.OUTLIER_SCAN_WORKERS if workers is None else workers
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+
+def _init_scan_worker():
+    """Cada proceso abre su propio engine (las conexiones no se comparten entre procesos)."""
+    global _worker_session_factory
+    engine = create_engine(settings.DATABASE_URL, pool_size=1, max_overflow=0)
+    _worker_session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def _scan_slice(args):
+    """
+    Busca anomalías en un bloque de medidores (corre en un proceso del pool): actualiza sus curvas
+    base, compara sus lecturas en la base de datos y clasifica los días-medidor que superan el umbral.
+    """
+    from app.data.repositories import EnergyRepository
+    from app.services.energy_service import EnergyService
+
+    slice_index, device_ids, base_year, start, end, threshold = args
+    inicio = time.perf_counter()
+    db = _worker_session_factory()
+    try:
+        repo = EnergyRepository(db)
+        repo.refresh_baselines(base_year, device_ids=device_ids)
+        rows = repo.get_fleet_outlier_curves(
+            base_year=base_year,
+            start_date=start,
+            end_date=end,
+            threshold=threshold,
+            device_ids=device_ids
+        )
+        medidores = {m.deviceid: m for m in repo.get_medidores_by_ids(device_ids)}
+        resultados = EnergyService(repo, observers=[])._outlier_results(rows, medidores)
+    finally:
+        db.close()
+
+    return slice_index, resultados, {
+        'pid': os.getpid(),
+        'devices': len(device_ids),
+        'rows': len(rows),
+        'seconds': time.perf_counter() - inicio
+    }
+
+
+def iter_parallel_outlier_scan(device_ids: List[str], base_year: int, start: datetime, end: datetime, threshold: float,
+                               workers: int, chunk_size: int, stats: dict = None):
+    """
+    Reparte los medidores (ordenados) en bloques de hasta `chunk_size` entre `workers` procesos y
+    genera (indice_bloque, procesados, total, resultados_del_bloque) a medida que termina cada bloque.
+    Si el consumidor deja de iterar (cancelación, cliente desconectado) se descartan los bloques pendientes.
+
+    Al terminar, `stats` (si se pasa) recibe las estadísticas por proceso: medidores, filas,
+    segundos y medidores/s.
+    """
+    device_ids = sorted(device_ids)
+    # Bloques más pequeños que una porción por proceso para repartir la carga y reportar progreso
+    chunk_size = max(1, min(chunk_size, -(-len(device_ids) // workers)))
+    bloques = [device_ids[i:i + chunk_size] for i in range(0, len(device_ids), chunk_size)]
+
+    print(f"[INFO] Búsqueda paralela: {len(device_ids)} medidores en {len(bloques)} bloques, {workers} procesos")
+    inicio = time.perf_counter()
+    por_proceso = {}
+    procesados = 0
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_scan_worker
+    )
+    try:
+        futures = [executor.submit(_scan_slice, (i, bloque, base_year, start, end, threshold))
+                   for i, bloque in enumerate(bloques)]
+        for future in as_completed(futures):
+            slice_index, resultados, slice_stats = future.result()
+            proceso = por_proceso.setdefault(slice_stats['pid'], {'devices': 0, 'rows': 0, 'seconds': 0.0, 'slices': 0})
+            proceso['devices'] += slice_stats['devices']
+            proceso['rows'] += slice_stats['rows']
+            proceso['seconds'] += slice_stats['seconds']
+            proceso['slices'] += 1
+            procesados += slice_stats['devices']
+            yield slice_index, procesados, len(device_ids), resultados
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    executor.shutdown(wait=True)
+
+    total_seconds = time.perf_counter() - inicio
+    workers_stats = []
+    for n, (pid, proceso) in enumerate(sorted(por_proceso.items()), 1):
+        proceso = {
+            'worker': n,
+            'pid': pid,
+            **proceso,
+            'seconds': round(proceso['seconds'], 3),
+            'devices_per_second': round(proceso['devices'] / proceso['seconds'], 1) if proceso['seconds'] else None
+        }
+        workers_stats.append(proceso)
+        print(f"[INFO]   Proceso {n} (pid {pid}): {proceso['devices']} medidores en {proceso['slices']} bloques, "
+              f"{proceso['seconds']:.2f}s ({proceso['devices_per_second']} medidores/s)")
+    print(f"[INFO] Búsqueda paralela completada en {total_seconds:.2f}s "
+          f"({len(device_ids) / total_seconds:,.0f} medidores/s en total)")
+
+    if stats is not None:
+        stats.update({
+            'workers': workers,
+            'slices': len(bloques),
+            'devices': len(device_ids),
+            'seconds': round(total_seconds, 3),
+            'per_worker': workers_stats
+        })
@@ -0,0 +1,203 @@
+import heapq
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+# Peso de cada campo en la relevancia (un id de medidor exacto pesa más que una coincidencia en la descripción)
+FIELD_WEIGHTS = {
+    'deviceid': 1.0,
+    'localidad': 0.9,
+    'municipio': 0.85,
+    'departamento': 0.8,
+    'description': 0.7
+}
+
+# Similitud mínima de trigramas para coincidencias aproximadas (errores de escritura), como pg_trgm
+FUZZY_MIN_SIMILARITY = 0.3
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def fold(text: Optional[str]) -> str:
+    """Normaliza para buscar: sin tildes ni diacríticos, minúsculas y solo letras/dígitos separados por un espacio."""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text)
+    sin_tildes = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', sin_tildes.casefold()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigramas del texto normalizado con un espacio en cada extremo."""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def match_quality(query: str, text: str) -> float:
+    """1.0 igual, 0.9 prefijo, 0.8 prefijo de una palabra, 0.6 subcadena, 0 sin coincidencia."""
+    if text == query:
+        return 1.0
+    if text.startswith(query):
+        return 0.9
+    if f" {query}" in f" {text}":
+        return 0.8
+    if query in text:
+        return 0.6
+    return 0.0
+
+
+class SearchHit(NamedTuple):
+    medidor: object  # MeterRecord
+    score: float
+    match: str       # campo que dio la mejor coincidencia
+
+
+class PlaceHit(NamedTuple):
+    kind: str        # localidad, municipio o departamento
+    record: object   # LocalidadRecord, MunicipioRecord o DepartamentoRecord
+    score: float
+
+
+class SearchResults(NamedTuple):
+    total: int
+    hits: list
+
+
+class SearchIndex:
+    """
+    Índice de búsqueda en memoria sobre un RegistrySnapshot: id de medidor, descripción y nombres de
+    localidad, municipio y departamento, sin distinguir tildes ni mayúsculas.
+
+    - Los textos se normalizan (fold) y se indexan una sola vez por texto distinto: muchas
+      descripciones se repiten y un nombre de lugar cubre a todos sus medidores.
+    - Los trigramas filtran los candidatos de una subcadena; si no hay ninguna coincidencia se
+      buscan textos parecidos por similitud de trigramas (tolerancia a errores de escritura).
+    - Los ids de medidor (únicos y cortos) se comparan directamente.
+
+    La relevancia de un medidor es la mejor coincidencia entre sus campos (calidad × peso del campo).
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._device_ids: List[Tuple[str, str]] = [(fold(d), d) for d in snapshot.medidores]
+        self._texts: List[str] = []
+        self._text_trigrams: List[int] = []
+        self._owners: List[List[Tuple[str, str]]] = []
+        self._postings: Dict[str, Set[int]] = {}
+        text_ids: Dict[str, int] = {}
+
+        def add(text: Optional[str], field: str, key: str):
+            folded = fold(text)
+            if not folded:
+                return
+            text_id = text_ids.get(folded)
+            if text_id is None:
+                text_id = text_ids[folded] = len(self._texts)
+                self._texts.append(folded)
+                self._owners.append([])
+                grams = trigrams(folded)
+                self._text_trigrams.append(len(grams))
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(text_id)
+            self._owners[text_id].append((field, key))
+
+        for m in snapshot.medidores.values():
+            add(m.description, 'description', m.deviceid)
+        for l in snapshot.localidades.values():
+            add(l.localidad, 'localidad', l.id_loc)
+        for m in snapshot.municipios.values():
+            add(m.municipio, 'municipio', m.id_mun)
+        for d in snapshot.departamentos.values():
+            add(d.departamento, 'departamento', d.id_dep)
+
+    def _matching_texts(self, query: str) -> Dict[int, float]:
+        """
+        text_id → calidad de la coincidencia de los textos que contienen (o se parecen a) la consulta.
+        Las consultas de uno o dos caracteres (búsqueda mientras se escribe) solo coinciden al inicio de una palabra.
+        """
+        if len(query) < 3:
+            # Menos de un trigrama: recorrido directo de los textos distintos
+            candidates = range(len(self._texts))
+            min_quality = 0.8
+        else:
+            # Toda subcadena contiene los trigramas internos de la consulta
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+            min_quality = 0.6
+
+        matches = {}
+        for text_id in candidates:
+            quality = match_quality(query, self._texts[text_id])
+            if quality >= min_quality:
+                matches[text_id] = quality
+        if matches or len(query) < 3:
+            return matches
+
+        # Sin subcadenas: similitud de trigramas |A ∩ B| / |A ∪ B|
+        query_grams = trigrams(query)
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(self._postings.get(gram, ()))
+        for text_id, shared in overlap.items():
+            similarity = shared / (len(query_grams) + self._text_trigrams[text_id] - shared)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                matches[text_id] = 0.5 * similarity
+        return matches
+
+    def _place_meters(self, field: str, key: str):
+        snapshot = self.snapshot
+        if field == 'localidad':
+            return snapshot.medidores_por_localidad.get(key, ())
+        if field == 'municipio':
+            return [m for l in snapshot.localidades_por_municipio.get(key, ())
+                    for m in snapshot.medidores_por_localidad.get(l.id_loc, ())]
+        return [m for mun in snapshot.municipios_por_departamento.get(key, ())
+                for l in snapshot.localidades_por_municipio.get(mun.id_mun, ())
+                for m in snapshot.medidores_por_localidad.get(l.id_loc, ())]
+
+    def search(self, term: str, limit: Optional[int] = None, offset: int = 0) -> SearchResults:
+        """Medidores que coinciden con `term`, de mayor a menor relevancia (empates por deviceid), paginados."""
+        query = fold(term)
+        if not query:
+            return SearchResults(0, [])
+
+        mejores: Dict[str, Tuple[float, str]] = {}
+
+        def consider(deviceid: str, score: float, field: str):
+            actual = mejores.get(deviceid)
+            if actual is None or score > actual[0]:
+                mejores[deviceid] = (score, field)
+
+        for folded, deviceid in self._device_ids:
+            if query in folded:
+                consider(deviceid, match_quality(query, folded) * FIELD_WEIGHTS['deviceid'], 'deviceid')
+
+        for text_id, quality in self._matching_texts(query).items():
+            for field, key in self._owners[text_id]:
+                score = quality * FIELD_WEIGHTS[field]
+                if field == 'description':
+                    consider(key, score, field)
+                else:
+                    for m in self._place_meters(field, key):
+                        consider(m.deviceid, score, field)
+
+        ranking = ((-score, deviceid, field) for deviceid, (score, field) in mejores.items())
+        ordered = sorted(ranking) if limit is None else heapq.nsmallest(offset + limit, ranking)
+        medidores = self.snapshot.medidores
+        hits = [SearchHit(medidores[deviceid], round(-score, 3), field)
+                for score, deviceid, field in ordered[offset:]]
+        return SearchResults(len(mejores), hits)
+
+    def search_places(self, term: str, kind: str) -> List[PlaceHit]:
+        """Localidades, municipios o departamentos cuyo nombre coincide con `term`, por relevancia."""
+        query = fold(term)
+        if not query:
+            return []
+        records = {'localidad': self.snapshot.localidades, 'municipio': self.snapshot.municipios,
+                   'departamento': self.snapshot.departamentos}[kind]
+        hits = [PlaceHit(kind, records[key], round(quality, 3))
+                for text_id, quality in self._matching_texts(query).items()
+                for field, key in self._owners[text_id] if field == kind]
+        return sorted(hits, key=lambda hit: (-hit.score, hit.record[0]))
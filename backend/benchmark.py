@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark de las rutas analíticas críticas a distintos tamaños de flota.
+
+Siembra una base PostgreSQL local con la flota sintética de database_seeder (medidores con
+prefijo FLEET_DEVICE_PREFIX) y mide cada operación varias veces. Los resultados se guardan
+en JSON para comparar ejecuciones entre sí.
+
+IMPORTANTE: usar una base dedicada (DATABASE_URL), la flota sintética se borra y se vuelve a sembrar.
+
+Uso:
+    python benchmark.py --scales 10x1m 1kx1m --repeat 5
+    python benchmark.py --scales 1kx1y --no-seed          # reutiliza la flota ya sembrada
+    python benchmark.py --compare antes.json despues.json
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.data.database import SessionLocal
+from app.data.repositories import EnergyRepository
+from app.services.energy_service import EnergyService
+from app.services.meter_registry import MeterRegistry
+import database_seeder
+
+# Escalas: nombre -> (medidores, años, meses; None = años completos)
+SCALES = {
+    "10x1m": (10, [2024], 1),
+    "10x1y": (10, [2024], None),
+    "1kx1m": (1000, [2024], 1),
+    "1kx1y": (1000, [2024], None),
+    "10kx1m": (10000, [2024], 1),
+    "10kx2y": (10000, [2024, 2025], None),
+}
+DEFAULT_SCALES = ["10x1m", "1kx1m"]
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+
+
+def stub_gemini_analysis(self, device_id, medidor, target_date_str, target_day_name, merged_df, calculated_estado_general, base_year=None):
+    """Reemplaza la llamada a Gemini para medir solo el pipeline propio de /analyze."""
+    return {
+        "resumen": "Benchmark (Gemini simulado).",
+        "habitos": "N/A",
+        "anomalias": [],
+        "recomendacion": "N/A",
+        "estado_general": calculated_estado_general
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+
+def fleet_summary(db):
+    """Medidores de la flota sintética y rango de fechas con lecturas."""
+    row = db.execute(text("""
+        SELECT COUNT(DISTINCT deviceid) AS medidores, MIN(fecha) AS fecha_min, MAX(fecha) AS fecha_max, COUNT(*) AS lecturas
+        FROM public.m_lecturas
+        WHERE deviceid LIKE :pattern
+    """), {"pattern": f"{database_seeder.FLEET_DEVICE_PREFIX}%"}).mappings().first()
+    return dict(row)
+
+
+def time_call(fn, repeat: int):
+    """Ejecuta fn una vez en frío y `repeat` veces más; retorna los tiempos en milisegundos."""
+    timings = []
+    for _ in range(repeat + 1):
+        db = SessionLocal()
+        try:
+            start = time.perf_counter()
+            fn(db)
+            timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+
+    warm = timings[1:] or timings
+    return {
+        "first_ms": round(timings[0], 2),
+        "min_ms": round(min(warm), 2),
+        "median_ms": round(statistics.median(warm), 2),
+        "mean_ms": round(statistics.mean(warm), 2),
+        "runs": len(warm)
+    }
+
+
+def build_cases(db, summary: dict, base_year: int):
+    """Define las operaciones a medir sobre la última semana con datos de la flota."""
+    last_day = pd.Timestamp(summary["fecha_max"]).normalize()
+    week_start = last_day - timedelta(days=6)
+    prev_start = week_start - timedelta(days=7)
+    prev_end = week_start - timedelta(days=1)
+    month_start = last_day - timedelta(days=29)
+    device_id = f"{database_seeder.FLEET_DEVICE_PREFIX}{1:07d}"
+    fmt = "%Y-%m-%d"
+
+    def outliers(db):
+        EnergyService(EnergyRepository(db)).find_outlier_devices(
+            base_year, week_start.strftime(fmt), last_day.strftime(fmt), 20.0)
+
+    def demand_growth(db):
+        EnergyService(EnergyRepository(db)).analyze_demand_growth(
+            week_start.strftime(fmt), last_day.strftime(fmt), prev_start.strftime(fmt), prev_end.strftime(fmt), 0.0)
+
+    def total_energy(db):
+        EnergyRepository(db).get_total_energy_in_period(device_id, month_start.strftime(fmt), last_day.strftime(fmt))
+
+    def max_power(db):
+        EnergyRepository(db).get_max_power_in_period(device_id, month_start.strftime(fmt), last_day.strftime(fmt))
+
+    # El histórico se carga una sola vez: solo se mide el cálculo de la curva base
+    data = EnergyRepository(db).get_historical_year_data(device_id, base_year)
+    df_hist = pd.DataFrame([{"timestamp": r.fecha, "value": r.kwhd} for r in data])
+
+    def calculate_baseline(db):
+        EnergyService(EnergyRepository(db))._calculate_baseline(df_hist.copy(), last_day.day_name())
+
+    # Registro e índice de búsqueda de la flota sembrada, cargados una sola vez: solo se mide la búsqueda
+    registry = MeterRegistry(SessionLocal)
+    registry.search_index()
+
+    def search(db):
+        registry.search("Antioquia")
+
+    def analyze(db):
+        EnergyService(EnergyRepository(db)).analyze_day(device_id, last_day.strftime(fmt), base_year)
+
+    return {
+        "find_outlier_devices": outliers,
+        "analyze_demand_growth": demand_growth,
+        "get_total_energy_in_period": total_energy,
+        "get_max_power_in_period": max_power,
+        "_calculate_baseline": calculate_baseline,
+        "search_medidores": search,
+        "analyze_pipeline": analyze,
+    }
+
+
+def run_scale(name: str, repeat: int, seed: bool, workers: int, only: list = None):
+    n_meters, years, months = SCALES[name]
+    print(f"\n📏 Escala {name}: {n_meters} medidores, {f'{months} mes(es)' if months else f'años {years}'}")
+    print("=" * 80)
+
+    seed_seconds = None
+    if seed:
+        db = SessionLocal()
+        try:
+            database_seeder.clear_fleet(db)
+        finally:
+            db.close()
+        seed_seconds = database_seeder.seed_fleet(n_meters, years, workers, months=months)["seconds"]
+
+    db = SessionLocal()
+    try:
+        summary = fleet_summary(db)
+        if not summary["lecturas"]:
+            raise ValueError("No hay lecturas de la flota sintética; ejecute sin --no-seed")
+        cases = build_cases(db, summary, years[0])
+    finally:
+        db.close()
+
+    results = {}
+    for case_name, fn in cases.items():
+        if only and case_name not in only:
+            continue
+        try:
+            results[case_name] = time_call(fn, repeat)
+            r = results[case_name]
+            print(f"⏱️ {case_name:<28} frío {r['first_ms']:>10.1f} ms | mediana {r['median_ms']:>10.1f} ms")
+        except Exception as e:
+            results[case_name] = {"error": str(e)}
+            print(f"❌ {case_name:<28} {e}")
+
+    return {
+        "scale": name,
+        "meters": summary["medidores"],
+        "readings": summary["lecturas"],
+        "fecha_min": str(summary["fecha_min"]),
+        "fecha_max": str(summary["fecha_max"]),
+        "seed_seconds": seed_seconds,
+        "results": results
+    }
+
+
+def compare(old_path: str, new_path: str):
+    """Imprime la relación de tiempos (mediana) entre dos archivos de resultados."""
+    with open(old_path) as f:
+        old = {s["scale"]: s for s in json.load(f)["scales"]}
+    with open(new_path) as f:
+        new = {s["scale"]: s for s in json.load(f)["scales"]}
+
+    print(f"📊 {old_path} → {new_path}")
+    for scale in [s for s in new if s in old]:
+        print(f"\n📏 Escala {scale}")
+        print("=" * 80)
+        for case, r_new in new[scale]["results"].items():
+            r_old = old[scale]["results"].get(case)
+            if not r_old or "median_ms" not in r_old or "median_ms" not in r_new:
+                print(f"   {case:<28} sin datos comparables")
+                continue
+            ratio = r_old["median_ms"] / r_new["median_ms"] if r_new["median_ms"] else float("inf")
+            marker = "🟢" if ratio >= 1.1 else ("🔴" if ratio <= 0.9 else "⚪")
+            print(f"{marker} {case:<28} {r_old['median_ms']:>10.1f} ms → {r_new['median_ms']:>10.1f} ms  (x{ratio:.2f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de rutas analíticas de Energy App")
+    parser.add_argument("--scales", nargs="+", default=DEFAULT_SCALES, help=f"Escalas: {', '.join(SCALES)} o 'all'")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones en caliente por operación")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para sembrar la flota")
+    parser.add_argument("--no-seed", action="store_true", help="Reutilizar la flota ya sembrada (una sola escala)")
+    parser.add_argument("--only", nargs="+", default=None, help="Medir solo estas operaciones")
+    parser.add_argument("--output", default=None, help="Archivo JSON de resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTES", "DESPUES"), help="Comparar dos archivos de resultados")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scales = list(SCALES) if args.scales == ["all"] else args.scales
+    for name in scales:
+        if name not in SCALES:
+            parser.error(f"Escala desconocida: {name}")
+
+    EnergyService._get_gemini_analysis = stub_gemini_analysis
+
+    print("🚀 Benchmark de rutas analíticas")
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "scales": [run_scale(name, args.repeat, not args.no_seed, args.workers, args.only) for name in scales]
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\n💾 Resultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
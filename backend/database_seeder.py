@@ -2,19 +2,31 @@
 """
 Database Seeder for Energy App
 Handles initial data population for m_lecturas 2024-2025 data
+
+Fleet mode generates large synthetic fleets for scaling tests:
+    python database_seeder.py --fleet --meters 10000 --years 2024 2025 --workers 8
 """
 
+import argparse
+import io
+import multiprocessing
 import os
 import sys
+import time
 from datetime import datetime, timedelta
 import random
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import Session
 
 # Add the backend directory to Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from app.core.config import settings
 from app.data.database import SessionLocal, engine
 from app.data.models import Departamento, Municipio, Localidad, Medidor, MLectura
+from app.data.partitions import ensure_partitions
 from app.data.repositories import EnergyRepository
 
 def create_sample_departments(db: Session):
@@ -112,6 +124,10 @@ def generate_sample_readings_2024_2025(db: Session):
     
     device_ids = ["MED001", "MED002", "MED003", "MED004"]
     repository = EnergyRepository(db)
+
+    # Readings are merged row by row, so the monthly partitions must exist beforehand
+    with engine.begin() as conn:
+        ensure_partitions(conn, datetime(2024, 1, 1), datetime(2025, 12, 31, 23, 45))
     
     total_readings = 0
     
@@ -175,6 +191,326 @@ def generate_sample_readings_2024_2025(db: Session):
     db.commit()
     print(f"✅ Generated {total_readings} sample readings for 2024-2025")
 
+    # Readings were merged row by row, so the hourly/daily rollups are rebuilt for these meters
+    repository.refresh_rollups(device_ids)
+    print("✅ Rebuilt hourly/daily rollups")
+    # Existing baselines of these meters no longer match their readings: rebuild them on next use
+    repository.mark_baselines_stale(device_ids)
+
+# --- Fleet mode ---
+
+# DANE departments with approximate centroid (lat, lon)
+FLEET_DEPARTMENTS = [
+    ("05", "Antioquia", 6.70, -75.50), ("08", "Atlántico", 10.70, -74.90),
+    ("11", "Bogotá D.C.", 4.65, -74.10), ("13", "Bolívar", 8.70, -74.50),
+    ("15", "Boyacá", 5.80, -73.10), ("17", "Caldas", 5.30, -75.30),
+    ("18", "Caquetá", 1.00, -74.00), ("19", "Cauca", 2.40, -76.80),
+    ("20", "Cesar", 9.30, -73.60), ("23", "Córdoba", 8.40, -75.80),
+    ("25", "Cundinamarca", 4.90, -74.10), ("27", "Chocó", 5.70, -76.60),
+    ("41", "Huila", 2.50, -75.50), ("44", "La Guajira", 11.40, -72.70),
+    ("47", "Magdalena", 10.20, -74.20), ("50", "Meta", 3.50, -73.00),
+    ("52", "Nariño", 1.50, -77.70), ("54", "Norte de Santander", 8.00, -72.80),
+    ("63", "Quindío", 4.50, -75.70), ("66", "Risaralda", 5.10, -75.90),
+    ("68", "Santander", 6.90, -73.40), ("70", "Sucre", 9.00, -75.20),
+    ("73", "Tolima", 4.00, -75.20), ("76", "Valle del Cauca", 3.80, -76.50),
+    ("81", "Arauca", 6.70, -71.00), ("85", "Casanare", 5.30, -71.70),
+    ("86", "Putumayo", 0.50, -76.00), ("88", "San Andrés", 12.55, -81.70),
+    ("91", "Amazonas", -1.40, -71.50), ("94", "Guainía", 2.60, -68.50),
+    ("95", "Guaviare", 2.00, -72.30), ("97", "Vaupés", 0.60, -70.40),
+    ("99", "Vichada", 4.70, -69.40),
+]
+
+# Meter profiles: (usergroup, devicetype, share of the fleet, base kWh per 15 min)
+FLEET_PROFILES = [
+    ("02", "Residencial", 0.70, 0.4),
+    ("01", "Comercial", 0.22, 1.5),
+    ("03", "Industrial", 0.08, 6.0),
+]
+
+FLEET_DEVICE_PREFIX = "7"
+FLEET_MUNICIPALITIES_PER_DEPARTMENT = 12
+FLEET_LOCALITIES_PER_MUNICIPALITY = 8
+
+# Tables holding per-meter rows that must be cleared before the fleet meters
+FLEET_DEPENDENT_TABLES = ["public.m_baseline", "public.m_baseline_estado", "public.m_lecturas_hora",
+                          "public.m_lecturas_dia", "public.m_rollup_estado", "public.m_analisis_cache",
+                          "public.m_lecturas"]
+
+_worker_engine = None
+
+
+def build_fleet_geography(rng: np.random.Generator):
+    """Build departments, municipalities and localities for the synthetic fleet"""
+    departments, municipalities, localities = [], [], []
+
+    for id_dep, name, lat, lon in FLEET_DEPARTMENTS:
+        departments.append({"id_dep": id_dep, "departamento": name})
+
+        for m in range(FLEET_MUNICIPALITIES_PER_DEPARTMENT):
+            # DANE municipality codes are department code + odd 3-digit sequence (001 = capital)
+            id_mun = f"{id_dep}{2 * m + 1:03d}"
+            mun_name = f"{name} - Capital" if m == 0 else f"{name} - Municipio {m:02d}"
+            municipalities.append({"id_mun": id_mun, "id_dep": id_dep, "municipio": mun_name})
+
+            mun_lat = lat + rng.normal(0, 0.6)
+            mun_lon = lon + rng.normal(0, 0.6)
+            for l in range(FLEET_LOCALITIES_PER_MUNICIPALITY):
+                localities.append({
+                    "id_loc": f"{id_mun}{l + 1:03d}",
+                    "id_mun": id_mun,
+                    "localidad": f"{mun_name} - Sector {l + 1}",
+                    "clas_politica": "UR" if l < FLEET_LOCALITIES_PER_MUNICIPALITY // 2 else "RU",
+                    "latitud": round(float(mun_lat + rng.normal(0, 0.05)), 6),
+                    "longitud": round(float(mun_lon + rng.normal(0, 0.05)), 6),
+                })
+
+    return departments, municipalities, localities
+
+
+def build_fleet_meters(n_meters: int, localities: list, rng: np.random.Generator):
+    """Assign a profile and a locality to each synthetic meter"""
+    shares = np.array([p[2] for p in FLEET_PROFILES])
+    profile_idx = rng.choice(len(FLEET_PROFILES), size=n_meters, p=shares / shares.sum())
+    loc_idx = rng.integers(0, len(localities), size=n_meters)
+
+    meters = []
+    for i in range(n_meters):
+        usergroup, devicetype, _, _ = FLEET_PROFILES[profile_idx[i]]
+        loc = localities[loc_idx[i]]
+        meters.append({
+            "id_loc": loc["id_loc"],
+            "deviceid": f"{FLEET_DEVICE_PREFIX}{i + 1:07d}",
+            "devicetype": devicetype,
+            "description": f"Medidor {devicetype} {loc['localidad']}"[:60],
+            "connectiontype": "GPRS",
+            "customerid": f"FLEET{i + 1:07d}",
+            "usergroup": usergroup,
+            "ipaddress": f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}",
+            "port": 502,
+            "activado": datetime(2023, 1, 1),
+            "ke": 1.0,
+            "profile": int(profile_idx[i]),
+        })
+    return meters
+
+
+def insert_fleet_metadata(db: Session, departments: list, municipalities: list, localities: list, meters: list):
+    """Insert the fleet geography and meters, skipping rows that already exist"""
+    db.execute(text("""
+        INSERT INTO public.departamentos (id_dep, departamento) VALUES (:id_dep, :departamento)
+        ON CONFLICT (id_dep) DO NOTHING
+    """), departments)
+    db.execute(text("""
+        INSERT INTO public.municipios (id_mun, id_dep, municipio) VALUES (:id_mun, :id_dep, :municipio)
+        ON CONFLICT (id_mun) DO NOTHING
+    """), municipalities)
+    db.execute(text("""
+        INSERT INTO public.localidades (id_loc, id_mun, localidad, clas_politica, latitud, longitud)
+        VALUES (:id_loc, :id_mun, :localidad, :clas_politica, :latitud, :longitud)
+        ON CONFLICT (id_loc) DO NOTHING
+    """), localities)
+    db.execute(text("""
+        INSERT INTO public.medidor (id_loc, deviceid, devicetype, description, connectiontype, customerid,
+                                    usergroup, ipaddress, port, activado, ke)
+        VALUES (:id_loc, :deviceid, :devicetype, :description, :connectiontype, :customerid,
+                :usergroup, :ipaddress, :port, :activado, :ke)
+        ON CONFLICT (deviceid) DO NOTHING
+    """), meters)
+    db.commit()
+
+
+def generate_load_curves(profile: int, timestamps: pd.DatetimeIndex, rng: np.random.Generator, anomaly_rate: float):
+    """
+    Generate one meter's 15-minute kWh/kvarh series with NumPy.
+    Returns (kwhd, kvarhd, anomalies) where anomalies is the number of injected anomalous days.
+    """
+    hours = timestamps.hour.values + timestamps.minute.values / 60.0
+    weekend = timestamps.dayofweek.values >= 5
+    day_of_year = timestamps.dayofyear.values
+
+    _, _, _, base = FLEET_PROFILES[profile]
+    base = base * rng.uniform(0.6, 1.6)
+
+    if profile == 0:
+        # Residential: morning and evening peaks
+        shape = 0.35 + 0.8 * np.exp(-((hours - 7.0) ** 2) / 2.0) + 1.3 * np.exp(-((hours - 19.5) ** 2) / 3.0)
+        weekend_factor = 1.1
+    elif profile == 1:
+        # Commercial: business-hours plateau
+        shape = 0.3 + 1.2 / (1 + np.exp(-(hours - 8.0) * 2)) / (1 + np.exp((hours - 19.0) * 2))
+        weekend_factor = 0.6
+    else:
+        # Industrial: near-flat with a shift pattern
+        shape = 0.8 + 0.3 * ((hours >= 6) & (hours < 22))
+        weekend_factor = 0.75
+
+    seasonal = 1 + 0.08 * np.sin(2 * np.pi * (day_of_year + rng.uniform(0, 365)) / 365.0)
+    noise = rng.lognormal(0, 0.08, size=len(timestamps))
+    kwhd = base * shape * seasonal * np.where(weekend, weekend_factor, 1.0) * noise
+
+    # Injected anomalies: outage (zeros for a few hours), spike (x3-x5) or whole-day drift (x1.6)
+    n_days = len(timestamps) // 96
+    anomalous_days = np.flatnonzero(rng.random(n_days) < anomaly_rate)
+    for day in anomalous_days:
+        kind = rng.integers(0, 3)
+        start = day * 96
+        if kind == 0:
+            offset = rng.integers(0, 80)
+            kwhd[start + offset:start + offset + rng.integers(8, 16)] = 0.0
+        elif kind == 1:
+            offset = rng.integers(0, 88)
+            kwhd[start + offset:start + offset + rng.integers(4, 8)] *= rng.uniform(3, 5)
+        else:
+            kwhd[start:start + 96] *= 1.6
+
+    kvarhd = kwhd * rng.uniform(0.05, 0.3) * rng.lognormal(0, 0.05, size=len(timestamps))
+    return np.round(kwhd, 3), np.round(kvarhd, 3), len(anomalous_days)
+
+
+def _init_fleet_worker():
+    """Each worker process opens its own engine (connections are not shared across processes)"""
+    global _worker_engine
+    _worker_engine = create_engine(settings.DATABASE_URL, pool_size=1, max_overflow=0)
+
+
+def _copy_frame(cursor, frame: pd.DataFrame):
+    """COPY a frame into a staging table and move it to m_lecturas skipping existing readings"""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+    buffer.seek(0)
+    cursor.execute("TRUNCATE tmp_seed_lecturas")
+    cursor.copy_expert("COPY tmp_seed_lecturas (fecha, deviceid, kwhd, kvarhd) FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.execute("""
+        INSERT INTO public.m_lecturas (fecha, deviceid, kwhd, kvarhd)
+        SELECT fecha, deviceid, kwhd, kvarhd FROM tmp_seed_lecturas
+        ON CONFLICT (fecha, deviceid) DO NOTHING
+    """)
+    return cursor.rowcount
+
+
+def _seed_fleet_chunk(args):
+    """Generate and COPY the readings of a chunk of meters (runs in a worker process)"""
+    chunk_index, meters, periods, anomaly_rate, seed = args
+    rng = np.random.default_rng([seed, chunk_index])
+    batch_size = settings.INGEST_BATCH_SIZE
+
+    connection = _worker_engine.raw_connection()
+    inserted = generated = anomalies = 0
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS tmp_seed_lecturas
+            (LIKE public.m_lecturas INCLUDING DEFAULTS)
+        """)
+
+        frames, pending = [], 0
+        for period_start, period_end in periods:
+            timestamps = pd.date_range(period_start, period_end, freq="15min")
+            for meter in meters:
+                kwhd, kvarhd, n_anomalies = generate_load_curves(meter["profile"], timestamps, rng, anomaly_rate)
+                frames.append(pd.DataFrame({"fecha": timestamps, "deviceid": meter["deviceid"], "kwhd": kwhd, "kvarhd": kvarhd}))
+                pending += len(timestamps)
+                anomalies += n_anomalies
+
+                if pending >= batch_size:
+                    inserted += _copy_frame(cursor, pd.concat(frames, ignore_index=True))
+                    generated += pending
+                    frames, pending = [], 0
+
+        if frames:
+            inserted += _copy_frame(cursor, pd.concat(frames, ignore_index=True))
+            generated += pending
+
+        connection.commit()
+    finally:
+        connection.close()
+
+    return len(meters), generated, inserted, anomalies
+
+
+def fleet_periods(years: list, months: int = None):
+    """Reading periods (first, last 15-minute timestamp) for full years, or the first N months of the first year"""
+    if months:
+        start = datetime(years[0], 1, 1)
+        return [(start, start + pd.DateOffset(months=months) - timedelta(minutes=15))]
+    return [(datetime(year, 1, 1), datetime(year, 12, 31, 23, 45)) for year in years]
+
+
+def clear_fleet(db: Session):
+    """Delete the synthetic fleet (meters with FLEET_DEVICE_PREFIX) and everything that references it"""
+    params = {"pattern": f"{FLEET_DEVICE_PREFIX}%"}
+    for table in FLEET_DEPENDENT_TABLES:
+        db.execute(text(f"DELETE FROM {table} WHERE deviceid LIKE :pattern"), params)
+    deleted = db.execute(text("DELETE FROM public.medidor WHERE deviceid LIKE :pattern"), params).rowcount
+    db.commit()
+    print(f"🧹 Removed {deleted} fleet meters")
+    return deleted
+
+
+def seed_fleet(n_meters: int = 10000, years: list = None, workers: int = None,
+               anomaly_rate: float = 0.01, seed: int = 42, meters_per_chunk: int = 50, months: int = None):
+    """Seed a synthetic fleet of meters with realistic geography and vectorized load curves"""
+    years = years or [2024, 2025]
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    periods = fleet_periods(years, months)
+    span = f"{months} months from {years[0]}" if months else f"years {years}"
+    print(f"🌱 Seeding fleet: {n_meters} meters, {span}, {workers} workers...")
+
+    rng = np.random.default_rng(seed)
+    departments, municipalities, localities = build_fleet_geography(rng)
+    meters = build_fleet_meters(n_meters, localities, rng)
+
+    db = SessionLocal()
+    try:
+        insert_fleet_metadata(db, departments, municipalities, localities,
+                              [{k: v for k, v in m.items() if k != "profile"} for m in meters])
+        print(f"✅ Geography: {len(departments)} departments, {len(municipalities)} municipalities, {len(localities)} localities")
+        print(f"✅ Medidores: {len(meters)}")
+    except Exception as e:
+        print(f"❌ Fleet metadata seeding failed: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    chunks = [
+        (i, meters[start:start + meters_per_chunk], periods, anomaly_rate, seed)
+        for i, start in enumerate(range(0, len(meters), meters_per_chunk))
+    ]
+
+    # Workers COPY straight into m_lecturas, so every partition of the seeded periods is created first
+    with engine.begin() as conn:
+        ensure_partitions(conn, periods[0][0], periods[-1][1])
+
+    start_time = time.perf_counter()
+    done_meters = generated = inserted = anomalies = 0
+    with multiprocessing.get_context("spawn").Pool(workers, initializer=_init_fleet_worker) as pool:
+        for n, g, ins, a in pool.imap_unordered(_seed_fleet_chunk, chunks):
+            done_meters += n
+            generated += g
+            inserted += ins
+            anomalies += a
+            elapsed = time.perf_counter() - start_time
+            print(f"    ✅ {done_meters}/{len(meters)} meters | {inserted} readings inserted | {generated / elapsed:,.0f} rows/s")
+
+    # COPY bypasses the repository, so the hourly/daily rollups are built afterwards and the
+    # baselines of the seeded years are flagged for a rebuild on next use
+    db = SessionLocal()
+    try:
+        repository = EnergyRepository(db)
+        device_ids = [m["deviceid"] for m in meters]
+        repository.refresh_rollups(device_ids)
+        print("✅ Rebuilt hourly/daily rollups")
+        repository.mark_baselines_stale(device_ids, sorted({p[0].year for p in periods}))
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"🎉 Fleet seeding completed: {inserted} readings inserted ({generated - inserted} already present), "
+          f"{anomalies} anomalous days injected, {elapsed:.1f}s")
+    return {"meters": len(meters), "generated": generated, "inserted": inserted, "anomalies": anomalies, "seconds": elapsed}
+
+
 def seed_database():
     """Main database seeding function"""
     print("🌱 Starting database seeding...")
@@ -210,4 +546,34 @@ def seed_database():
         db.close()
 
 if __name__ == "__main__":
-    seed_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Energy App database seeder")
+    parser.add_argument("--fleet", action="store_true", help="Generate a synthetic fleet instead of the sample data")
+    parser.add_argument("--meters", type=int, default=10000, help="Number of meters in the fleet")
+    parser.add_argument("--years", type=int, nargs="+", default=[2024, 2025], help="Years of 15-minute readings")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel COPY workers (default: CPUs - 1)")
+    parser.add_argument("--months", type=int, default=None, help="Only seed the first N months of the first year")
+    parser.add_argument("--anomaly-rate", type=float, default=0.01, help="Probability of an anomalous meter-day")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--refresh-rollups", action="store_true",
+                        help="Only rebuild the hourly/daily rollups of every meter (e.g. after external loads)")
+    parser.add_argument("--refresh-baselines", type=int, nargs="+", metavar="YEAR",
+                        help="Only refresh the baselines of these base years, recounting every meter's readings")
+    args = parser.parse_args()
+
+    if args.refresh_rollups:
+        db = SessionLocal()
+        try:
+            print(f"✅ Rebuilt rollups: {EnergyRepository(db).refresh_rollups()}")
+        finally:
+            db.close()
+    elif args.refresh_baselines:
+        db = SessionLocal()
+        try:
+            for year in args.refresh_baselines:
+                print(f"✅ Refreshed baselines: {EnergyRepository(db).refresh_baselines(year, verify=True)}")
+        finally:
+            db.close()
+    elif args.fleet:
+        seed_fleet(args.meters, args.years, args.workers, args.anomaly_rate, args.seed, months=args.months)
+    else:
+        seed_database()
\ No newline at end of file
@@ -40,15 +40,16 @@ def check_database_connection():
     return False
 
 def initialize_database():
-    """Initialize database tables"""
+    """Initialize database tables and m_lecturas partitions"""
     print("🗄️ Initializing database tables...")
     
-    from app.data.database import engine, Base
-    from app.data.models import Departamento, Municipio, Localidad, Medidor, MLectura
+    from app.data.database import engine
+    from app.data.partitions import setup_schema
     
     try:
-        # Create all tables
-        Base.metadata.create_all(bind=engine)
+        # Create all tables, the (deviceid, fecha) index and upcoming m_lecturas partitions
+        # (set LECTURAS_PARTITION_MIGRATE=true to convert an existing unpartitioned m_lecturas)
+        setup_schema(engine)
         print("✅ Database tables created successfully!")
         return True
     except Exception as e:
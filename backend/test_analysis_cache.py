@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Script para probar la caché de análisis de Gemini (clave por contenido, LRU, vencimiento y contadores)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import time
+from types import SimpleNamespace
+import pandas as pd
+from app.services.analysis_cache import AnalysisCache, analysis_cache_key
+from app.services.energy_service import EnergyService
+
+def print_result(name, obtained, expected):
+    status = "✅ PASS" if obtained == expected else "❌ FAIL"
+    print(f"{status} | {name}: {obtained} (esperado: {expected})")
+
+class FakeRepo:
+    """Nivel persistente en memoria con la misma interfaz del repositorio."""
+    def __init__(self):
+        self.rows = {}
+
+    def get_cached_analysis(self, clave):
+        return self.rows.get(clave)
+
+    def save_cached_analysis(self, clave, analysis, ttl_seconds, **meta):
+        self.rows[clave] = analysis
+
+class FallbackClient:
+    """Cliente de Gemini cuyo modelo principal falla y responde el alternativo."""
+    def __init__(self, primary_ok=False):
+        self.primary_ok = primary_ok
+        self.models = self
+
+    def generate_content(self, model, contents):
+        if model == EnergyService.GEMINI_MODEL_ID and not self.primary_ok:
+            raise RuntimeError("modelo no disponible")
+        return SimpleNamespace(text='{"resumen": "%s"}' % model)
+
+def main():
+    print("🚀 Prueba de la caché de análisis")
+    print("=" * 80)
+
+    curva = pd.DataFrame({'time_str': ['00:00', '00:15'], 'value': [1.0, 2.0], 'mean': [1.0, 1.5], 'std': [0.1, 0.2]})
+    key = analysis_cache_key('36075003', '2024-01-15', 2024, 'gemini-2.5-flash', curva, 'NORMAL')
+
+    # Clave por contenido
+    print_result("Misma entrada → misma clave", analysis_cache_key('36075003', '2024-01-15', 2024, 'gemini-2.5-flash', curva.copy(), 'NORMAL'), key)
+    print_result("Otro año base → otra clave", analysis_cache_key('36075003', '2024-01-15', 2023, 'gemini-2.5-flash', curva, 'NORMAL') != key, True)
+    print_result("Otro modelo → otra clave", analysis_cache_key('36075003', '2024-01-15', 2024, 'gemini-2.0-flash', curva, 'NORMAL') != key, True)
+    print_result("Otra curva → otra clave", analysis_cache_key('36075003', '2024-01-15', 2024, 'gemini-2.5-flash', curva.assign(value=[1.0, 2.5]), 'NORMAL') != key, True)
+
+    # Memoria: acierto, copia independiente y LRU
+    cache = AnalysisCache(capacity=2, ttl_seconds=60)
+    print_result("Fallo inicial", cache.get(key), None)
+    cache.put(key, {'resumen': 'ok', 'anomalias': []})
+    hit = cache.get(key)
+    print_result("Acierto en memoria", hit, {'resumen': 'ok', 'anomalias': []})
+    hit['anomalias'].append('modificado')
+    print_result("El valor guardado no se altera", cache.get(key)['anomalias'], [])
+
+    cache.put('b', {'resumen': 'b'})
+    cache.get(key)
+    cache.put('c', {'resumen': 'c'})
+    print_result("LRU desaloja la entrada menos usada", cache.get('b'), None)
+    print_result("La entrada usada recientemente permanece", cache.get(key) is not None, True)
+
+    # Vencimiento
+    cache = AnalysisCache(capacity=10, ttl_seconds=0.05)
+    cache.put(key, {'resumen': 'ok'})
+    time.sleep(0.1)
+    print_result("Entrada vencida", cache.get(key), None)
+
+    # Nivel persistente: un proceso nuevo encuentra el análisis en la tabla
+    repo = FakeRepo()
+    AnalysisCache().put(key, {'resumen': 'persistido'}, repo, deviceid='36075003', fecha='2024-01-15', base_year=2024, model_id='gemini-2.5-flash')
+    cache = AnalysisCache()
+    print_result("Acierto en la tabla", cache.get(key, repo), {'resumen': 'persistido'})
+    cache.get(key, repo)
+    stats = cache.stats()
+    print_result("Contadores (memoria, tabla, fallos)", (stats['memory_hits'], stats['db_hits'], stats['misses']), (1, 1, 0))
+
+    # Un análisis del modelo alternativo no se guarda con la clave del modelo principal
+    medidor = SimpleNamespace(description='Prueba', devicetype=None, customerid=None, usergroup=None)
+    cache, repo = AnalysisCache(), FakeRepo()
+    service = EnergyService(repo, genai_client=FallbackClient(), observers=[], analysis_cache=cache)
+    analysis = service._get_gemini_analysis('36075003', medidor, '2024-01-15', 'Monday', curva, 'NORMAL', 2024)
+    print_result("Responde el modelo alternativo", analysis.get('resumen'), EnergyService.GEMINI_FALLBACK_MODEL_ID)
+    print_result("Alternativo no se guarda en la caché", (cache.stats()['stores'], repo.rows), (0, {}))
+    service.genai_client = FallbackClient(primary_ok=True)
+    service._get_gemini_analysis('36075003', medidor, '2024-01-15', 'Monday', curva, 'NORMAL', 2024)
+    print_result("Principal se guarda en la caché", cache.stats()['stores'], 1)
+
+if __name__ == "__main__":
+    main()
@@ -48,7 +48,7 @@ def main():
     # Verificar que pide confirmación
     if result1.get('type') == 'confirmation_required':
         print("\n✅ CORRECTO: El sistema pidió confirmación antes de procesar")
-        print(f"⏱️  Tiempo estimado: {result1['parameters']['estimated_minutes']:.1f} minutos")
+        print(f"🕒 Trabajo en segundo plano: {result1['parameters']['background_job']}")
         print(f"📊 Total medidores: {result1['parameters']['total_medidores']}")
         print(f"📅 Días a analizar: {result1['parameters']['days']}")
         print(f"📆 Año base: {result1['parameters']['base_year']}")
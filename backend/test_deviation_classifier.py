@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+"""
+Script para probar el clasificador vectorizado de desviaciones (NORMAL / ALERTA / CRITICO)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from app.services.deviation_classifier import classify_device_days
+
+def print_result(name, obtained, expected):
+    status = "✅ PASS" if obtained == expected else "❌ FAIL"
+    print(f"{status} | {name}: {obtained} (esperado: {expected})")
+
+def main():
+    print("🚀 Prueba del clasificador vectorizado de desviaciones")
+    print("=" * 80)
+
+    # Un solo día-medidor
+    result = classify_device_days([10, 11, 9], [10, 10, 10])
+    print_result("Día normal (±10%)", result['estado'][0], 'NORMAL')
+
+    result = classify_device_days([10, 15], [10, 10])
+    print_result("Día en alerta (+50%)", result['estado'][0], 'ALERTA')
+
+    result = classify_device_days([10, 2], [10, 10])
+    print_result("Día crítico (-80%)", result['estado'][0], 'CRITICO')
+
+    # Semántica de media cero
+    result = classify_device_days([0, 0], [0, 0])
+    print_result("Media 0 y valor 0 → 0%", result['percentage_diff'].tolist(), [0.0, 0.0])
+
+    result = classify_device_days([1, 0], [0, 0])
+    print_result("Media 0 y valor > 0 → inf", result['estado'][0], 'CRITICO')
+
+    # Varios días-medidor en una sola llamada
+    actual = np.array([10, 15, 10, 2, 10, 10])
+    expected = np.full(6, 10.0)
+    groups = np.array([0, 0, 1, 1, 2, 2])
+    result = classify_device_days(actual, expected, group_index=groups, n_groups=3)
+    print_result("Estados por día-medidor", result['estado'].tolist(), ['ALERTA', 'CRITICO', 'NORMAL'])
+    print_result("Desviación máxima por día-medidor", result['max_deviation'].tolist(), [50.0, 80.0, 0.0])
+
+    # Escala: 10k días-medidor de 96 intervalos en una sola pasada
+    n_days = 10_000
+    rng = np.random.default_rng(42)
+    expected = rng.uniform(1, 5, n_days * 96)
+    actual = expected * rng.uniform(0.9, 1.1, n_days * 96)
+    groups = np.repeat(np.arange(n_days), 96)
+
+    import time
+    start = time.perf_counter()
+    result = classify_device_days(actual, expected, group_index=groups, n_groups=n_days)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print_result("10k días-medidor clasificados", len(result['estado']), n_days)
+    print(f"⏱️ Tiempo: {elapsed_ms:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""
+Script para probar el bus de eventos de los observadores (entrega en segundo plano, lotes, desbordamiento y errores)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import threading
+import time
+from app.services.event_bus import EventBus
+from app.services.observers import Observer, Subject
+
+def print_result(name, obtained, expected):
+    status = "✅ PASS" if obtained == expected else "❌ FAIL"
+    print(f"{status} | {name}: {obtained} (esperado: {expected})")
+
+class SlowSink(Observer):
+    """Sink que tarda `delay` segundos por entrega (correo, webhook...)."""
+    def __init__(self, delay=0.0, gate=None):
+        self.delay = delay
+        self.gate = gate
+        self.events = []
+        self.batches = 0
+
+    def update(self, event_type, data):
+        self.events.append(data['n'])
+
+    def update_batch(self, events):
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(self.delay)
+        self.batches += 1
+        super().update_batch(events)
+
+class FailingSink(Observer):
+    def update(self, event_type, data):
+        raise RuntimeError("sink caído")
+
+class LegacySink:
+    """Observador sin update_batch (solo update)."""
+    def __init__(self):
+        self.events = []
+
+    def update(self, event_type, data):
+        self.events.append(data['n'])
+
+def main():
+    print("🚀 Prueba del bus de eventos")
+    print("=" * 80)
+
+    # notify retorna sin esperar al sink lento; el sink recibe los eventos en lotes y en orden
+    bus = EventBus(capacity=1000, workers=1, batch_size=50)
+    slow, failing, legacy = SlowSink(delay=0.05), FailingSink(), LegacySink()
+    subject = Subject(event_bus=bus)
+    for observer in (slow, failing, legacy):
+        subject.attach(observer)
+    start = time.perf_counter()
+    for n in range(200):
+        subject.notify("ANALYSIS_DONE", {'n': n})
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print_result("notify no espera al sink", elapsed_ms < 50, True)
+    print_result("Entrega completa", bus.flush(timeout=10), True)
+    print_result("Orden de entrega", slow.events == list(range(200)), True)
+    print_result("Menos lotes que eventos", slow.batches < 200, True)
+    print_result("Observador sin update_batch", len(legacy.events), 200)
+    stats = bus.stats()
+    print_result("Errores contados por sink", (stats['sinks']['FailingSink']['failed'], stats['sinks']['SlowSink']['failed']), (200, 0))
+    print(f"⏱️ 200 notify: {elapsed_ms:.2f} ms, lotes: {slow.batches}, latencia media: {stats['avg_delivery_ms']} ms")
+    bus.shutdown()
+
+    # Cola llena: drop_new rechaza los nuevos (5 aceptados), drop_oldest acepta todos y descarta los antiguos
+    for policy, expected, expected_accepted in (('drop_new', list(range(6)), 5),
+                                                ('drop_oldest', [0] + list(range(15, 20)), 19)):
+        gate = threading.Event()
+        bus = EventBus(capacity=5, workers=1, batch_size=1, overflow=policy)
+        sink = SlowSink(gate=gate)
+        bus.publish("E", {'n': 0}, [sink])
+        time.sleep(0.05)  # El primer evento queda en despacho, bloqueado en el sink
+        aceptados = sum(bus.publish("E", {'n': n}, [sink]) for n in range(1, 20))
+        gate.set()
+        bus.flush(timeout=5)
+        print_result(f"{policy}: publicaciones aceptadas", aceptados, expected_accepted)
+        print_result(f"{policy}: eventos entregados", sink.events, expected)
+        print_result(f"{policy}: descartados", bus.stats()['dropped'], 14)
+        bus.shutdown()
+
+    # block: contrapresión acotada por block_seconds
+    gate = threading.Event()
+    bus = EventBus(capacity=1, workers=1, batch_size=1, overflow='block', block_seconds=0.1)
+    sink = SlowSink(gate=gate)
+    bus.publish("E", {'n': 0}, [sink])
+    time.sleep(0.05)
+    bus.publish("E", {'n': 1}, [sink])
+    start = time.perf_counter()
+    aceptado = bus.publish("E", {'n': 2}, [sink])
+    print_result("block: espera y descarta", (aceptado, round(time.perf_counter() - start, 1)), (False, 0.1))
+    gate.set()
+    bus.shutdown()
+    print_result("shutdown entrega lo pendiente", sink.events, [0, 1])
+
+    # Tras shutdown el bus está cerrado: publish rechaza el evento y lo cuenta como descartado
+    descartados = bus.stats()['dropped']
+    aceptado = bus.publish("E", {'n': 3}, [sink])
+    print_result("publish tras shutdown", (aceptado, bus.stats()['dropped'] - descartados, sink.events), (False, 1, [0, 1]))
+
+    # publish concurrente con shutdown: todo evento aceptado se entrega
+    bus = EventBus(capacity=10000, workers=2, batch_size=10)
+    sink = SlowSink()
+    aceptados = []
+
+    def publisher(base):
+        for n in range(base, base + 2000):
+            if bus.publish("E", {'n': n}, [sink]):
+                aceptados.append(n)
+
+    threads = [threading.Thread(target=publisher, args=(base,)) for base in (0, 10000, 20000, 30000)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.005)
+    bus.shutdown()
+    for thread in threads:
+        thread.join()
+    stats = bus.stats()
+    print_result("shutdown concurrente: aceptados entregados", sorted(sink.events) == sorted(aceptados), True)
+    print_result("shutdown concurrente: sin pendientes", stats['pending'], 0)
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from app.data.database import SessionLocal
 from app.data.repositories import EnergyRepository
+from app.services.meter_registry import meter_registry
 
 def test_localidades(repo):
     print("\n" + "="*80)
@@ -86,15 +87,16 @@ def test_search_general(repo):
     
     for term in search_terms:
         print(f"\n🔍 Buscando: '{term}'")
-        medidores = repo.search_medidores(term)
-        print(f"   Resultados encontrados: {len(medidores)}")
+        resultados = meter_registry.search(term)
+        print(f"   Resultados encontrados: {resultados.total}")
         
-        if medidores:
-            for m in medidores[:3]:  # Mostrar máximo 3
-                localidad = m.localidad.localidad if m.localidad else "N/A"
-                municipio = m.localidad.municipio.municipio if m.localidad and m.localidad.municipio else "N/A"
-                print(f"   • {m.deviceid} - {m.description}")
-                print(f"     Localidad: {localidad}, Municipio: {municipio}")
+        for hit in resultados.hits[:3]:  # Mostrar máximo 3
+            m = hit.medidor
+            localidad = meter_registry.localidad(m.id_loc)
+            municipio = meter_registry.municipio(localidad.id_mun) if localidad else None
+            print(f"   • {m.deviceid} - {m.description} (relevancia {hit.score}, campo {hit.match})")
+            print(f"     Localidad: {localidad.localidad if localidad else 'N/A'}, "
+                  f"Municipio: {municipio.municipio if municipio and municipio.municipio else 'N/A'}")
 
 def main():
     print("🚀 Iniciando pruebas de búsqueda geográfica")
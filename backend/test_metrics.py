@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Script para probar las métricas por etapa (histogramas en formato Prometheus y encabezado Server-Timing)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.core.metrics import MetricsMiddleware, MetricsRegistry, TimedAPIRouter, metrics, stage
+
+def print_result(name, obtained, expected):
+    status = "✅ PASS" if obtained == expected else "❌ FAIL"
+    print(f"{status} | {name}: {obtained} (esperado: {expected})")
+
+def main():
+    print("🚀 Prueba de métricas por etapa")
+    print("=" * 80)
+
+    # Histograma: límites acumulados, suma y total
+    registry = MetricsRegistry()
+    histogram = registry.histogram('prueba_seconds', 'Prueba', ('endpoint',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(value, '/x')
+    lines = registry.render().splitlines()
+    print_result("Bucket 0.1", 'prueba_seconds_bucket{endpoint="/x",le="0.1"} 1' in lines, True)
+    print_result("Bucket 1", 'prueba_seconds_bucket{endpoint="/x",le="1"} 2' in lines, True)
+    print_result("Bucket +Inf", 'prueba_seconds_bucket{endpoint="/x",le="+Inf"} 3' in lines, True)
+    print_result("Total", 'prueba_seconds_count{endpoint="/x"} 3' in lines, True)
+
+    # Etapas de una solicitud: Server-Timing y series por endpoint (plantilla de la ruta)
+    router = TimedAPIRouter()
+
+    @router.get("/items/{item_id}")
+    def get_item(item_id: int):
+        with stage('db_fetch'):
+            time.sleep(0.02)
+        with stage('classify'):
+            pass
+        return {"item_id": item_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app)
+
+    response = client.get("/items/7")
+    server_timing = response.headers.get("server-timing", "")
+    print(f"Server-Timing: {server_timing}")
+    print_result("Respuesta del endpoint", response.json(), {"item_id": 7})
+    print_result("Etapas en Server-Timing", [part.split(';')[0] for part in server_timing.split(', ')],
+                 ['db_fetch', 'classify', 'serialize', 'total'])
+    db_ms = float(server_timing.split(', ')[0].split('dur=')[1])
+    print_result("Duración de db_fetch >= 20 ms", db_ms >= 20, True)
+
+    text = metrics.render()
+    print_result("Serie por plantilla de ruta",
+                 'energyapp_stage_duration_seconds_count{endpoint="/items/{item_id}",stage="db_fetch"} 1' in text, True)
+    print_result("Solicitud contada",
+                 'energyapp_requests_total{endpoint="/items/{item_id}",method="GET",status="200"} 1' in text, True)
+
+    # Fuera de una solicitud las etapas se registran como 'background'
+    with stage('baseline'):
+        pass
+    print_result("Etapa en segundo plano",
+                 'energyapp_stage_duration_seconds_count{endpoint="background",stage="baseline"} 1' in metrics.render(), True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Script para probar el índice de búsqueda de medidores y lugares (sin tildes, aproximado y por relevancia)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import time
+from app.services.meter_registry import (
+    DepartamentoRecord, LocalidadRecord, MeterRecord, MunicipioRecord, RegistrySnapshot
+)
+from app.services.search_index import SearchIndex, fold
+
+def print_result(name, obtained, expected):
+    status = "✅ PASS" if obtained == expected else "❌ FAIL"
+    print(f"{status} | {name}: {obtained} (esperado: {expected})")
+
+def meter(deviceid, id_loc, description):
+    return MeterRecord(deviceid, id_loc, 'Smart', description, None, None, None, None, None, None, None, None, None, None, None)
+
+def build_snapshot(n_extra=0):
+    medidores = [
+        meter('36075003', '9400101', 'Medidor Centro'),
+        meter('36075004', '9400102', 'Medidor Caño Vitina'),
+        meter('12345678', '0500101', 'Medidor Medellín Centro'),
+    ]
+    medidores += [meter(f"7{i:07d}", '0500101', f"Medidor {i}") for i in range(n_extra)]
+    localidades = [
+        LocalidadRecord('9400101', '94001', 'Inírida Centro', None, None, None, None),
+        LocalidadRecord('9400102', '94001', 'Caño Vitina', None, None, None, None),
+        LocalidadRecord('0500101', '05001', 'Medellín Centro', None, None, None, None),
+    ]
+    municipios = [MunicipioRecord('94001', '94', 'Inírida'), MunicipioRecord('05001', '05', 'Medellín')]
+    departamentos = [DepartamentoRecord('94', 'Guainía'), DepartamentoRecord('05', 'Antioquia')]
+    return RegistrySnapshot(medidores, localidades, municipios, departamentos)
+
+def ids(results):
+    return [hit.medidor.deviceid for hit in results.hits]
+
+def main():
+    print("🚀 Prueba del índice de búsqueda")
+    print("=" * 80)
+
+    print_result("Normalización", fold("Inírida  Caño-Vitina"), "inirida cano vitina")
+
+    index = SearchIndex(build_snapshot())
+
+    # Tildes y mayúsculas
+    print_result("'Inirida' sin tilde", ids(index.search("Inirida")), ['36075003', '36075004'])
+    print_result("'GUAINIA' en mayúsculas", index.search("GUAINIA").total, 2)
+    print_result("'cano' encuentra 'Caño'", ids(index.search("cano")), ['36075004'])
+
+    # Relevancia: id exacto antes que coincidencias en descripción o lugar
+    result = index.search("36075003")
+    print_result("Id exacto primero", (ids(result)[0], result.hits[0].score, result.hits[0].match), ('36075003', 1.0, 'deviceid'))
+    result = index.search("centro")
+    print_result("Localidad 'Centro' antes que descripción", result.hits[0].match, 'localidad')
+
+    # Errores de escritura
+    print_result("'Inrida' aproximado", ids(index.search("Inrida")), ['36075003', '36075004'])
+    print_result("Sin coincidencias", index.search("zzzz").total, 0)
+
+    # Lugares
+    places = index.search_places("medellin", 'municipio')
+    print_result("Municipio 'medellin'", [hit.record.municipio for hit in places], ['Medellín'])
+
+    # Paginación y escala
+    index = SearchIndex(build_snapshot(n_extra=50_000))
+    start = time.perf_counter()
+    result = index.search("medellin", limit=20, offset=20)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print_result("Total 'medellin' en 50k medidores", result.total, 50_001)
+    print_result("Página de 20", len(result.hits), 20)
+    print(f"⏱️ Tiempo: {elapsed_ms:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,8 @@ const EnergyChatbot: React.FC<EnergyChatbotProps> = ({ context, onParametersExtr
   const [isOpen, setIsOpen] = useState(false);
   const [isVisible, setIsVisible] = useState(true);
   const chatEndRef = useRef<HTMLDivElement>(null);
+  // Sesión del backend (confirmación pendiente y última consulta): se envía en cada mensaje
+  const sessionIdRef = useRef<string | null>(null);
 
   // Cargar estado de visibilidad desde localStorage al iniciar
   useEffect(() => {
@@ -59,9 +61,12 @@ const EnergyChatbot: React.FC<EnergyChatbotProps> = ({ context, onParametersExtr
       const res = await fetch('http://localhost:8000/chat', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: msg, context }),
+        body: JSON.stringify({ message: msg, context, session_id: sessionIdRef.current }),
       });
       const data = await res.json();
+      if (data.session_id) {
+        sessionIdRef.current = data.session_id;
+      }
       console.log('🔍 [CHATBOT] Full response from backend:', data);
 
       // Handle the new response structure with parameters
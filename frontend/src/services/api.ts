@@ -18,10 +18,58 @@ export interface OutlierResponse {
   outliers: OutlierResult[];
 }
 
+// Estado de un trabajo en segundo plano (/jobs/{job_id})
+export interface JobStatus {
+  job_id: string;
+  status: 'pendiente' | 'en_curso' | 'completado' | 'cancelado' | 'error' | 'interrumpido';
+  processed: number;
+  total: number | null;
+  progress: number;
+  anomalies: number;
+  error: string | null;
+}
+
+const JOB_ACTIVE_STATES = ['pendiente', 'en_curso'];
+
+/**
+ * Consulta /jobs/{job_id} (con espera creciente, hasta 5 s) hasta que el trabajo termina
+ * y retorna su resultado desde /jobs/{job_id}/result.
+ */
+const waitForOutlierJob = async (
+  job: JobStatus,
+  onProgress?: (job: JobStatus) => void
+): Promise<OutlierResponse> => {
+  let delay = 1000;
+  while (JOB_ACTIVE_STATES.includes(job.status)) {
+    onProgress?.(job);
+    await new Promise(resolve => setTimeout(resolve, delay));
+    delay = Math.min(delay * 2, 5000);
+    const response = await fetch(`${BASE_URL}/jobs/${job.job_id}`);
+    if (!response.ok) {
+      throw new Error('Error al consultar el progreso de la búsqueda de anomalías');
+    }
+    job = await response.json();
+  }
+  if (job.status !== 'completado') {
+    throw new Error(job.error || `La búsqueda de anomalías terminó con estado ${job.status}`);
+  }
+  const response = await fetch(`${BASE_URL}/jobs/${job.job_id}/result`);
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.detail || 'Error al obtener el resultado de la búsqueda de anomalías');
+  }
+  return response.json();
+};
+
 /**
  * Busca medidores con desviaciones mayores al umbral en el rango de fechas dado.
+ * Si la búsqueda no termina de inmediato el backend responde 202 con el trabajo
+ * y se sigue su progreso hasta obtener el resultado.
  */
-export const analyzeOutliers = async (payload: OutlierRequest): Promise<OutlierResponse> => {
+export const analyzeOutliers = async (
+  payload: OutlierRequest,
+  onProgress?: (job: JobStatus) => void
+): Promise<OutlierResponse> => {
   const response = await fetch(`${BASE_URL}/analyze-outliers`, {
     method: 'POST',
     headers: {
@@ -33,6 +81,9 @@ export const analyzeOutliers = async (payload: OutlierRequest): Promise<OutlierR
     const error = await response.json();
     throw new Error(error.detail || 'Error en el análisis de outliers');
   }
+  if (response.status === 202) {
+    return waitForOutlierJob(await response.json(), onProgress);
+  }
   return response.json();
 };
 // Definición de Tipos para las Respuestas del Backend